@@ -0,0 +1,11 @@
+"""
+Puts the Python worker modules (crm-app/src/workers/python) on sys.path, so
+scripts in this folder can reuse them (`import _workers_path` before the
+worker imports). Scripts are run directly, e.g. `python scripts/sync_ads_incremental.py`.
+"""
+import os
+import sys
+
+WORKERS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src', 'workers', 'python'))
+if WORKERS_DIR not in sys.path:
+    sys.path.insert(0, WORKERS_DIR)
@@ -12,6 +12,9 @@ import psycopg2
 from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 
+import _workers_path  # noqa: F401 (worker modules on sys.path)
+from keyword_matcher import get_matcher
+
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env.local'))
 
 ACCESS_TOKEN = os.getenv('FB_ACCESS_TOKEN')
@@ -379,6 +382,13 @@ def sync_daily_metrics(conn, cur):
         
     print(f"✅ Upserted {upserted_metrics} Daily Metrics.")
 
+CATEGORY_LABELS = {
+    'sushi': '🍣 Sushi',
+    'ramen': '🍜 Ramen',
+    'dimsum': '🥟 Dimsum',
+    'kids_camp': '🧒 Kids Camp',
+}
+
 def check_and_send_daily_summary(cur):
     now = datetime.now()
     if now.hour < 9:
@@ -445,6 +455,7 @@ def check_and_send_daily_summary(cur):
     
     total_spend = 0.0
     total_leads = 0
+    ad_categories = get_matcher('ad_categories')  # keywords: event_keywords.json
     
     for row in rows:
         ad_name, camp_name, spend, leads = row
@@ -453,16 +464,8 @@ def check_and_send_daily_summary(cur):
         total_spend += spend
         total_leads += leads
         
-        lower_name = f"{ad_name} {camp_name}".lower()
-        cat_key = '🌐 Other'
-        if 'sushi' in lower_name or 'ซูชิ' in lower_name:
-            cat_key = '🍣 Sushi'
-        elif 'ramen' in lower_name or 'ราเมน' in lower_name:
-            cat_key = '🍜 Ramen'
-        elif 'dimsum' in lower_name or 'ติ่มซำ' in lower_name:
-            cat_key = '🥟 Dimsum'
-        elif 'kids' in lower_name or 'เด็ก' in lower_name or 'camp' in lower_name:
-            cat_key = '🧒 Kids Camp'
+        category = ad_categories.first_category(f"{ad_name} {camp_name}")
+        cat_key = CATEGORY_LABELS.get(category, '🌐 Other')
             
         categories[cat_key]['spend'] += spend
         categories[cat_key]['leads'] += leads
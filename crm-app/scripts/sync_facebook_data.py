@@ -5,6 +5,9 @@ import shutil
 from datetime import datetime
 from dotenv import load_dotenv
 
+import _workers_path  # noqa: F401 (worker modules on sys.path)
+from change_journal import record_change
+
 # Load environment variables
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env.local'))
 
@@ -151,6 +154,7 @@ def process_customer(conversation):
     chat_file = os.path.join(chat_dir, f"conv_{conversation['id']}.json")
     with open(chat_file, 'w', encoding='utf-8') as f:
         json.dump({"data": messages}, f, indent=4, ensure_ascii=False)
+    record_change('chat', customer=folder_name, conversation=conversation['id'])
         
     # 3. Download Assets
     assets_dir = os.path.join(customer_dir, 'assets')
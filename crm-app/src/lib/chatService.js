@@ -5,6 +5,8 @@ import BusinessAnalyst from '../utils/BusinessAnalyst.js';
 import { getAllEmployees } from './db.js';
 
 const DATA_DIR = path.join(process.cwd(), 'cache', 'customer');
+// Same file as the Python workers' change_journal.py (read by the hourly behavior audit)
+const CHANGE_JOURNAL_PATH = process.env.CHANGE_JOURNAL_PATH || path.join(process.cwd(), 'cache', 'change_journal.jsonl');
 const PAGE_ACCESS_TOKEN = process.env.FB_PAGE_ACCESS_TOKEN;
 
 /**
@@ -409,6 +411,13 @@ async function saveChatToCache(conversationId, messages) {
                     existing.updated_time = new Date().toISOString();
                     fs.writeFileSync(convFile, JSON.stringify(existing, null, 4));
                     console.log(`[ChatService] Cached ${messages.length} messages for ${conversationId}`);
+                    try {
+                        fs.appendFileSync(CHANGE_JOURNAL_PATH, JSON.stringify({
+                            t: Date.now() / 1000, event: 'chat', customer: folder, conversation: conversationId
+                        }) + '\n');
+                    } catch (e) {
+                        console.warn('[ChatService] Change journal write failed:', e.message);
+                    }
                     return;
                 } catch (e) {
                     console.error('Cache Write Error:', e);
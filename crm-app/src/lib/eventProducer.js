@@ -1,10 +1,24 @@
 
 import { Queue } from 'bullmq';
 import IORedis from 'ioredis';
+import fs from 'fs';
+import path from 'path';
 import { checkRedisConnection } from './queueCheck';
 
 const REDIS_URL = process.env.REDIS_URL || 'redis://localhost:6379';
 
+// Same keyword file and rules as the Python worker (event_priority.py)
+const KEYWORDS_PATH = path.join(process.cwd(), 'src', 'workers', 'python', 'event_keywords.json');
+let buyIntentKeywords = [];
+try {
+    buyIntentKeywords = JSON.parse(fs.readFileSync(KEYWORDS_PATH, 'utf-8')).buy_intent || [];
+} catch (err) {
+    console.warn(`[Queue] Could not load ${KEYWORDS_PATH}: ${err.message}. All events use the general lane.`);
+}
+
+// BullMQ serves lower numbers first
+const LANE_PRIORITY = { slip: 1, buy_intent: 2, general: 3 };
+
 // Singleton Queue Instance to avoid creating multiple connections
 let eventQueue;
 
@@ -22,6 +36,18 @@ function getQueue() {
     return eventQueue;
 }
 
+/**
+ * Cheap pre-classification so payment slips and buy-intent messages jump the queue.
+ * @param {Object} eventData - The raw event payload from Facebook
+ * @returns {'slip'|'buy_intent'|'general'}
+ */
+export function classifyEvent(eventData) {
+    if ((eventData.attachments || []).some(a => a?.type === 'image')) return 'slip';
+    const text = String(eventData.message || '').toLowerCase();
+    if (buyIntentKeywords.some(k => text.includes(k))) return 'buy_intent';
+    return 'general';
+}
+
 /**
  * Adds a Facebook Event to the processing queue.
  * @param {Object} eventData - The raw event payload from Facebook
@@ -37,11 +63,13 @@ export async function produceEvent(eventData) {
         // }
 
         const queue = getQueue();
+        const lane = classifyEvent(eventData);
         await queue.add('process-message', eventData, {
+            priority: LANE_PRIORITY[lane],
             removeOnComplete: 100, // Keep last 100 completed jobs
             removeOnFail: 500      // Keep last 500 failed jobs for debugging
         });
-        console.log(`[Queue] Added job for customer: ${eventData.sender?.id || 'Unknown'}`);
+        console.log(`[Queue] Added ${lane} job for customer: ${eventData.sender?.id || 'Unknown'}`);
         return true;
     } catch (error) {
         console.error('Failed to add job to queue:', error);
@@ -0,0 +1,235 @@
+"""
+V-School Approximate Nearest-Neighbour Index (IVF-Flat)
+───────────────────────────────────────────────────────
+Pure NumPy inverted-file index for cosine similarity over normalized vectors:
+  - train: spherical k-means picks `nlist` centroids (~sqrt(N))
+  - add:   each vector goes to the inverted list of its nearest centroid;
+           inserts are incremental (no retrain needed)
+  - search: score the `nprobe` closest lists only, exact dot products inside
+
+Used by knowledge_base.search_knowledge for large indexes and meant for
+similar-chat lookup over conversation embeddings (`chat_embeddings`).
+Vectors added before there is enough data to train are searched exactly.
+
+  python ann_index.py   # synthetic benchmark: latency + recall@k vs exact scan
+"""
+
+import os
+import math
+import time
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+DEFAULT_NPROBE = int(os.getenv('ANN_NPROBE', '8'))
+TRAIN_MIN_VECTORS = int(os.getenv('ANN_TRAIN_MIN', '2048'))  # below this, search stays exact
+RETRAIN_GROWTH = 4  # auto nlist: retrain once the index has grown 4x (sqrt(N) doubled)
+KMEANS_ITERS = 12
+KMEANS_SAMPLE_PER_LIST = 64
+
+
+def _normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _top_k(scores, k):
+    k = min(k, len(scores))
+    if k <= 0: return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    return top[np.argsort(-scores[top])]
+
+
+class IVFIndex:
+    def __init__(self, dim, nlist=None, nprobe=DEFAULT_NPROBE, train_min=TRAIN_MIN_VECTORS):
+        if not HAS_NUMPY:
+            raise RuntimeError("ann_index requires numpy")
+        self.dim = dim
+        self.nlist = nlist          # None -> ~sqrt(N) at training time
+        self.nprobe = nprobe
+        self.train_min = train_min
+        self.ids = []               # external id per internal position
+        self.centroids = None
+        self._trained_size = 0
+        self._pending = []          # (positions, vectors) added before training
+        self._list_vecs = []        # per list: (n_i, dim) float32
+        self._list_pos = []         # per list: (n_i,) internal positions
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    # ─── Build ─────────────────────────────────────────────
+
+    def add(self, vectors, ids=None):
+        """Add vectors (normalized here). `ids` default to their insertion positions."""
+        vectors = _normalize_rows(vectors)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"dimension mismatch: {vectors.shape[1]} != {self.dim}")
+        start = len(self.ids)
+        positions = np.arange(start, start + len(vectors), dtype=np.int64)
+        self.ids.extend(ids if ids is not None else positions.tolist())
+
+        if self.trained:
+            self._assign(vectors, positions)
+            if self.nlist is None and len(self.ids) >= RETRAIN_GROWTH * self._trained_size:
+                self.train()  # keep nlist ~ sqrt(N) as the index grows
+        else:
+            self._pending.append((positions, vectors))
+            if len(self.ids) >= self.train_min:
+                self.train()
+
+    def train(self, seed=0):
+        """(Re)train centroids on everything added so far and rebuild the lists."""
+        positions, vectors = self._all()
+        if not len(vectors): return
+        nlist = self.nlist or max(1, int(math.sqrt(len(vectors))))
+        nlist = min(nlist, len(vectors))
+
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(vectors), nlist * KMEANS_SAMPLE_PER_LIST)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(KMEANS_ITERS):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            empty = np.bincount(assign, minlength=nlist) == 0
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]  # re-seed dead lists
+            centroids = _normalize_rows(sums)
+
+        self.centroids = centroids
+        self._trained_size = len(vectors)
+        self._pending = []
+        self._list_vecs = [np.empty((0, self.dim), dtype=np.float32) for _ in range(nlist)]
+        self._list_pos = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+        self._assign(vectors, positions)
+
+    def _assign(self, vectors, positions):
+        lists = np.argmax(vectors @ self.centroids.T, axis=1)
+        for c in np.unique(lists):
+            mask = lists == c
+            self._list_vecs[c] = np.concatenate([self._list_vecs[c], vectors[mask]])
+            self._list_pos[c] = np.concatenate([self._list_pos[c], positions[mask]])
+
+    def _all(self):
+        parts = self._pending if not self.trained else list(zip(self._list_pos, self._list_vecs))
+        if not parts:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.dim), dtype=np.float32)
+        return np.concatenate([p for p, _ in parts]), np.concatenate([v for _, v in parts])
+
+    # ─── Search ────────────────────────────────────────────
+
+    def search(self, query, k=10, nprobe=None):
+        """[(score, id), ...] best first, scanning the `nprobe` nearest lists."""
+        if not self.trained:
+            return self.exact_search(query, k)
+        q = _normalize_rows(query)[0]
+        probe = _top_k(self.centroids @ q, nprobe or self.nprobe)
+        vecs = [self._list_vecs[c] for c in probe if len(self._list_pos[c])]
+        if not vecs: return []
+        pos = np.concatenate([self._list_pos[c] for c in probe if len(self._list_pos[c])])
+        scores = np.concatenate([v @ q for v in vecs])
+        return [(float(scores[i]), self.ids[pos[i]]) for i in _top_k(scores, k)]
+
+    def exact_search(self, query, k=10):
+        """Brute-force reference scan over every vector."""
+        positions, vectors = self._all()
+        if not len(positions): return []
+        scores = vectors @ _normalize_rows(query)[0]
+        return [(float(scores[i]), self.ids[positions[i]]) for i in _top_k(scores, k)]
+
+    def recall_at_k(self, queries, k=10, nprobe=None):
+        """Mean fraction of the exact top-k that the ANN search returns."""
+        total = 0.0
+        for q in queries:
+            exact = {i for _, i in self.exact_search(q, k)}
+            if not exact: continue
+            approx = {i for _, i in self.search(q, k, nprobe)}
+            total += len(exact & approx) / len(exact)
+        return total / max(1, len(queries))
+
+    # ─── Persistence ───────────────────────────────────────
+
+    def save(self, path):
+        """Atomic save to a .npz file."""
+        positions, vectors = self._all()
+        sizes = [len(p) for p in self._list_pos] if self.trained else []
+        tmp = f"{path}.tmp.npz"
+        np.savez(tmp,
+                 config=np.array([self.dim, self.nlist or 0, self.nprobe, self.train_min, self._trained_size],
+                                 dtype=np.int64),
+                 centroids=self.centroids if self.trained else np.empty((0, self.dim), dtype=np.float32),
+                 sizes=np.array(sizes, dtype=np.int64),
+                 positions=positions, vectors=vectors,
+                 ids=np.array([str(i) for i in self.ids]),
+                 int_ids=np.array(all(isinstance(i, (int, np.integer)) for i in self.ids)))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            dim, nlist, nprobe, train_min, trained_size = (int(x) for x in data['config'])
+            index = cls(dim, nlist or None, nprobe, train_min)
+            index._trained_size = trained_size
+            ids = data['ids'].tolist()
+            index.ids = [int(i) for i in ids] if bool(data['int_ids']) else ids
+            positions, vectors = data['positions'], data['vectors'].astype(np.float32)
+            if len(data['centroids']):
+                index.centroids = data['centroids'].astype(np.float32)
+                offsets = np.concatenate([[0], np.cumsum(data['sizes'])])
+                index._list_vecs = [vectors[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+                index._list_pos = [positions[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+            elif len(positions):
+                index._pending = [(positions, vectors)]
+        return index
+
+
+def load_or_create(path, dim, **kwargs):
+    """Open a persisted index (e.g. chat embeddings), or start an empty one."""
+    if os.path.exists(path):
+        try:
+            index = IVFIndex.load(path)
+            if index.dim == dim:
+                return index
+            print(f"[ANN] {path} has dim {index.dim}, expected {dim}; starting fresh")
+        except Exception as e:
+            print(f"[ANN] Load Error {path}: {e}")
+    return IVFIndex(dim, **kwargs)
+
+
+if __name__ == "__main__":
+    # Synthetic benchmark: clustered vectors, like topic-grouped chat embeddings
+    n, dim, k = 100_000, 768, 10
+    rng = np.random.default_rng(42)
+    centers = rng.standard_normal((500, dim)).astype(np.float32)
+    data = centers[rng.integers(0, 500, n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    queries = data[rng.choice(n, 100, replace=False)] + 0.1 * rng.standard_normal((100, dim)).astype(np.float32)
+
+    t = time.perf_counter()
+    index = IVFIndex(dim)
+    for chunk in range(0, n, 10_000):
+        index.add(data[chunk:chunk + 10_000])
+    print(f"Build: {n} x {dim} in {time.perf_counter() - t:.1f}s ({len(index.centroids)} lists)")
+
+    for nprobe in (4, 8, 16):
+        t = time.perf_counter()
+        for q in queries:
+            index.search(q, k, nprobe)
+        ann_ms = (time.perf_counter() - t) * 1000 / len(queries)
+        print(f"nprobe={nprobe:<3} {ann_ms:.2f} ms/query  recall@{k}={index.recall_at_k(queries[:20], k, nprobe):.3f}")
+
+    t = time.perf_counter()
+    for q in queries[:20]:
+        index.exact_search(q, k)
+    print(f"exact      {(time.perf_counter() - t) * 1000 / 20:.2f} ms/query")
@@ -9,13 +9,13 @@ Handles contextual response generation based on:
 
 import os
 import json
-from google import genai
+from gemini_client import get_client
 from dotenv import load_dotenv
 
 load_dotenv()
 
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-# genai configuration removed
+# Gemini client is shared per process (gemini_client.get_client)
 
 # Simplified Course Catalog / FAQ for RAG (Initial Version)
 SCHOOL_KNOWLEDGE = {
@@ -29,47 +29,65 @@ SCHOOL_KNOWLEDGE = {
     "contact": "Phone: 02-123-4567 | Line: @vschool"
 }
 
-from knowledge_base import search_knowledge
+from knowledge_base import search_knowledge, is_relevant
 
-def generate_auto_reply(sender_id, messages, intelligence):
+def get_last_user_message(sender_id, messages):
+    """Newest message text from the customer (messages are newest first)."""
+    return next((m.get('message', '') for m in messages if m.get('from', {}).get('id') == sender_id), None)
+
+def format_kb_context(kb_results):
+    """Answers above the relevance cut-off, one per line."""
+    # Cosine gate, or the BM25 gate for lexical-only hits; the fused score only orders them
+    return "\n".join([f"- {r['original']['answer']}" for r in kb_results or [] if is_relevant(r)])
+
+def should_auto_reply(sender_id, messages, intelligence):
+    """
+    Guardrails: Don't auto-reply if:
+    1. Score is too low (unclear intent)
+    2. Intent is 'Complaint' (needs human manager)
+    3. Last message was from the business (staff already intervening)
+    """
+    intent = intelligence.get('intent', 'Question')
+    score = intelligence.get('score', 0)
+
+    if score < 40 and intent != 'Greeting':
+        print(f"[Auto-Reply] Score too low ({score}). Skipping.")
+        return False
+    
+    if intent == 'Complaint':
+        print(f"[Auto-Reply] Intent is 'Complaint'. Escalating to human.")
+        return False
+
+    if messages and messages[0].get('from', {}).get('id') != sender_id:
+        print(f"[Auto-Reply] Last message was from staff. Skipping.")
+        return False
+    return True
+
+def generate_auto_reply(sender_id, messages, intelligence, kb_results=None):
     """
     Generates a contextual reply using Gemini Pro with RAG.
+    `kb_results` may be pre-fetched by the caller (search_knowledge for the
+    last user message); otherwise the search runs here.
     """
     if not GEMINI_API_KEY:
         return None
 
-    last_user_message = next((m.get('message', '') for m in messages if m.get('from', {}).get('id') == sender_id), None)
+    last_user_message = get_last_user_message(sender_id, messages)
     
     # RAG: Retrieve knowledge for the query
-    context_text = ""
-    if last_user_message:
+    if last_user_message and kb_results is None:
         kb_results = search_knowledge(last_user_message, top_k=2)
-        if kb_results:
-            context_text = "\n".join([f"- {r['original']['answer']}" for r in kb_results if r['score'] > 0.6])
+    context_text = format_kb_context(kb_results)
 
     intent = intelligence.get('intent', 'Question')
     score = intelligence.get('score', 0)
     interest = intelligence.get('main_interest', 'General')
 
-    # Guardrails: Don't auto-reply if:
-    # 1. Score is too low (unclear intent)
-    # 2. Intent is 'Complaint' (needs human manager)
-    # 3. Last message was from the business (staff already intervening)
-    
-    if score < 40 and intent != 'Greeting':
-        print(f"[Auto-Reply] Score too low ({score}). Skipping.")
-        return None
-    
-    if intent == 'Complaint':
-        print(f"[Auto-Reply] Intent is 'Complaint'. Escalating to human.")
-        return None
-
-    if messages and messages[0].get('from', {}).get('id') != sender_id:
-        print(f"[Auto-Reply] Last message was from staff. Skipping.")
+    if not should_auto_reply(sender_id, messages, intelligence):
         return None
 
     try:
-        client = genai.Client(api_key=GEMINI_API_KEY)
+        client = get_client()
         
         # Build prompt with context
         history_text = "\n".join([f"{m.get('from', {}).get('name', 'User')}: {m.get('message', '')}" for m in messages[:3][::-1]])
@@ -1,17 +1,56 @@
 import os
 import json
-import time
 from datetime import datetime, timedelta
-from google import genai
 from dotenv import load_dotenv
-from behavioral_analyzer import analyze_customer_behavior, analyze_batch_customer_behavior
-from db_adapter import update_customer_intelligence
+from behavioral_analyzer import analyze_customers_batched, plan_behavior_update, summary_state
+from db_adapter import update_customer_intelligence_bulk
+from change_journal import JournalReader, touched, mtime_scan, record_changes, JOURNAL_PATH
+from batch_executor import BatchCheckpoint
+from customer_index import get_customer_index
 
 load_dotenv()
 
 # Configuration
 DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', '..', 'customer'))
 
+CHECKPOINT_PATH = os.path.join(os.path.dirname(JOURNAL_PATH), 'hourly_audit.checkpoint.jsonl')
+AUDIT_EVENTS = {'chat'}  # journal events that make a customer due for a behavior audit
+
+def _audit_time(intel):
+    """last_behavior_audit as epoch seconds (written as naive local time + 'Z'), or None."""
+    stamp = intel.get('last_behavior_audit')
+    if not stamp: return None
+    return datetime.fromisoformat(stamp.replace('Z', '')).timestamp()
+
+def find_active_folders(reader):
+    """
+    {folder: last chat activity (epoch) or None} from the change journal, or
+    from an mtime scan of chathistory/ when the journal has no usable checkpoint.
+    Returns (folders, journal position to commit after the sweep).
+    """
+    entries, position = reader.changes()
+    if entries is None:
+        since = reader.last_commit_time()
+        folders = mtime_scan(DATA_DIR, since)
+        print(f"  [Journal] No checkpoint, mtime scan: {len(folders)} active folders")
+        return folders, position
+
+    customers, conversations = touched(entries, AUDIT_EVENTS)
+    index = get_customer_index(DATA_DIR)
+    folders = {}
+    def mark(folder_path, t):
+        if not folder_path: return
+        folder = os.path.basename(os.path.normpath(folder_path))
+        folders[folder] = max(t or 0, folders.get(folder) or 0)
+    for customer_id, t in customers.items():
+        direct = os.path.join(DATA_DIR, customer_id)
+        mark(direct if os.path.isdir(direct) else index.find_folder(customer_id, match_suffix=True), t)
+    for conversation_id, t in conversations.items():
+        conv_file = index.find_conversation(conversation_id)
+        mark(os.path.dirname(os.path.dirname(conv_file)) if conv_file else None, t)
+    print(f"  [Journal] {len(entries)} entries, {len(folders)} customers with new chat activity")
+    return folders, position
+
 def run_hourly_audit():
     print(f"[{datetime.now()}] 🕒 Starting Hourly Batch Intelligence Sweep...")
     
@@ -20,15 +59,24 @@ def run_hourly_audit():
         return
 
     # 1. Identify active customers who need an update
-    # Criteria: Profile updated in last 60 mins OR has new messages with no 'behavioral' AI stamp
+    # Criteria: chat activity (change journal / chathistory mtime) newer than the last
+    # behavioral audit. Without activity times (first run): no audit stamp or older than 60 mins.
     active_customers = []
     
     now = datetime.now()
-    one_hour_ago = now - timedelta(hours=1)
+    one_hour_ago = (now - timedelta(hours=1)).timestamp()
+    reader = JournalReader('hourly_audit')
+    folders, journal_position = find_active_folders(reader)
+
+    # Resume: skip customers already saved by an interrupted sweep (unless they chatted since)
+    checkpoint = BatchCheckpoint(CHECKPOINT_PATH)
+    completed = checkpoint.completed()
+    if completed:
+        resumed = [f for f, activity in folders.items() if f in completed and (activity or 0) <= completed[f]]
+        for folder in resumed: del folders[folder]
+        print(f"  [Checkpoint] Resuming interrupted sweep, {len(resumed)} customers already done")
 
-    for folder in os.listdir(DATA_DIR):
-        # ... logic to scan folders ...
-        # For simplicity in this demo, we'll scan all but you could optimize via file mtime
+    for folder, activity in folders.items():
         folder_path = os.path.join(DATA_DIR, folder)
         profile_file = os.path.join(folder_path, f"profile_{folder}.json")
         
@@ -39,15 +87,11 @@ def run_hourly_audit():
                 
                 # Check last AI update
                 intel = profile.get('intelligence', {})
-                last_update_str = intel.get('last_behavior_audit')
-                
-                should_audit = False
-                if not last_update_str:
-                    should_audit = True
+                last_audit = _audit_time(intel)
+                if activity is not None:
+                    should_audit = last_audit is None or last_audit < activity
                 else:
-                    last_update = datetime.fromisoformat(last_update_str.replace('Z', ''))
-                    if last_update < one_hour_ago:
-                        should_audit = True
+                    should_audit = last_audit is None or last_audit < one_hour_ago
                 
                 if should_audit:
                     # Get messages
@@ -59,6 +103,7 @@ def run_hourly_audit():
                             active_customers.append({
                                 "id": folder, # Customer ID is usually the folder name
                                 "profile_path": profile_file,
+                                "intel": intel,
                                 "conv_file": os.path.join(history_dir, conv_files[0]) # Use latest
                             })
             except Exception as e:
@@ -66,61 +111,75 @@ def run_hourly_audit():
 
     print(f"Found {len(active_customers)} customers requiring deep audit.")
 
-    # 2. Mega-Batch Processing (Context Packing)
-    BATCH_SIZE = 20
+    # 2. Mega-Batch Processing (Context Packing by token budget, see batch_packer)
     counts = {"success": 0, "failed": 0, "skipped": 0}
+    retry = []
+    backlog = []  # delta customers with new messages left for the next sweep
+    batch_payload = []
+    plans = {}
     
-    for i in range(0, len(active_customers), BATCH_SIZE):
-        chunk = active_customers[i:i + BATCH_SIZE]
-        batch_payload = []
-        
-        for customer in chunk:
-            try:
-                with open(customer['conv_file'], 'r', encoding='utf-8') as f:
-                    conv_data = json.load(f)
-                
-                messages = conv_data.get('messages', {}).get('data', [])
-                if messages:
-                    batch_payload.append({
-                        "customer_id": customer['id'],
-                        "messages": messages
-                    })
-                else:
-                    counts['skipped'] += 1
-            except Exception as e:
-                print(f"  [Error] Failed to read {customer['id']}: {e}")
-
-        if not batch_payload:
-            continue
-
-        print(f"  [Mega-Batch] Processing group of {len(batch_payload)} customers in ONE API call...")
-        
+    for customer in active_customers:
         try:
-            # CALL MEGA-BATCH AI
-            batch_results = analyze_batch_customer_behavior(batch_payload)
+            with open(customer['conv_file'], 'r', encoding='utf-8') as f:
+                conv_data = json.load(f)
             
-            if "error" not in batch_results:
-                for customer_id, result in batch_results.items():
-                    # Update with audit timestamp
-                    result['last_behavior_audit'] = datetime.now().isoformat() + 'Z'
-                    update_customer_intelligence(customer_id, {
-                        "behavioral": result,
-                        "last_behavior_audit": result['last_behavior_audit'],
-                        "status": result.get('customer_status', 'WARM'),
-                        "tags": result.get('behavioral_tags', [])
-                    })
-                    counts['success'] += 1
-                print(f"    ✅ Successfully updated {len(batch_results)} customers.")
+            messages = conv_data.get('messages', {}).get('data', [])
+            # Rolling summary: previous profile + new messages only, full re-analysis on schedule
+            plan = plan_behavior_update(customer['intel'], messages) if messages else {"mode": "none"}
+            if plan['mode'] != 'none':
+                plans[customer['id']] = (plan, customer['intel'], messages)
+                batch_payload.append({
+                    "customer_id": customer['id'],
+                    "messages": plan['messages'],
+                    "previous": plan.get('previous')
+                })
             else:
-                print(f"    [Error] Mega-Batch AI failed: {batch_results['error']}")
-                counts['failed'] += len(batch_payload)
-            
-            # Small delay to be polite to the API
-            time.sleep(1)
-            
+                counts['skipped'] += 1
+        except Exception as e:
+            print(f"  [Error] Failed to read {customer['id']}: {e}")
+            retry.append(customer['id'])
+
+    def save_results(batch_results):
+        # Update with audit timestamp (one bulk JSONB merge per mega-batch)
+        audit_ts = datetime.now().isoformat() + 'Z'
+        patches = []
+        for customer_id, result in batch_results.items():
+            plan, intel, messages = plans[customer_id]
+            summary = summary_state(result, plan, intel, messages)
+            result['last_behavior_audit'] = audit_ts
+            patches.append((customer_id, {
+                "behavioral": result,
+                "behavior_summary": summary,
+                "last_behavior_audit": audit_ts,
+                "status": result.get('customer_status', 'WARM'),
+                "tags": result.get('behavioral_tags', [])
+            }))
+        updated = update_customer_intelligence_bulk(patches)
+        counts['success'] += len(updated)
+        counts['failed'] += len(patches) - len(updated)
+        retry.extend(cid for cid, _ in patches if cid not in updated)
+        backlog.extend(cid for cid, _ in patches if cid in updated and plans[cid][0].get('remaining'))
+        print(f"    ✅ Successfully updated {len(updated)} customers.")
+        return updated  # only these are checkpointed as completed
+
+    if batch_payload:
+        delta = sum(1 for plan, _, _ in plans.values() if plan['mode'] == 'delta')
+        print(f"  [Rolling Summary] {delta} delta updates, {len(plans) - delta} full re-analyses")
+        try:
+            outcome = analyze_customers_batched(batch_payload, on_results=save_results, checkpoint=checkpoint)
+            counts['failed'] += len(outcome['failed'])
+            retry.extend(outcome['failed'])
+            print(f"  [Mega-Batch] {outcome['calls']} API calls for {len(batch_payload)} customers in {outcome['seconds']}s")
         except Exception as e:
             print(f"    [Error] Mega-Batch Execution failed: {e}")
-            counts['failed'] += len(batch_payload)
+            retry.extend(c['customer_id'] for c in batch_payload)
+
+    # Failed customers (and unfinished delta backlogs) go back into the journal for the next sweep
+    if backlog:
+        print(f"  [Rolling Summary] {len(backlog)} customers have more new messages; continued next sweep")
+    record_changes('chat', customers=retry + backlog)
+    reader.commit(journal_position)
+    checkpoint.clear()
 
     print(f"\n✅ Audit Complete. Success: {counts['success']}, Failed: {counts['failed']}, Skipped: {counts['skipped']}")
 
@@ -0,0 +1,137 @@
+"""
+V-School Mega-Batch Executor
+────────────────────────────
+Runs token-budget packed batches (batch_packer) concurrently under the
+shared Gemini rate limiter (rate_limiter): every call first reserves one
+request + its estimated tokens, and 429 / RESOURCE_EXHAUSTED responses back
+off every worker and are retried without using up a customer's attempts.
+
+Customers missing from a response are re-packed into a later round, up to
+BATCH_MAX_ATTEMPTS. With a BatchCheckpoint, customers are recorded as
+completed once on_results reports their results as saved, so an interrupted sweep resumes
+after the last completed batch instead of starting over.
+
+Config (env):
+  BATCH_CONCURRENCY    calls in flight (default: 4)
+  BATCH_MAX_ATTEMPTS   per customer, incl. re-queues (default: 3)
+"""
+
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from batch_packer import pack_batches, PROMPT_OVERHEAD_TOKENS, OUTPUT_TOKENS_PER_CUSTOMER
+from rate_limiter import get_limiter, is_rate_limit_error
+
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+MAX_BATCH_ATTEMPTS = int(os.getenv('BATCH_MAX_ATTEMPTS', '3'))
+RATE_LIMIT_RETRIES = 5  # per batch, on top of the adaptive backoff
+
+
+class BatchCheckpoint:
+    """Append-only JSONL of customers whose results were saved during the current sweep."""
+    def __init__(self, path):
+        self.path = path
+
+    def completed(self):
+        """{customer_id: completed_at (epoch)} from an interrupted sweep."""
+        done = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line from a crash
+                    done.update(dict.fromkeys(entry.get('ids', []), entry.get('t')))
+        except OSError:
+            pass
+        return done
+
+    def mark(self, customer_ids):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"t": time.time(), "ids": list(customer_ids)}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def _batch_tokens(batch):
+    return PROMPT_OVERHEAD_TOKENS + sum(b['tokens'] + OUTPUT_TOKENS_PER_CUSTOMER for b in batch)
+
+
+def _run_one(call, batch, limiter):
+    """One batch call under the limiter; rate-limit errors are retried after backoff."""
+    for _ in range(RATE_LIMIT_RETRIES + 1):
+        limiter.acquire(_batch_tokens(batch))
+        try:
+            response = call(batch)
+        except Exception as e:
+            response = {"error": str(e)}
+        if "error" not in response:
+            limiter.success()
+            return response
+        if not is_rate_limit_error(response['error']):
+            return response
+        limiter.backoff(response['error'])
+    return response
+
+
+def run_batches(entries, call, on_results=None, checkpoint=None, limiter=None,
+                concurrency=BATCH_CONCURRENCY, max_attempts=MAX_BATCH_ATTEMPTS):
+    """
+    entries: [{"customer_id", "messages"}]; call(batch) -> {customer_id: result} or {"error": ...}.
+    on_results(results) runs on the calling thread after each successful call and
+    returns the customer ids it stored (None = all); only those are checkpointed.
+    Returns {"results", "failed", "calls", "seconds"}.
+    """
+    limiter = limiter or get_limiter()
+    by_id = {str(e['customer_id']): dict(e, customer_id=str(e['customer_id'])) for e in entries}
+    attempts = dict.fromkeys(by_id, 0)
+    results, failed, calls = {}, [], 0
+    start = time.monotonic()
+    queue = pack_batches(list(by_id.values()))
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='mega-batch') as pool:
+        while queue:
+            missing = []
+            futures = {}
+            for batch in queue:
+                for b in batch: attempts[b['customer_id']] += 1
+                truncated = sum(1 for b in batch if b['truncated'])
+                print(f"  [Mega-Batch] {len(batch)} customers, ~{sum(b['tokens'] for b in batch)} tokens"
+                      f"{f', {truncated} truncated' if truncated else ''}")
+                futures[pool.submit(_run_one, call, batch, limiter)] = batch
+
+            for future in as_completed(futures):
+                ids = [b['customer_id'] for b in futures[future]]
+                response = future.result()
+                calls += 1
+                if "error" in response:
+                    print(f"    [Error] Mega-Batch AI failed: {response['error']}")
+                    response = {}
+                # Only this batch's customers count; ids from other batches are ignored
+                batch_ids = set(ids)
+                got = {cid: value for cid, value in response.items() if cid in batch_ids and isinstance(value, dict)}
+                if got:
+                    results.update(got)
+                    saved = on_results(got) if on_results else None
+                    saved = list(got) if saved is None else [cid for cid in got if cid in set(saved)]
+                    if checkpoint and saved: checkpoint.mark(saved)  # failed saves stay due on resume
+                missing.extend(cid for cid in ids if cid not in got)
+
+            retry = [cid for cid in missing if attempts[cid] < max_attempts]
+            failed.extend(cid for cid in missing if attempts[cid] >= max_attempts)
+            if retry:
+                print(f"    [Mega-Batch] Re-queueing {len(retry)} customers missing from the response")
+            queue = pack_batches([by_id[cid] for cid in retry])
+
+    return {"results": results, "failed": failed, "calls": calls,
+            "seconds": round(time.monotonic() - start, 1)}
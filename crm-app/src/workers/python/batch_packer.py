@@ -0,0 +1,117 @@
+"""
+V-School Token-Budget Batch Packer
+──────────────────────────────────
+Packs customer conversations into mega-batch prompts by estimated token
+count instead of a fixed number of customers per call:
+  - each conversation is rendered once (newest HISTORY_MESSAGES, oldest first)
+    and its tokens estimated; Thai has no spaces and costs far more tokens
+    per character than English, so it is counted separately
+  - a conversation above BATCH_CUSTOMER_TOKENS is cut down to a truncated
+    summary: long messages clipped, oldest messages dropped (with a marker)
+  - batches are filled up to BATCH_TOKEN_BUDGET input tokens and at most
+    as many customers as the output budget can answer
+
+Config (env):
+  BATCH_TOKEN_BUDGET     input tokens per request (default: 24000)
+  BATCH_CUSTOMER_TOKENS  max tokens per conversation block (default: 2500)
+  BATCH_OUTPUT_BUDGET    output tokens per request (default: 8000)
+"""
+
+import os
+import re
+import json
+
+TOKEN_BUDGET = int(os.getenv('BATCH_TOKEN_BUDGET', '24000'))
+CUSTOMER_TOKENS = int(os.getenv('BATCH_CUSTOMER_TOKENS', '2500'))
+OUTPUT_BUDGET = int(os.getenv('BATCH_OUTPUT_BUDGET', '8000'))
+OUTPUT_TOKENS_PER_CUSTOMER = 250   # one JSON result object
+PROMPT_OVERHEAD_TOKENS = 600       # instructions + output format
+HISTORY_MESSAGES = 30
+MESSAGE_MAX_CHARS = 600            # clip for single long messages in truncated blocks
+
+# Rough Gemini tokenizer ratios: Thai ~1.5 chars/token, Latin text ~4 chars/token
+THAI_CHARS_PER_TOKEN = 1.5
+OTHER_CHARS_PER_TOKEN = 4.0
+_THAI = re.compile(r'[\u0E00-\u0E7F]')
+
+
+def estimate_tokens(text):
+    text = text or ''
+    thai = len(_THAI.findall(text))
+    other = len(text) - thai - text.count(' ')
+    return int(thai / THAI_CHARS_PER_TOKEN + max(0, other) / OTHER_CHARS_PER_TOKEN) + 1
+
+
+def _line(msg, max_chars=None):
+    sender = msg.get('from', {}).get('name', 'User')
+    text = msg.get('message', '') or ''
+    if max_chars and len(text) > max_chars:
+        text = text[:max_chars] + '…'
+    return f"{sender}: {text}\n"
+
+
+def render_conversation(customer_id, messages, max_tokens=CUSTOMER_TOKENS, previous=None):
+    """
+    Prompt block for one customer -> (block, estimated tokens, truncated?).
+    `messages` are newest first (Graph API order). With `previous` (rolling
+    profile from the last audit), only the messages since then are expected.
+    """
+    header = f"### CUSTOMER_ID: {customer_id}\n"
+    if previous:
+        header += (f"PREVIOUS PROFILE: {json.dumps(previous, ensure_ascii=False, separators=(',', ':'))}\n"
+                   "NEW MESSAGES SINCE LAST AUDIT:\n")
+    recent = messages[:HISTORY_MESSAGES]
+    lines = [_line(m) for m in reversed(recent)]
+    block = header + ''.join(lines) + "\n---\n"
+    tokens = estimate_tokens(block)
+    if tokens <= max_tokens:
+        return block, tokens, False
+
+    # Truncated summary: newest messages first until the budget is spent
+    budget = max_tokens - estimate_tokens(header) - 20
+    kept = []
+    for msg in recent:
+        line = _line(msg, MESSAGE_MAX_CHARS)
+        cost = estimate_tokens(line)
+        if cost > budget: break
+        kept.append(line)
+        budget -= cost
+    omitted = len(recent) - len(kept)
+    marker = f"[... {omitted} earlier messages omitted, long messages clipped ...]\n" if omitted else ''
+    block = header + marker + ''.join(reversed(kept)) + "\n---\n"
+    return block, estimate_tokens(block), True
+
+
+def max_customers_per_batch():
+    return max(1, OUTPUT_BUDGET // OUTPUT_TOKENS_PER_CUSTOMER)
+
+
+def pack_batches(entries, token_budget=TOKEN_BUDGET, max_customers=None):
+    """
+    entries: [{"customer_id", "messages"[, "previous"]}] -> list of batches, each a list of
+    {"customer_id", "block", "tokens", "truncated"}. Order is preserved;
+    every customer lands in exactly one batch.
+    """
+    max_customers = max_customers or max_customers_per_batch()
+    limit = max(1, token_budget - PROMPT_OVERHEAD_TOKENS)
+    batches, current, used = [], [], 0
+    for entry in entries:
+        block, tokens, truncated = render_conversation(entry['customer_id'], entry['messages'],
+                                                       min(CUSTOMER_TOKENS, limit), entry.get('previous'))
+        if current and (used + tokens > limit or len(current) >= max_customers):
+            batches.append(current)
+            current, used = [], 0
+        current.append({"customer_id": entry['customer_id'], "block": block,
+                        "tokens": tokens, "truncated": truncated})
+        used += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+if __name__ == "__main__":
+    chat = [{"from": {"name": "User"}, "message": "อยากเรียนซูชิแบบเปิดร้านเลยครับ ราคาเท่าไหร่"}] * 30
+    print(estimate_tokens("อยากเรียนซูชิแบบเปิดร้านเลยครับ"), estimate_tokens("I want to learn sushi"))
+    entries = [{"customer_id": f"C{i}", "messages": chat[: 5 + i * 3]} for i in range(10)]
+    for batch in pack_batches(entries, token_budget=2500):
+        print([(b['customer_id'], b['tokens'], b['truncated']) for b in batch])
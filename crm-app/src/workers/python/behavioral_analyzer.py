@@ -1,32 +1,33 @@
 import os
 import json
-from google import genai
+import time
+from gemini_client import get_client
+from batch_packer import render_conversation, HISTORY_MESSAGES, CUSTOMER_TOKENS
+from batch_executor import run_batches
+from llm_cache import generate_cached, parse_json_text
 from dotenv import load_dotenv
 
 load_dotenv()
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+BEHAVIOR_PROMPT_VERSION = 1  # single-customer prompt; bump when it changes (LLM cache key)
 
 def analyze_batch_customer_behavior(batch_data):
     """
     Analyzes multiple customer conversations in a single API call for token efficiency.
     batch_data: List of dicts {"customer_id": "...", "messages": [...]}
+                or packed entries with a rendered "block" (batch_packer.pack_batches)
     """
     if not GEMINI_API_KEY:
         return {"error": "Missing API Key"}
 
-    client = genai.Client(api_key=GEMINI_API_KEY)
+    client = get_client()
     
-    # Pack multiple contexts
-    packed_context = ""
-    for entry in batch_data:
-        cid = entry['customer_id']
-        msgs = entry['messages']
-        packed_context += f"### CUSTOMER_ID: {cid}\n"
-        for msg in msgs[-30:]:
-            sender = msg.get('from', {}).get('name', 'User')
-            text = msg.get('message', '')
-            packed_context += f"{sender}: {text}\n"
-        packed_context += "\n---\n"
+    # Pack multiple contexts (newest messages, oldest first; oversized chats truncated)
+    packed_context = "".join(
+        entry['block'] if 'block' in entry else
+        render_conversation(entry['customer_id'], entry['messages'], previous=entry.get('previous'))[0]
+        for entry in batch_data
+    )
 
     prompt = f"""
     You are a Senior Marketing Strategist & Behavioral Analyst for V School.
@@ -35,12 +36,17 @@ def analyze_batch_customer_behavior(batch_data):
     CONVERSATIONS:
     {packed_context}
 
+    Some customers have a PREVIOUS PROFILE and only the NEW MESSAGES since the last audit:
+    update that profile with the new messages (keep what still holds, change what the new messages contradict).
+
     OBJECTIVE FOR EACH CUSTOMER:
     1. Identify 'behavioral_tags': (e.g., LOVES_SUSHI, BARGAIN_HUNTER, LONG_TIME_FAN, PRICE_SENSITIVE, DECISION_MAKER).
     2. Identify 'marketing_persona': (e.g., Casual Hobbyist, Professional Chef, Event Planner, Gift Buyer).
     3. Track 'emotional_state': (e.g., Enthusiastic, Hesitant, Skeptical, Satisfied).
     4. Recommend 'next_best_action' (CTA).
     5. Determine 'customer_status': (e.g., COLD, WARM, HOT_LEAD, WON, DORMANT).
+    6. Write 'rolling_summary': max 60 words, everything worth remembering about this customer
+       (interests, objections, budget, stage). It replaces the chat history in the next audit.
 
     OUTPUT FORMAT (JSON OBJECT ONLY, KEYED BY CUSTOMER_ID):
     {{
@@ -51,7 +57,8 @@ def analyze_batch_customer_behavior(batch_data):
             "recommended_cta": "string",
             "customer_status": "string",
             "analysis_summary": "Thai text",
-            "intent_evolution": "string"
+            "intent_evolution": "string",
+            "rolling_summary": "string"
         }},
         ...
     }}
@@ -70,6 +77,114 @@ def analyze_batch_customer_behavior(batch_data):
     except Exception as e:
         return {"error": str(e)}
 
+# ─── Rolling Summary (delta-only re-analysis) ──────────────
+# intelligence.behavior_summary = {summary, last_message_id, last_message_time, full_at, updates}
+FULL_EVERY_DAYS = float(os.getenv('BEHAVIOR_FULL_EVERY_DAYS', '7'))
+FULL_EVERY_UPDATES = int(os.getenv('BEHAVIOR_FULL_EVERY_UPDATES', '10'))
+
+def _messages_since(messages, cursor):
+    """
+    Newest-first messages after the cursor: up to the cursor message id, or,
+    when that id has left the fetched window, strictly after the cursor's
+    (created_time, id) so already summarized messages are not folded in twice.
+    """
+    last_id, last_time = cursor.get('last_message_id'), cursor.get('last_message_time')
+    if last_id and any(msg.get('id') == last_id for msg in messages):
+        newer = []
+        for msg in messages:
+            if msg.get('id') == last_id: break
+            newer.append(msg)
+        return newer
+    if not last_time:
+        return list(messages)
+    return [msg for msg in messages
+            if (msg.get('created_time', ''), msg.get('id') or '') > (last_time, last_id or '')]
+
+def _delta_chunk(new_messages, previous):
+    """
+    Oldest new messages that fit one untruncated prompt block (at most
+    HISTORY_MESSAGES), newest first. The cursor only moves to the newest of
+    these, so a longer backlog is folded in over several audits, not dropped.
+    """
+    chunk = []
+    for msg in reversed(new_messages):
+        candidate = [msg] + chunk
+        # 20 tokens of headroom for the customer id in the block header
+        if chunk and (len(candidate) > HISTORY_MESSAGES
+                      or render_conversation('', candidate, CUSTOMER_TOKENS - 20, previous)[2]):
+            break
+        chunk = candidate
+    return chunk
+
+def plan_behavior_update(intel, messages, now=None):
+    """
+    Decide what the next audit sends for one customer (messages newest first):
+      {"mode": "full", "messages": messages}
+      {"mode": "delta", "messages": oldest new messages, "previous": compact profile,
+       "remaining": new messages left for the next audit}
+      {"mode": "none"}   nothing new since the last audit
+    Full re-analysis when there is no summary yet, or it is older than
+    BEHAVIOR_FULL_EVERY_DAYS, or after BEHAVIOR_FULL_EVERY_UPDATES deltas.
+    """
+    now = now or time.time()
+    state = intel.get('behavior_summary') or {}
+    behavioral = intel.get('behavioral') or {}
+    due_full = (not state.get('summary') or not state.get('full_at')
+                or now - state['full_at'] > FULL_EVERY_DAYS * 86400
+                or state.get('updates', 0) >= FULL_EVERY_UPDATES)
+    if due_full:
+        return {"mode": "full", "messages": messages}
+
+    new_messages = _messages_since(messages, state)
+    if not new_messages:
+        return {"mode": "none"}
+    previous = {
+        "summary": state['summary'],
+        "tags": behavioral.get('behavioral_tags', []),
+        "persona": behavioral.get('marketing_persona'),
+        "status": behavioral.get('customer_status'),
+    }
+    chunk = _delta_chunk(new_messages, previous)
+    return {"mode": "delta", "messages": chunk, "previous": previous, "remaining": len(new_messages) - len(chunk)}
+
+def summary_state(result, plan, intel, messages, now=None):
+    """New intelligence.behavior_summary after a successful audit."""
+    now = now or time.time()
+    state = intel.get('behavior_summary') or {}
+    full = plan['mode'] == 'full'
+    # Delta: cursor = newest message actually summarized (not the newest fetched)
+    summarized = messages if full else plan['messages']
+    newest = summarized[0] if summarized else {}
+    return {
+        "summary": result.pop('rolling_summary', None) or result.get('analysis_summary') or state.get('summary'),
+        "last_message_id": newest.get('id', state.get('last_message_id')),
+        "last_message_time": newest.get('created_time', state.get('last_message_time')),
+        "full_at": now if full else state.get('full_at'),
+        "updates": 0 if full else state.get('updates', 0) + 1,
+    }
+
+def _result_id(key):
+    """Model output keys sometimes keep the 'CUSTOMER_ID:' label from the prompt."""
+    key = str(key).strip()
+    return key.split(':', 1)[1].strip() if key.upper().startswith('CUSTOMER_ID') else key
+
+def _analyze_packed_batch(batch):
+    response = analyze_batch_customer_behavior(batch)
+    if "error" in response:
+        return response
+    return {_result_id(key): value for key, value in response.items()}
+
+def analyze_customers_batched(entries, on_results=None, checkpoint=None):
+    """
+    Mega-batch analysis packed by token budget (batch_packer) and run
+    concurrently under the shared rate limiter (batch_executor). Customers
+    missing from a response are re-queued into later batches.
+    on_results(results) is called after every successful call and returns the
+    customer ids it saved (only those are checkpointed).
+    Returns {"results": {customer_id: result}, "failed": [customer_id], "calls": int, "seconds": float}.
+    """
+    return run_batches(entries, _analyze_packed_batch, on_results=on_results, checkpoint=checkpoint)
+
 def analyze_customer_behavior(customer_id, chat_messages):
     """
     Analyzes the full conversation context to detect behavioral patterns, 
@@ -78,11 +193,10 @@ def analyze_customer_behavior(customer_id, chat_messages):
     if not GEMINI_API_KEY:
         return {"error": "Missing API Key"}
 
-    client = genai.Client(api_key=GEMINI_API_KEY)
-    
     # Format chat for LLM
     chat_context = ""
-    for msg in chat_messages[-30:]: # Use last 30 messages for deep context
+    # Messages arrive newest first (Graph API order): newest 30, oldest first for the prompt
+    for msg in reversed(chat_messages[:30]):
         sender = msg.get('from', {}).get('name', 'User')
         text = msg.get('message', '')
         chat_context += f"{sender}: {text}\n"
@@ -114,26 +228,17 @@ def analyze_customer_behavior(customer_id, chat_messages):
     """
 
     try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt
-        )
-        # Clean response
-        text = response.text.replace('```json', '').replace('```', '').strip()
-        if '{' in text and '}' in text:
-            text = text[text.find('{'):text.rfind('}')+1]
-        
-        result = json.loads(text)
-        return result
+        return generate_cached('customer_behavior', "gemini-2.0-flash", BEHAVIOR_PROMPT_VERSION,
+                               {"chat": chat_context, "customer": customer_id}, prompt, parse_json_text)
     except Exception as e:
         return {"error": str(e)}
 
 if __name__ == "__main__":
     # Test stub
-    sample_chat = [
-        {"from": {"name": "User"}, "message": "อยากเรียนซูชิแบบเปิดร้านเลยครับ"},
-        {"from": {"name": "User"}, "message": "แต่ราคาแอบแรงนิดนึง มีโปรโมชั่นไหมครับ?"},
+    sample_chat = [  # newest first, as fetched from the Graph API
+        {"from": {"name": "User"}, "message": "โอ้ ชุดมีดน่าสนใจครับ งานยี่ห้ออะไรเหรอครับ"},
         {"from": {"name": "Admin"}, "message": "สวสัดีครับ ถ้าเน้นเปิดร้านแนะนำคอร์ส Professional เลยครับ ตอนนี้มีโปรแถมชุดมีดครับ"},
-        {"from": {"name": "User"}, "message": "โอ้ ชุดมีดน่าสนใจครับ งานยี่ห้ออะไรเหรอครับ"}
+        {"from": {"name": "User"}, "message": "แต่ราคาแอบแรงนิดนึง มีโปรโมชั่นไหมครับ?"},
+        {"from": {"name": "User"}, "message": "อยากเรียนซูชิแบบเปิดร้านเลยครับ"}
     ]
     print(json.dumps(analyze_customer_behavior("TEST-B01", sample_chat), indent=2, ensure_ascii=False))
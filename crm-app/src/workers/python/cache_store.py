@@ -0,0 +1,228 @@
+"""
+V-School Tiered Cache
+─────────────────────
+Small key/value cache shared by the Python workers:
+  - in-process LRU tier (always on, bounded by entry count)
+  - optional persistent tier: SQLite file or Redis
+Both tiers honour a TTL; SQLite evicts least-recently-used rows past its size
+bound, Redis relies on key expiry (+ the server's maxmemory policy).
+Values must be JSON-serializable. Every cache keeps hit/miss counters.
+
+Config (env):
+  CACHE_BACKEND      sqlite | redis | none   (default: sqlite)
+  CACHE_SQLITE_PATH  SQLite file             (default: crm-app/cache/worker_cache.sqlite3)
+  REDIS_URL          used when CACHE_BACKEND=redis
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+try:
+    import redis
+    HAS_REDIS = True
+except ImportError:
+    HAS_REDIS = False
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'sqlite').lower()
+CACHE_SQLITE_PATH = os.getenv('CACHE_SQLITE_PATH') or os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', '..', '..', 'cache', 'worker_cache.sqlite3'))
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379')
+
+
+class LRUCache:
+    """Thread-safe in-process LRU with per-entry expiry."""
+    def __init__(self, max_entries=1024, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is None: return None
+            expires_at, value = hit
+            if expires_at and expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at=None):
+        """`expires_at` (epoch) overrides the TTL, e.g. for an entry copied from a persistent tier."""
+        if expires_at is None and self.ttl:
+            expires_at = time.time() + self.ttl
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteStore:
+    """
+    Persistent tier in a local SQLite file (one table per namespace).
+    Rows past `max_entries` are evicted by least-recent access.
+    """
+    EVICT_EVERY = 100  # writes between size checks
+
+    def __init__(self, namespace, path=CACHE_SQLITE_PATH, max_entries=50000, ttl=None):
+        self.table = f"cache_{''.join(ch if ch.isalnum() else '_' for ch in namespace)}"
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL,
+                    accessed_at REAL NOT NULL
+                )""")
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_accessed ON {self.table} (accessed_at)")
+
+    def get_entry(self, key):
+        """(value, expires_at or None) or None."""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None: return None
+            if row[1] and row[1] < now:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                return None
+            self._conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0]), row[1]
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry[0] if entry else None
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + self.ttl if self.ttl else None, now))
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now):
+        self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+        self._conn.execute(f"""
+            DELETE FROM {self.table} WHERE key IN (
+                SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )""", (self.max_entries,))
+
+
+class RedisStore:
+    """Persistent tier in Redis; size is bounded by TTL and the server's maxmemory-policy."""
+    def __init__(self, namespace, url=REDIS_URL, ttl=None):
+        self.prefix = f"vschool:cache:{namespace}:"
+        self.ttl = ttl
+        self._client = redis.from_url(url)
+
+    def get_entry(self, key):
+        """(value, expires_at or None) or None; expiry from the key's remaining PTTL."""
+        pipe = self._client.pipeline()
+        pipe.get(self.prefix + key)
+        pipe.pttl(self.prefix + key)
+        raw, pttl = pipe.execute()
+        if raw is None: return None
+        return json.loads(raw), (time.time() + pttl / 1000.0 if pttl and pttl > 0 else None)
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry[0] if entry else None
+
+    def set(self, key, value):
+        self._client.set(self.prefix + key, json.dumps(value, ensure_ascii=False),
+                         ex=int(self.ttl) if self.ttl else None)
+
+
+class TieredCache:
+    """LRU in front of an optional persistent store, with hit/miss counters."""
+    def __init__(self, name, memory_entries=1024, ttl=None, store=None):
+        self.name = name
+        self.memory = LRUCache(memory_entries, ttl)
+        self.store = store
+        self._stats = {"hits_memory": 0, "hits_persistent": 0, "misses": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, field):
+        with self._stats_lock:
+            self._stats[field] += 1
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("hits_memory")
+            return value
+        if self.store is not None:
+            try:
+                entry = self.store.get_entry(key)
+            except Exception as e:
+                self._count("errors")
+                print(f"[Cache:{self.name}] Read Error: {e}")
+                entry = None
+            if entry is not None:
+                value, expires_at = entry
+                # Promote with the stored expiry, not a fresh TTL
+                self.memory.set(key, value, expires_at=expires_at)
+                self._count("hits_persistent")
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.store is not None:
+            try:
+                self.store.set(key, value)
+            except Exception as e:
+                self._count("errors")
+                print(f"[Cache:{self.name}] Write Error: {e}")
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["hits_memory"] + stats["hits_persistent"] + stats["misses"]
+        stats["hit_rate"] = round((lookups - stats["misses"]) / lookups, 4) if lookups else 0.0
+        stats["memory_entries"] = len(self.memory)
+        return stats
+
+
+def make_cache(name, memory_entries=1024, ttl=None, max_entries=50000, backend=None):
+    """
+    Build a TieredCache for `name` using CACHE_BACKEND (or `backend`).
+    If the persistent tier cannot be opened, the cache runs memory-only.
+    """
+    backend = (backend or CACHE_BACKEND).lower()
+    store = None
+    try:
+        if backend == 'sqlite':
+            store = SQLiteStore(name, max_entries=max_entries, ttl=ttl)
+        elif backend == 'redis':
+            if not HAS_REDIS:
+                raise RuntimeError("'redis' is not installed")
+            store = RedisStore(name, ttl=ttl)
+    except Exception as e:
+        print(f"[Cache:{name}] Persistent tier '{backend}' unavailable, memory only: {e}")
+        store = None
+    return TieredCache(name, memory_entries=memory_entries, ttl=ttl, store=store)
@@ -0,0 +1,198 @@
+"""
+V-School Change Journal
+───────────────────────
+Append-only JSONL record of which customers were touched, so periodic jobs
+(batch_auditor.run_hourly_audit) visit only recently active customers
+instead of opening every profile:
+
+  {"t": 1760680800.5, "event": "chat", "customer": "TVS-CUS-...", "conversation": "t_123"}
+
+Events: chat (new messages synced), intel (AI intelligence merged),
+order (order created). Writers: db_adapter, scripts/sync_facebook_data.py
+and chatService.js (same file). Each line is one small O_APPEND write, so
+concurrent writers from several processes do not interleave.
+
+Readers keep their own checkpoint (file inode + byte offset) next to the
+journal. The reader rotates the journal once it has consumed it past
+CHANGE_JOURNAL_ROTATE_MB; a checkpoint still pointing into the rotated file
+is finished from `.1`. If the checkpoint is missing or lost, `changes()`
+returns None and the caller falls back to an mtime scan (see `mtime_scan`).
+
+Config (env):
+  CHANGE_JOURNAL_PATH        default: crm-app/cache/change_journal.jsonl
+  CHANGE_JOURNAL_ROTATE_MB   default: 16
+"""
+
+import os
+import json
+import time
+import threading
+
+JOURNAL_PATH = os.getenv('CHANGE_JOURNAL_PATH') or os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', '..', '..', 'cache', 'change_journal.jsonl'))
+ROTATE_BYTES = int(float(os.getenv('CHANGE_JOURNAL_ROTATE_MB', '16')) * 1024 * 1024)
+
+_write_lock = threading.Lock()
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+# ─── Writers ───────────────────────────────────────────────
+
+def record_changes(event, customers=(), conversations=(), path=JOURNAL_PATH):
+    """Append one line per touched customer / conversation. Never raises."""
+    now = round(time.time(), 3)
+    lines = [json.dumps({"t": now, "event": event, "customer": str(c)}, ensure_ascii=False) for c in customers if c]
+    lines += [json.dumps({"t": now, "event": event, "conversation": str(c)}, ensure_ascii=False) for c in conversations if c]
+    if not lines: return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        with _write_lock:
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+    except Exception as e:
+        print(f"[Journal] Write Error: {e}")
+
+def record_change(event, customer=None, conversation=None, path=JOURNAL_PATH):
+    record_changes(event, [customer] if customer else (), [conversation] if conversation else (), path)
+
+
+# ─── Readers ───────────────────────────────────────────────
+
+def _read_from(path, offset):
+    """Complete lines from `offset` on -> (entries, offset after the last complete line)."""
+    entries = []
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for raw in f:
+            if not raw.endswith(b'\n'):
+                break  # a writer is mid-line; pick it up next time
+            offset += len(raw)
+            try:
+                entries.append(json.loads(raw))
+            except ValueError:
+                continue
+    return entries, offset
+
+
+class JournalReader:
+    def __init__(self, consumer, path=JOURNAL_PATH):
+        self.path = path
+        self.rotated_path = f"{path}.1"
+        self.state_path = f"{path}.{consumer}.state.json"
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def end_position(self):
+        st = _stat(self.path)
+        return {"inode": st.st_ino if st else None, "offset": st.st_size if st else 0}
+
+    def changes(self):
+        """
+        (entries, position) since the last commit, or (None, position) when
+        there is no usable checkpoint (first run / journal lost) -> full scan.
+        """
+        state = self._load_state()
+        if state is None:
+            return None, self.end_position()
+
+        current = _stat(self.path)
+        entries, offset = [], state.get('offset', 0)
+        if state.get('inode') is not None and (current is None or current.st_ino != state['inode']):
+            rotated = _stat(self.rotated_path)
+            if rotated is None or rotated.st_ino != state['inode']:
+                return None, self.end_position()
+            entries, _ = _read_from(self.rotated_path, offset)
+            offset = 0
+        elif state.get('inode') is None:
+            offset = 0
+
+        if current is None:
+            return entries, {"inode": None, "offset": 0}
+        new_entries, offset = _read_from(self.path, offset)
+        return entries + new_entries, {"inode": current.st_ino, "offset": offset}
+
+    def last_commit_time(self):
+        return (self._load_state() or {}).get('committed_at')
+
+    def commit(self, position):
+        """Persist the checkpoint after the batch was processed; rotate a consumed, large journal."""
+        state = dict(position, committed_at=time.time())
+        st = _stat(self.path)
+        if st and position.get('inode') == st.st_ino and position['offset'] >= ROTATE_BYTES:
+            try:
+                os.replace(self.path, self.rotated_path)  # lines appended meanwhile are read from .1
+            except OSError as e:
+                print(f"[Journal] Rotate Error: {e}")
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_path)
+
+
+def touched(entries, events=None):
+    """
+    ({customer: last t}, {conversation: last t}) from journal entries,
+    optionally filtered by event type.
+    """
+    customers, conversations = {}, {}
+    for e in entries:
+        if events and e.get('event') not in events: continue
+        if e.get('customer'): customers[e['customer']] = e.get('t')
+        if e.get('conversation'): conversations[e['conversation']] = e.get('t')
+    return customers, conversations
+
+
+def mtime_scan(data_dir, since=None, subdir='chathistory'):
+    """
+    Fallback: {folder: last change time} for customer folders whose `subdir`
+    (or a file in it) changed after `since` (epoch seconds). With since=None
+    every folder is returned with time None (nothing is stat'ed). Never parses files.
+    """
+    folders = {}
+    try:
+        entries = list(os.scandir(data_dir))
+    except OSError:
+        return folders
+    for entry in entries:
+        if not entry.is_dir() or entry.name.startswith('.'): continue
+        if since is None:
+            folders[entry.name] = None
+            continue
+        target = os.path.join(entry.path, subdir)
+        try:
+            latest = os.stat(target).st_mtime
+            latest = max([latest] + [f.stat().st_mtime for f in os.scandir(target) if f.is_file()])
+        except OSError:
+            continue
+        if latest > since:
+            folders[entry.name] = latest
+    return folders
+
+
+if __name__ == "__main__":
+    import tempfile
+    path = os.path.join(tempfile.mkdtemp(), 'journal.jsonl')
+    reader = JournalReader('demo', path)
+    print("first run:", reader.changes()[0])
+    reader.commit(reader.end_position())
+    record_change('chat', customer='TVS-CUS-001', conversation='t_1', path=path)
+    record_change('intel', customer='TVS-CUS-002', path=path)
+    entries, position = reader.changes()
+    print(touched(entries, events={'chat'}))
+    reader.commit(position)
+    print("after commit:", reader.changes()[0])
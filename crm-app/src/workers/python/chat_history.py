@@ -0,0 +1,122 @@
+"""
+V-School Incremental Chat Sync
+──────────────────────────────
+Keeps the recent Messenger history of each conversation in memory, with a
+high-water mark (id + created_time of the newest message seen). Each sync
+pages the Graph API newest-first in small pages and stops at the mark, so
+only messages that arrived since the last event are downloaded and handed
+to storage; the per-event payload no longer grows with the conversation.
+
+The mark only advances once storage accepted the delta: if the save fails
+the cached entry is dropped, so the next sync re-seeds from storage and
+fetches the unsaved messages again.
+
+Cold start (worker restart / evicted entry): the history is seeded from
+storage (db_adapter.get_chat_messages) and the mark taken from it; with
+nothing stored, one full page of CHAT_HISTORY_LIMIT messages is fetched.
+
+Config (env):
+  CHAT_HISTORY_LIMIT    messages kept per conversation / passed to the analyzers (default: 50)
+  CHAT_SYNC_PAGE_SIZE   Graph page size for incremental fetches (default: 10)
+  CHAT_HISTORY_CACHE    conversations kept in memory (default: 2000)
+"""
+
+import os
+import threading
+import requests
+
+from cache_store import LRUCache
+from db_adapter import get_chat_messages
+
+GRAPH_URL = "https://graph.facebook.com/v19.0"
+MESSAGE_FIELDS = 'id,message,from,created_time,attachments{id,mime_type,name,file_url,image_data,url}'
+HISTORY_LIMIT = int(os.getenv('CHAT_HISTORY_LIMIT', '50'))
+PAGE_SIZE = int(os.getenv('CHAT_SYNC_PAGE_SIZE', '10'))
+REQUEST_TIMEOUT = 15
+
+_histories = LRUCache(int(os.getenv('CHAT_HISTORY_CACHE', '2000')))
+_merge_lock = threading.Lock()
+_stats = {"incremental": 0, "full": 0, "fetched": 0, "save_failed": 0}
+
+
+def high_water_mark(messages):
+    """{id, created_time} of the newest message, or None."""
+    if not messages: return None
+    return {"id": messages[0].get('id'), "created_time": messages[0].get('created_time', '')}
+
+
+def merge_messages(history, new_messages, limit=HISTORY_LIMIT):
+    """Newest-first union by message id (Graph created_time strings sort chronologically)."""
+    by_id = {m.get('id'): m for m in history}
+    by_id.update((m.get('id'), m) for m in new_messages)
+    return sorted(by_id.values(), key=lambda m: m.get('created_time', ''), reverse=True)[:limit]
+
+
+def fetch_new_messages(conversation_id, access_token, mark=None):
+    """
+    Messages newer than `mark` (newest first, at most HISTORY_LIMIT).
+    Without a mark, the latest HISTORY_LIMIT messages in one page.
+    Raises RuntimeError with the Graph error message on failure.
+    """
+    url = f"{GRAPH_URL}/{conversation_id}/messages"
+    params = {'fields': MESSAGE_FIELDS, 'limit': PAGE_SIZE if mark else HISTORY_LIMIT, 'access_token': access_token}
+    new = []
+    while url and len(new) < HISTORY_LIMIT:
+        response = requests.get(url, params=params, timeout=REQUEST_TIMEOUT)
+        data = response.json()
+        if response.status_code != 200:
+            raise RuntimeError(data.get('error', {}).get('message') or f"HTTP {response.status_code}")
+
+        for msg in data.get('data', []):
+            if mark and (msg.get('id') == mark['id'] or msg.get('created_time', '') < mark['created_time']):
+                return new
+            new.append(msg)
+        if not mark:
+            break
+        url, params = data.get('paging', {}).get('next'), None  # `next` already carries the query
+    return new[:HISTORY_LIMIT]
+
+
+def sync_conversation(conversation_id, access_token, save=None):
+    """
+    Returns (history, delta, saved): the merged recent history (newest first),
+    the messages that were not seen before, and whether `save(delta)` stored
+    them. The cached history (and so the mark) only advances after a
+    successful save; on failure the entry is dropped and the delta is fetched
+    again by the next sync.
+    """
+    history = _histories.get(conversation_id)
+    if history is None:
+        history = get_chat_messages(conversation_id, HISTORY_LIMIT)
+
+    mark = high_water_mark(history)
+    fetched = fetch_new_messages(conversation_id, access_token, mark)
+    with _merge_lock:
+        _stats["incremental" if mark else "full"] += 1
+        _stats["fetched"] += len(fetched)
+        # Another event of the same conversation may have merged meanwhile
+        current = _histories.get(conversation_id) or history
+        known = {m.get('id') for m in current}
+        delta = [m for m in fetched if m.get('id') not in known]
+
+    saved = bool(save(delta)) if (delta and save) else True
+    with _merge_lock:
+        if not saved:
+            _stats["save_failed"] += 1
+            _histories.delete(conversation_id)
+            return merge_messages(current, delta), delta, False
+        merged = merge_messages(_histories.get(conversation_id) or current, delta)
+        _histories.set(conversation_id, merged)
+    return merged, delta, True
+
+
+def get_sync_stats():
+    with _merge_lock:
+        return dict(_stats, conversations=len(_histories))
+
+
+if __name__ == "__main__":
+    history = [{"id": "m2", "created_time": "2026-01-01T10:05:00+0000"},
+               {"id": "m1", "created_time": "2026-01-01T10:00:00+0000"}]
+    new = [{"id": "m3", "created_time": "2026-01-01T10:06:00+0000"}]
+    print(high_water_mark(history), [m['id'] for m in merge_messages(history, new)])
@@ -9,7 +9,7 @@ import os
 import json
 import time
 from datetime import datetime
-from db_adapter import get_all_customers
+from db_adapter import get_all_customers, update_customer_intelligence_bulk
 
 def calculate_churn_risk(customer):
     """
@@ -78,17 +78,16 @@ def run_prediction_batch():
     results = []
     for c in customers:
         risk = calculate_churn_risk(c)
-        # Update intelligence object
-        intel = c.get('intelligence', {})
-        intel['churn_risk'] = risk
-        
-        # In a real scenario, we'd save this back to DB/JSON
-        # We'll simulate the save here for the CLI output
+        if not risk: continue # New/Empty lead
         results.append({
             "id": c.get('id'),
             "name": c.get('name'),
             "risk": risk
         })
+
+    # Persist all scores in one bulk JSONB merge
+    saved = update_customer_intelligence_bulk([(r['id'], {"churn_risk": r['risk']}) for r in results if r['id']])
+    print(f"[Predictor] Saved churn risk for {len(saved)}/{len(results)} customers.")
     
     # Sort by risk score to show top "at-risk" customers
     results.sort(key=lambda x: x['risk']['score'], reverse=True)
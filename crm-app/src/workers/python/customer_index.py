@@ -0,0 +1,305 @@
+"""
+Customer Cache ID Index
+───────────────────────
+O(1) lookup from any customer identifier to its JSON cache folder:
+  - folder name / customer_id   (TVS-CUS-..., FB_CHAT_...)
+  - facebook_id / PSID          (also matched as MSG-{psid})
+  - conversation_id             (chathistory/conv_{id}.json)
+
+The index is persisted to a compact sidecar (`cache/customer_index.json`),
+loaded lazily on first use and kept fresh from directory mtimes:
+  - root mtime changed   -> re-list customer folders (new/removed customers)
+  - folder mtime changed -> re-scan only that folder (profile is re-read
+                            only if its own mtime changed)
+Profiles are never opened on a lookup hit. On a miss, the known folders are
+stat'ed right away (only chathistory/ for a conversation lookup), since a new
+conv or profile file changes its folder's mtimes but not the root's; the
+full root sweep is throttled to CUSTOMER_INDEX_RESCAN_SECS.
+"""
+
+import os
+import json
+import time
+import threading
+
+INDEX_VERSION = 1
+RESCAN_INTERVAL = float(os.getenv('CUSTOMER_INDEX_RESCAN_SECS', '30'))  # throttle for miss-driven sweeps
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _normalize(key):
+    key = str(key).strip()
+    return key[4:] if key.startswith('MSG-') else key
+
+
+class CustomerIndex:
+    def __init__(self, data_dir, index_path=None):
+        self.data_dir = data_dir
+        self.index_path = index_path or os.path.join(os.path.dirname(data_dir), 'customer_index.json')
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._dirty = False
+        self._root_mtime = None
+        self._last_sweep = 0.0
+        self._folders = {}   # folder -> {mtime, chat_mtime, profile, profile_mtime, customer_id, facebook_id, convs}
+        self._keys = {}      # normalized id -> folder
+        self._suffixes = {}  # "-{suffix}" of folder names -> folder (legacy PSID-in-folder-name lookup)
+        self._convs = {}     # conversation_id -> folder
+
+    # ─── Public API ────────────────────────────────────────
+
+    def find_folder(self, customer_id, match_suffix=False):
+        """Absolute folder path for a customer identifier, or None."""
+        key = _normalize(customer_id)
+        folder = self._lookup(lambda: self._keys.get(key) or (self._suffixes.get(key) if match_suffix else None))
+        return os.path.join(self.data_dir, folder) if folder else None
+
+    def find_profile(self, customer_id):
+        """Absolute path of the customer's profile_*.json, or None."""
+        key = _normalize(customer_id)
+        folder = self._lookup(lambda: self._keys.get(key), need_profile=True)
+        if not folder: return None
+        return os.path.join(self.data_dir, folder, self._folders[folder]['profile'])
+
+    def find_conversation(self, conversation_id):
+        """Absolute path of chathistory/conv_{id}.json, or None."""
+        key = str(conversation_id)
+        folder = self._lookup(lambda: self._convs.get(key), conversations=True)
+        if not folder: return None
+        return os.path.join(self.data_dir, folder, 'chathistory', f"conv_{key}.json")
+
+    def profile_paths(self):
+        """Absolute paths of every indexed profile (after a full incremental refresh)."""
+        with self._lock:
+            self._ensure_loaded()
+            if self._refresh(force=True):
+                self._save()
+            return [os.path.join(self.data_dir, folder, entry['profile'])
+                    for folder, entry in self._folders.items() if entry.get('profile')]
+
+    def touch(self, folder_path):
+        """Re-index one folder after an external write (e.g. new conv file)."""
+        folder = os.path.basename(os.path.normpath(folder_path))
+        with self._lock:
+            self._ensure_loaded()
+            self._scan_folder(folder)
+            self._save()
+
+    def refresh(self, force=False):
+        """Incremental refresh; `force` stats every folder even if the root is unchanged."""
+        with self._lock:
+            self._ensure_loaded()
+            self._refresh(force)
+            self._save()
+
+    # ─── Lookup ────────────────────────────────────────────
+
+    def _lookup(self, resolve, need_profile=False, conversations=False):
+        with self._lock:
+            self._ensure_loaded()
+
+            def valid(folder):
+                if not folder or folder not in self._folders: return False
+                if need_profile and not self._folders[folder]['profile']: return False
+                return os.path.isdir(os.path.join(self.data_dir, folder))
+
+            folder = resolve()
+            if valid(folder): return folder
+
+            # Miss (or stale hit): cheap root check first, full stat sweep at most every RESCAN_INTERVAL
+            force = time.monotonic() - self._last_sweep >= RESCAN_INTERVAL
+            changed = self._refresh(force)
+            folder = resolve()
+            if not force and not valid(folder):
+                # Files added inside an existing folder don't change the root mtime
+                changed |= self._rescan_changed(conversations)
+                folder = resolve()
+            if changed:
+                self._save()
+            return folder if valid(folder) else None
+
+    # ─── Maintenance ───────────────────────────────────────
+
+    def _ensure_loaded(self):
+        if self._loaded: return
+        self._loaded = True
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == INDEX_VERSION and data.get('data_dir') == self.data_dir:
+                self._root_mtime = data.get('root_mtime')
+                self._folders = data.get('folders', {})
+                for folder in self._folders:
+                    self._register(folder)
+        except (OSError, ValueError):
+            pass
+        # First load (or unreadable sidecar) -> full build
+        self._refresh(force=not self._folders)
+        self._save()
+
+    def _refresh(self, force):
+        """Returns True if anything changed."""
+        root_mtime = _mtime(self.data_dir)
+        if root_mtime is None:
+            changed = bool(self._folders)
+            for folder in list(self._folders):
+                self._drop(folder)
+            return changed
+        if not force and root_mtime == self._root_mtime:
+            return False
+
+        changed = False
+        seen = set()
+        with os.scandir(self.data_dir) as it:
+            for entry in it:
+                if entry.name.startswith('.') or not entry.is_dir(): continue
+                seen.add(entry.name)
+                known = self._folders.get(entry.name)
+                if known is None or (force and self._folder_changed(entry.name, known)):
+                    changed |= self._scan_folder(entry.name)
+        for folder in set(self._folders) - seen:
+            self._drop(folder)
+            changed = True
+
+        self._root_mtime = root_mtime
+        self._last_sweep = time.monotonic()
+        self._dirty |= changed
+        return changed
+
+    def _rescan_changed(self, conversations):
+        """Re-scan known folders whose mtimes moved (only chathistory/ for conversation lookups)."""
+        changed = False
+        for folder, known in list(self._folders.items()):
+            if conversations:
+                stale = _mtime(os.path.join(self.data_dir, folder, 'chathistory')) != known.get('chat_mtime')
+            else:
+                stale = self._folder_changed(folder, known)
+            if stale:
+                changed |= self._scan_folder(folder)
+        self._dirty |= changed
+        return changed
+
+    def _folder_changed(self, folder, known):
+        path = os.path.join(self.data_dir, folder)
+        if _mtime(path) != known.get('mtime'): return True
+        if _mtime(os.path.join(path, 'chathistory')) != known.get('chat_mtime'): return True
+        profile = known.get('profile')
+        return bool(profile) and _mtime(os.path.join(path, profile)) != known.get('profile_mtime')
+
+    def _scan_folder(self, folder):
+        path = os.path.join(self.data_dir, folder)
+        mtime = _mtime(path)
+        if mtime is None:
+            if folder in self._folders:
+                self._drop(folder)
+                return True
+            return False
+
+        old = self._folders.get(folder) or {}
+        try:
+            names = os.listdir(path)
+        except OSError:
+            names = []
+        profiles = sorted(n for n in names if n.startswith('profile_') and n.endswith('.json'))
+        profile = f"profile_{folder}.json" if f"profile_{folder}.json" in profiles else (profiles[0] if profiles else None)
+        profile_mtime = _mtime(os.path.join(path, profile)) if profile else None
+
+        customer_id, facebook_id = old.get('customer_id'), old.get('facebook_id')
+        if profile != old.get('profile') or profile_mtime != old.get('profile_mtime'):
+            customer_id = facebook_id = None
+            if profile:
+                try:
+                    with open(os.path.join(path, profile), 'r', encoding='utf-8') as f:
+                        p = json.load(f)
+                    customer_id = p.get('customer_id')
+                    facebook_id = p.get('contact_info', {}).get('facebook_id') or p.get('facebook_id')
+                except (OSError, ValueError):
+                    pass
+
+        history_dir = os.path.join(path, 'chathistory')
+        chat_mtime = _mtime(history_dir)
+        if chat_mtime is not None and chat_mtime == old.get('chat_mtime'):
+            convs = old.get('convs', [])
+        else:
+            try:
+                convs = [n[5:-5] for n in os.listdir(history_dir) if n.startswith('conv_') and n.endswith('.json')]
+            except OSError:
+                convs = []
+
+        entry = {
+            "mtime": mtime, "chat_mtime": chat_mtime,
+            "profile": profile, "profile_mtime": profile_mtime,
+            "customer_id": str(customer_id) if customer_id else None,
+            "facebook_id": str(facebook_id) if facebook_id else None,
+            "convs": convs,
+        }
+        if entry == old: return False
+
+        self._unregister(folder)
+        self._folders[folder] = entry
+        self._register(folder)
+        self._dirty = True
+        return True
+
+    @staticmethod
+    def _entry_keys(folder, entry):
+        # Folder name last so a direct match is never shadowed by profile fields
+        keys = [_normalize(k) for k in (entry.get('facebook_id'), entry.get('customer_id'), folder) if k]
+        suffixes = [folder[i + 1:] for i, ch in enumerate(folder) if ch == '-']
+        return keys, suffixes, entry.get('convs', [])
+
+    def _register(self, folder):
+        keys, suffixes, convs = self._entry_keys(folder, self._folders[folder])
+        for key in keys:
+            self._keys[key] = folder
+        for suffix in suffixes:
+            self._suffixes.setdefault(suffix, folder)
+        for conv in convs:
+            self._convs[conv] = folder
+
+    def _unregister(self, folder):
+        entry = self._folders.get(folder)
+        if not entry: return
+        keys, suffixes, convs = self._entry_keys(folder, entry)
+        for table, names in ((self._keys, keys), (self._suffixes, suffixes), (self._convs, convs)):
+            for name in names:
+                if table.get(name) == folder:
+                    del table[name]
+
+    def _drop(self, folder):
+        self._unregister(folder)
+        self._folders.pop(folder, None)
+        self._dirty = True
+
+    def _save(self):
+        if not self._dirty: return
+        tmp = f"{self.index_path}.{os.getpid()}.tmp"  # per process: workers share the sidecar
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "version": INDEX_VERSION,
+                    "data_dir": self.data_dir,
+                    "root_mtime": self._root_mtime,
+                    "folders": self._folders,
+                }, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp, self.index_path)
+            self._dirty = False
+        except OSError as e:
+            print(f"[CustomerIndex] Save Error: {e}")
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_customer_index(data_dir):
+    """Process-wide index for a cache directory (created lazily)."""
+    with _indexes_lock:
+        if data_dir not in _indexes:
+            _indexes[data_dir] = CustomerIndex(data_dir)
+        return _indexes[data_dir]
@@ -16,7 +16,7 @@ import json
 import sys
 import uuid # For generating CUID/UUIDs
 from datetime import datetime, date
-from db_adapter import get_db_conn # Import for SQL access
+from db_adapter import db_cursor, DB_ADAPTER # Import for SQL access
 
 # ─── Check Optional Dependencies ───────────────────────────
 try:
@@ -552,130 +552,129 @@ def save_ad_data_to_db(data):
     """
     if not data: return False
     
-    conn = get_db_conn()
-    if not conn:
+    if DB_ADAPTER != 'prisma':
         print("[Error] No DB Connection available (DB_ADAPTER != prisma?)")
         return False
         
     try:
-        cur = conn.cursor()
+        # One pooled connection for the whole sync, returned (and committed) on exit
+        with db_cursor() as cur:
+            # 1. UPSERT AdAccount (We assume current account for now, or extract from data if available)
+            # For this script, we passed ad_account_id to fetch, we should probably pass it here too or just handle it.
+            # Ideally, we upsert campaigns first and link them.
         
-        # 1. UPSERT AdAccount (We assume current account for now, or extract from data if available)
-        # For this script, we passed ad_account_id to fetch, we should probably pass it here too or just handle it.
-        # Ideally, we upsert campaigns first and link them.
-        
-        # 2. UPSERT Campaigns
-        # Schema: id, name, status, objective, startDate, endDate, createdAt, updatedAt
-        print(f"💾 Saving {len(data['campaigns'])} Campaigns...")
-        for c in data['campaigns']:
-            cur.execute("""
-                INSERT INTO campaigns (id, name, status, objective, start_date, created_at, updated_at)
-                VALUES (%s, %s, %s, %s, %s, NOW(), NOW())
-                ON CONFLICT (id) DO UPDATE SET
-                    name = EXCLUDED.name,
-                    status = EXCLUDED.status,
-                    objective = EXCLUDED.objective,
-                    start_date = EXCLUDED.start_date,
-                    updated_at = NOW();
-            """, (
-                c.get('id'),
-                c.get('name'),
-                c.get('status'),
-                c.get('objective'),
-                c.get('start_time') # FB returns ISO string or None
-            ))
-            
-        # 3. UPSERT AdSets
-        # Schema: id, adSetId, name, status, campaignId, dailyBudget, targeting
-        print(f"💾 Saving {len(data['adsets'])} AdSets...")
-        for a in data['adsets']:
-            # Try to find existing by adSetId
-            cur.execute("SELECT id FROM ad_sets WHERE ad_set_id = %s", (a.get('id'),))
-            res = cur.fetchone()
-            
-            if res:
-                # Update
+            # 2. UPSERT Campaigns
+            # Schema: id, name, status, objective, startDate, endDate, createdAt, updatedAt
+            print(f"💾 Saving {len(data['campaigns'])} Campaigns...")
+            for c in data['campaigns']:
                 cur.execute("""
-                    UPDATE ad_sets SET 
-                        name = %s, status = %s, daily_budget = %s, targeting = %s, updated_at = NOW()
-                    WHERE ad_set_id = %s
+                    INSERT INTO campaigns (id, name, status, objective, start_date, created_at, updated_at)
+                    VALUES (%s, %s, %s, %s, %s, NOW(), NOW())
+                    ON CONFLICT (id) DO UPDATE SET
+                        name = EXCLUDED.name,
+                        status = EXCLUDED.status,
+                        objective = EXCLUDED.objective,
+                        start_date = EXCLUDED.start_date,
+                        updated_at = NOW();
                 """, (
-                    a.get('name'), a.get('status'), int(a.get('daily_budget') or 0)/100, 
-                    json.dumps(a.get('targeting') or {}), a.get('id')
+                    c.get('id'),
+                    c.get('name'),
+                    c.get('status'),
+                    c.get('objective'),
+                    c.get('start_time') # FB returns ISO string or None
                 ))
-            else:
-                # Insert
-                new_id = f"c{uuid.uuid4().hex}" # Pseudo-CUID
+            
+            # 3. UPSERT AdSets
+            # Schema: id, adSetId, name, status, campaignId, dailyBudget, targeting
+            print(f"💾 Saving {len(data['adsets'])} AdSets...")
+            for a in data['adsets']:
+                # Try to find existing by adSetId
+                cur.execute("SELECT id FROM ad_sets WHERE ad_set_id = %s", (a.get('id'),))
+                res = cur.fetchone()
+            
+                if res:
+                    # Update
+                    cur.execute("""
+                        UPDATE ad_sets SET 
+                            name = %s, status = %s, daily_budget = %s, targeting = %s, updated_at = NOW()
+                        WHERE ad_set_id = %s
+                    """, (
+                        a.get('name'), a.get('status'), int(a.get('daily_budget') or 0)/100, 
+                        json.dumps(a.get('targeting') or {}), a.get('id')
+                    ))
+                else:
+                    # Insert
+                    new_id = f"c{uuid.uuid4().hex}" # Pseudo-CUID
+                    cur.execute("""
+                        INSERT INTO ad_sets (id, ad_set_id, campaign_id, name, status, daily_budget, targeting, created_at, updated_at)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+                    """, (
+                        new_id, a.get('id'), a.get('campaign_id'), 
+                        a.get('name'), a.get('status'), int(a.get('daily_budget') or 0)/100,
+                        json.dumps(a.get('targeting') or {})
+                    ))
+
+            # 4. UPSERT Creatives
+            # Schema: id, name, body, headline, imageUrl, videoUrl, callToAction
+            print(f"💾 Saving {len(data['creatives'])} Creatives...")
+            for c in data['creatives']:
                 cur.execute("""
-                    INSERT INTO ad_sets (id, ad_set_id, campaign_id, name, status, daily_budget, targeting, created_at, updated_at)
+                    INSERT INTO ad_creatives (id, name, body, headline, image_url, video_url, call_to_action, created_at, updated_at)
                     VALUES (%s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+                    ON CONFLICT (id) DO UPDATE SET
+                        name = EXCLUDED.name,
+                        body = EXCLUDED.body,
+                        headline = EXCLUDED.headline,
+                        image_url = EXCLUDED.image_url,
+                        video_url = EXCLUDED.video_url,
+                        call_to_action = EXCLUDED.call_to_action,
+                        updated_at = NOW();
                 """, (
-                    new_id, a.get('id'), a.get('campaign_id'), 
-                    a.get('name'), a.get('status'), int(a.get('daily_budget') or 0)/100,
-                    json.dumps(a.get('targeting') or {})
+                    c.get('id'), # FB Creative ID as Primary Key
+                    c.get('name'),
+                    c.get('body'),
+                    c.get('title'),
+                    c.get('image_url') or c.get('thumbnail_url'),
+                    c.get('video_url'), 
+                    c.get('call_to_action_type')
                 ))
 
-        # 4. UPSERT Creatives
-        # Schema: id, name, body, headline, imageUrl, videoUrl, callToAction
-        print(f"💾 Saving {len(data['creatives'])} Creatives...")
-        for c in data['creatives']:
-            cur.execute("""
-                INSERT INTO ad_creatives (id, name, body, headline, image_url, video_url, call_to_action, created_at, updated_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
-                ON CONFLICT (id) DO UPDATE SET
-                    name = EXCLUDED.name,
-                    body = EXCLUDED.body,
-                    headline = EXCLUDED.headline,
-                    image_url = EXCLUDED.image_url,
-                    video_url = EXCLUDED.video_url,
-                    call_to_action = EXCLUDED.call_to_action,
-                    updated_at = NOW();
-            """, (
-                c.get('id'), # FB Creative ID as Primary Key
-                c.get('name'),
-                c.get('body'),
-                c.get('title'),
-                c.get('image_url') or c.get('thumbnail_url'),
-                c.get('video_url'), 
-                c.get('call_to_action_type')
-            ))
-
-        # 5. UPSERT Ads
-        # Schema: id, adId, name, status, adSetId, creativeId, spend, etc.
-        print(f"💾 Saving {len(data['ads'])} Ads...")
-        for ad in data['ads']:
-            # Lookup AdSet CUID
-            cur.execute("SELECT id FROM ad_sets WHERE ad_set_id = %s", (ad.get('adset_id'),))
-            res_set = cur.fetchone()
-            if not res_set:
-                print(f"[Warn] AdSet {ad.get('adset_id')} not found for Ad {ad.get('name')}")
-                continue
-            real_adset_id = res_set[0]
+            # 5. UPSERT Ads
+            # Schema: id, adId, name, status, adSetId, creativeId, spend, etc.
+            print(f"💾 Saving {len(data['ads'])} Ads...")
+            for ad in data['ads']:
+                # Lookup AdSet CUID
+                cur.execute("SELECT id FROM ad_sets WHERE ad_set_id = %s", (ad.get('adset_id'),))
+                res_set = cur.fetchone()
+                if not res_set:
+                    print(f"[Warn] AdSet {ad.get('adset_id')} not found for Ad {ad.get('name')}")
+                    continue
+                real_adset_id = res_set[0]
             
-            # Lookup Creative ID
-            creative_fb_id = ad.get('creative', {}).get('id')
+                # Lookup Creative ID
+                creative_fb_id = ad.get('creative', {}).get('id')
             
-            # Upsert Ad
-            cur.execute("SELECT id FROM ads WHERE ad_id = %s", (ad.get('id'),))
-            res_ad = cur.fetchone()
+                # Upsert Ad
+                cur.execute("SELECT id FROM ads WHERE ad_id = %s", (ad.get('id'),))
+                res_ad = cur.fetchone()
             
-            if res_ad:
-                cur.execute("""
-                    UPDATE ads SET 
-                        name = %s, status = %s, ad_set_id = %s, creative_id = %s, updated_at = NOW()
-                    WHERE ad_id = %s
-                """, (
-                    ad.get('name'), ad.get('status'), real_adset_id, creative_fb_id, ad.get('id')
-                ))
-            else:
-                new_ad_uuid = f"ad{uuid.uuid4().hex}"
-                cur.execute("""
-                    INSERT INTO ads (id, ad_id, name, status, ad_set_id, creative_id, created_at, updated_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, NOW(), NOW())
-                """, (
-                    new_ad_uuid, ad.get('id'), ad.get('name'), ad.get('status'), 
-                    real_adset_id, creative_fb_id
-                ))
+                if res_ad:
+                    cur.execute("""
+                        UPDATE ads SET 
+                            name = %s, status = %s, ad_set_id = %s, creative_id = %s, updated_at = NOW()
+                        WHERE ad_id = %s
+                    """, (
+                        ad.get('name'), ad.get('status'), real_adset_id, creative_fb_id, ad.get('id')
+                    ))
+                else:
+                    new_ad_uuid = f"ad{uuid.uuid4().hex}"
+                    cur.execute("""
+                        INSERT INTO ads (id, ad_id, name, status, ad_set_id, creative_id, created_at, updated_at)
+                        VALUES (%s, %s, %s, %s, %s, %s, NOW(), NOW())
+                    """, (
+                        new_ad_uuid, ad.get('id'), ad.get('name'), ad.get('status'), 
+                        real_adset_id, creative_fb_id
+                    ))
         
         print("✅ Database Population Complete!")
 
@@ -11,112 +11,277 @@ Supports:
 import os
 import json
 import time
+import threading
+from datetime import datetime, timezone
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from customer_index import get_customer_index
+from change_journal import record_change, record_changes
 
 load_dotenv()
 
 DB_ADAPTER = os.getenv('DB_ADAPTER', 'json')
 DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'cache', 'customer'))
 
-# ─── PostgreSQL / Supabase Connection ──────────────────────
-_conn = None
+# ─── PostgreSQL / Supabase Connection Pool ─────────────────
+# Bounded pool shared by all worker threads. Checkout blocks when the pool
+# is exhausted instead of raising, and idle connections are pinged before
+# reuse so Supabase idle drops are replaced transparently.
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = max(DB_POOL_MIN, int(os.getenv('DB_POOL_MAX', '5')))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))        # seconds to wait for a free connection
+DB_PING_AFTER_IDLE = float(os.getenv('DB_PING_AFTER_IDLE', '30'))  # seconds idle before liveness check
 
-def get_db_conn():
-    global _conn
+BULK_PAGE_SIZE = int(os.getenv('DB_BULK_PAGE_SIZE', '1000'))      # rows per execute_values statement
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+_last_used = {}               # id(conn) -> time.monotonic() when returned to the pool
+
+def _get_pool():
+    global _pool
     if DB_ADAPTER != 'prisma': return None
-    
-    if not _conn:
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                try:
+                    from psycopg2.pool import ThreadedConnectionPool
+                    _pool = ThreadedConnectionPool(
+                        DB_POOL_MIN, DB_POOL_MAX, os.getenv('DATABASE_URL'),
+                        keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3
+                    )
+                    print(f"[DB/Python] Connected to PostgreSQL/Supabase (pool {DB_POOL_MIN}-{DB_POOL_MAX})")
+                except Exception as e:
+                    print(f"[DB/Python] Connection failed: {e}")
+                    return None
+    return _pool
+
+def _is_alive(conn):
+    if conn.closed: return False
+    last_used = _last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < DB_PING_AFTER_IDLE:
+        return True  # freshly opened or recently used
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        if not conn.autocommit: conn.rollback()
+        return True
+    except Exception:
+        return False
+
+def _checkout():
+    pool = _get_pool()
+    if not pool:
+        raise RuntimeError("Database pool unavailable")
+    if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise RuntimeError(f"Timed out waiting for a DB connection ({DB_POOL_MAX} in use)")
+    try:
+        # Stale connections are discarded; the pool opens a fresh one (reconnect)
+        for _ in range(DB_POOL_MAX + 1):
+            conn = pool.getconn()
+            if _is_alive(conn): return conn
+            print("[DB/Python] Dropping stale connection, reconnecting...")
+            _last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+        raise RuntimeError("Could not obtain a live DB connection")
+    except Exception:
+        _pool_slots.release()
+        raise
+
+def _release(conn, broken=False):
+    try:
+        if broken or conn.closed:
+            _last_used.pop(id(conn), None)
+            _pool.putconn(conn, close=True)
+        else:
+            _last_used[id(conn)] = time.monotonic()
+            _pool.putconn(conn)
+    finally:
+        _pool_slots.release()
+
+def _is_connection_error(e):
+    try:
+        import psycopg2
+        return isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+    except ImportError:
+        return False
+
+@contextmanager
+def db_transaction():
+    """
+    Checks out a pooled connection for one transaction.
+    Commits on success, rolls back on error, and always returns the connection.
+    Raises RuntimeError if the database is unavailable.
+    """
+    conn = _checkout()
+    broken = False
+    try:
+        conn.autocommit = False
+        yield conn
+        conn.commit()
+    except Exception as e:
+        broken = _is_connection_error(e)
+        if not conn.closed:
+            try: conn.rollback()
+            except Exception: broken = True
+        raise
+    finally:
+        _release(conn, broken)
+
+@contextmanager
+def db_cursor():
+    """
+    Scoped cursor inside its own transaction (see db_transaction).
+    """
+    with db_transaction() as conn:
+        cur = conn.cursor()
         try:
-            import psycopg2
-            from psycopg2.extras import Json
-            db_url = os.getenv('DATABASE_URL')
-            _conn = psycopg2.connect(db_url)
-            _conn.autocommit = True
-            print("[DB/Python] Connected to PostgreSQL/Supabase")
-        except Exception as e:
-            print(f"[DB/Python] Connection failed: {e}")
-            return None
-    return _conn
+            yield cur
+        finally:
+            cur.close()
 
 # ═══════════════════════════════════════════════════════════
 #  CUSTOMERS
 # ═══════════════════════════════════════════════════════════
 
+# Stamp computed by PostgreSQL so concurrent writers agree on the clock
+_SQL_AI_STAMP = """jsonb_build_object('last_ai_update', to_char(NOW() AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"'))"""
+
 def update_customer_intelligence(customer_id, intel_data):
     """
     Updates the intelligence field of a customer.
-    Supports both JSON and SQL backends.
+    Supports both JSON and SQL backends. Journaled only once the write succeeded.
     """
     if DB_ADAPTER == 'prisma':
-        conn = get_db_conn()
-        if conn:
-            try:
-                from psycopg2.extras import Json
-                cur = conn.cursor()
-                # We use the JSONB update operator or just MERGE in SQL
-                # For simplicity, we fetch, merge, and update
-                cur.execute("SELECT intelligence FROM customers WHERE customer_id = %s", (customer_id,))
-                res = cur.fetchone()
-                if res:
-                    existing_intel = res[0] or {}
-                    existing_intel.update(intel_data)
-                    existing_intel['last_ai_update'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
-                    
-                    cur.execute(
-                        "UPDATE customers SET intelligence = %s, updated_at = NOW() WHERE customer_id = %s",
-                        (Json(existing_intel), customer_id)
-                    )
-                    return True
-            except Exception as e:
-                print(f"[DB/Python] SQL Update Error: {e}")
+        try:
+            from psycopg2.extras import Json
+            with db_cursor() as cur:
+                # Single-statement JSONB merge: no read-modify-write window for
+                # concurrent writers (worker vs. batch auditor) to lose updates
+                cur.execute(f"""
+                    UPDATE customers
+                    SET intelligence = COALESCE(intelligence, '{{}}'::jsonb) || %s::jsonb || {_SQL_AI_STAMP},
+                        updated_at = NOW()
+                    WHERE customer_id = %s
+                """, (Json(intel_data), customer_id))
+                updated = cur.rowcount > 0
+            if updated:
+                record_change('intel', customer=customer_id)
+                return True
+        except Exception as e:
+            print(f"[DB/Python] SQL Update Error: {e}")
     
     # JSON Fallback
-    return update_customer_intelligence_json(customer_id, intel_data)
+    saved = update_customer_intelligence_json(customer_id, intel_data)
+    if saved: record_change('intel', customer=customer_id)
+    return saved
 
-def update_customer_intelligence_json(customer_id, intel_data):
-    if not os.path.exists(DATA_DIR): return False
-    
-    # 1. Try Direct Match (Case for TVS-CUS IDs or exact folder names)
-    direct_folder = os.path.join(DATA_DIR, str(customer_id))
-    if os.path.exists(direct_folder):
-        profile_path = os.path.join(direct_folder, f"profile_{customer_id}.json")
-        if os.path.exists(profile_path):
-            return _perform_json_update(profile_path, intel_data)
-
-    # 2. Try Scan-and-Match (Case for Facebook IDs or Legacy IDs)
-    for folder in os.listdir(DATA_DIR):
-        folder_path = os.path.join(DATA_DIR, folder)
-        if not os.path.isdir(folder_path): continue
-        
-        # Look for profile_*.json
-        profile_files = [f for f in os.listdir(folder_path) if f.startswith('profile_') and f.endsWith('.json')]
-        if not profile_files: continue
-        
-        profile_path = os.path.join(folder_path, profile_files[0])
+def update_customer_intelligence_bulk(updates):
+    """
+    Merges many (customer_id, intel_patch) pairs in one statement.
+    Patches for the same customer are merged in order before sending.
+    Returns the set of customer_ids that were updated (SQL or JSON fallback).
+    """
+    merged = {}
+    for customer_id, patch in updates:
+        merged.setdefault(str(customer_id), {}).update(patch)
+    if not merged: return set()
+
+    updated = set()
+    if DB_ADAPTER == 'prisma':
+        try:
+            from psycopg2.extras import Json, execute_values
+            with db_cursor() as cur:
+                rows = execute_values(cur, f"""
+                    UPDATE customers AS c
+                    SET intelligence = COALESCE(c.intelligence, '{{}}'::jsonb) || v.patch || {_SQL_AI_STAMP},
+                        updated_at = NOW()
+                    FROM (VALUES %s) AS v(customer_id, patch)
+                    WHERE c.customer_id = v.customer_id
+                    RETURNING c.customer_id
+                """, [(cid, Json(patch)) for cid, patch in merged.items()],
+                    template="(%s, %s::jsonb)", page_size=len(merged), fetch=True)
+                updated = {row[0] for row in rows}
+        except Exception as e:
+            print(f"[DB/Python] SQL Bulk Update Error: {e}")
+
+    # JSON Fallback for anything the DB did not match
+    for customer_id, patch in merged.items():
+        if customer_id not in updated and update_customer_intelligence_json(customer_id, patch):
+            updated.add(customer_id)
+    record_changes('intel', customers=updated)  # only what was actually written
+    return updated
+
+def get_all_customers():
+    """
+    Returns flat customer dicts for batch jobs:
+    {id, name, updated_at (ISO), intelligence, total_spend}
+    """
+    if DB_ADAPTER == 'prisma':
+        try:
+            with db_cursor() as cur:
+                cur.execute("""
+                    SELECT c.customer_id, c.first_name, c.last_name, c.facebook_name, c.updated_at, c.intelligence,
+                           COALESCE(SUM(o.paid_amount), 0)
+                    FROM customers c
+                    LEFT JOIN orders o ON o.customer_id = c.id
+                    GROUP BY c.id
+                """)
+                return [{
+                    "id": row[0],
+                    "name": f"{row[1] or ''} {row[2] or ''}".strip() or row[3] or row[0],
+                    "updated_at": row[4].strftime('%Y-%m-%dT%H:%M:%SZ') if row[4] else None,
+                    "intelligence": row[5] or {},
+                    "total_spend": float(row[6] or 0)
+                } for row in cur.fetchall()]
+        except Exception as e:
+            print(f"[DB/Python] SQL Customers Error: {e}")
+
+    # JSON Fallback
+    if not os.path.exists(DATA_DIR): return []
+    customers = []
+    for profile_path in get_customer_index(DATA_DIR).profile_paths():
         try:
             with open(profile_path, 'r', encoding='utf-8') as f:
-                profile = json.load(f)
-            
-            # Match by ID or Facebook ID
-            fb_id = profile.get('contact_info', {}).get('facebook_id') or profile.get('facebook_id')
-            if str(customer_id) == str(fb_id) or str(customer_id).replace('MSG-', '') == str(fb_id):
-                return _perform_json_update(profile_path, intel_data)
+                p = json.load(f)
         except Exception:
             continue
-            
+        info = p.get('profile', {})
+        intel = p.get('intelligence', {})
+        customers.append({
+            "id": p.get('customer_id') or os.path.basename(os.path.dirname(profile_path)),
+            "name": f"{info.get('first_name', '')} {info.get('last_name', '')}".strip() or p.get('customer_id'),
+            "updated_at": p.get('updated_at') or intel.get('last_ai_update'),
+            "intelligence": intel,
+            "total_spend": intel.get('metrics', {}).get('total_spend', 0)
+        })
+    return customers
+
+def update_customer_intelligence_json(customer_id, intel_data):
+    if not os.path.exists(DATA_DIR): return False
+    
+    # Index covers direct folder names (TVS-CUS IDs) and Facebook/Legacy IDs
+    profile_path = _find_profile_path(customer_id)
+    if profile_path:
+        return _perform_json_update(profile_path, intel_data)
     return False
 
+# Read-modify-write of profile JSON; event steps update the same customer concurrently
+_json_update_lock = threading.Lock()
+
 def _perform_json_update(profile_path, intel_data):
     try:
-        with open(profile_path, 'r', encoding='utf-8') as f:
-            profile = json.load(f)
-        
-        if 'intelligence' not in profile: profile['intelligence'] = {}
-        profile['intelligence'].update(intel_data)
-        profile['intelligence']['last_ai_update'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
-        
-        with open(profile_path, 'w', encoding='utf-8') as f:
-            json.dump(profile, f, indent=4, ensure_ascii=False)
+        with _json_update_lock:
+            with open(profile_path, 'r', encoding='utf-8') as f:
+                profile = json.load(f)
+
+            if 'intelligence' not in profile: profile['intelligence'] = {}
+            profile['intelligence'].update(intel_data)
+            profile['intelligence']['last_ai_update'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+            with open(profile_path, 'w', encoding='utf-8') as f:
+                json.dump(profile, f, indent=4, ensure_ascii=False)
         return True
     except Exception as e:
         print(f"[DB/JSON] Update Error: {e}")
@@ -126,30 +291,127 @@ def _perform_json_update(profile_path, intel_data):
 #  CHATS
 # ═══════════════════════════════════════════════════════════
 
+def _graph_time(dt):
+    """DB timestamp -> Graph API created_time format (UTC, '+0000')."""
+    if dt is None: return ''
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc)
+    return dt.strftime('%Y-%m-%dT%H:%M:%S+0000')
+
+def get_chat_messages(conversation_id, limit=50):
+    """
+    Stored history of a conversation, newest first, in Graph API message shape.
+    Seeds the incremental sync (chat_history.py) after a worker restart.
+    """
+    if DB_ADAPTER == 'prisma':
+        try:
+            with db_cursor() as cur:
+                cur.execute("""
+                    SELECT m.message_id, m.content, m.from_id, m.from_name, m.created_at,
+                           m.attachment_id, m.attachment_type, m.attachment_url
+                    FROM messages m JOIN conversations c ON c.id = m.conversation_id
+                    WHERE c.conversation_id = %s
+                    ORDER BY m.created_at DESC LIMIT %s
+                """, (conversation_id, limit))
+                rows = cur.fetchall()
+            messages = []
+            for msg_id, content, from_id, from_name, created_at, att_id, att_type, att_url in rows:
+                msg = {"id": msg_id, "message": content or '', "from": {"id": from_id, "name": from_name},
+                       "created_time": _graph_time(created_at)}
+                if att_id or att_url:
+                    msg["attachments"] = {"data": [{"id": att_id, "mime_type": att_type, "image_data": {"url": att_url}}]}
+                messages.append(msg)
+            return messages
+        except Exception as e:
+            print(f"[DB/Python] SQL Chat Read Error: {e}")
+
+    if not os.path.exists(DATA_DIR): return []
+    conv_file = get_customer_index(DATA_DIR).find_conversation(conversation_id)
+    if not conv_file: return []
+    try:
+        with open(conv_file, 'r', encoding='utf-8') as f:
+            return (json.load(f).get('messages') or {}).get('data', [])[:limit]
+    except Exception:
+        return []
+
+FB_PAGE_ID = os.getenv('FB_PAGE_ID')
+
+def _parse_graph_time(value):
+    """Graph created_time ('2026-01-01T10:00:00+0000') -> naive UTC datetime, as Prisma stores it."""
+    try:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S%z').astimezone(timezone.utc).replace(tzinfo=None)
+    except (TypeError, ValueError):
+        return datetime.utcnow()
+
+def _message_row(msg_id, conv_pk, msg):
+    attachment = ((msg.get('attachments') or {}).get('data') or [{}])[0]
+    url = ((attachment.get('image_data') or {}).get('url') or (attachment.get('video_data') or {}).get('url')
+           or attachment.get('file_url'))
+    sender = msg.get('from') or {}
+    return (msg_id, msg.get('id'), conv_pk, sender.get('id'), sender.get('name'), msg.get('message'),
+            bool(attachment), attachment.get('id'), attachment.get('mime_type'), url,
+            _parse_graph_time(msg.get('created_time')))
+
+def _unread_change(inserted, participant_id):
+    """
+    (reset, count) from newly inserted (from_id, created_at) rows: a page reply
+    marks the thread read, customer messages after it count as unread.
+    """
+    reset, count = False, 0
+    for from_id, _ in sorted(inserted, key=lambda r: r[1]):
+        from_page = from_id == FB_PAGE_ID if FB_PAGE_ID else from_id != participant_id
+        if from_page:
+            reset, count = True, 0
+        else:
+            count += 1
+    return reset, count
+
 def save_chat_messages(conversation_id, messages):
     """
-    Saves synced chat messages to the DB or JSON cache.
+    Saves newly synced chat messages (the delta since the last sync) to the DB or JSON cache.
+    SQL: the conversation is upserted by conversation_id, messages are bulk
+    inserted (existing message_ids are skipped), and last_message_at /
+    unread_count are updated, all in one transaction.
     """
+    if messages: record_change('chat', conversation=conversation_id)
     if DB_ADAPTER == 'prisma':
-        conn = get_db_conn()
-        if conn:
-            try:
-                from psycopg2.extras import Json
-                cur = conn.cursor()
-                # Upsert conversation
+        import secrets
+        def cuid(): return "c" + secrets.token_hex(12)
+        participant_id = str(conversation_id)
+        if participant_id.startswith('t_'): participant_id = participant_id[2:]  # only the thread prefix
+        try:
+            from psycopg2.extras import execute_values
+            with db_cursor() as cur:
                 cur.execute("""
-                    INSERT INTO conversations (id, updated_at) 
-                    VALUES (%s, NOW()) 
-                    ON CONFLICT (id) DO UPDATE SET updated_at = NOW()
-                """, (conversation_id,))
-                
-                # In a real system, we'd loop and insert each message into 'messages' table.
-                # For Phase 6 simplification, we can store as a JSON blob if needed, 
-                # but better to follow the schema if possible.
-                # For now, let's just mark success.
-                return True
-            except Exception as e:
-                print(f"[DB/Python] SQL Chat Error: {e}")
+                    INSERT INTO conversations (id, conversation_id, participant_id, channel, created_at, updated_at)
+                    VALUES (%s, %s, %s, 'facebook', NOW(), NOW())
+                    ON CONFLICT (conversation_id) DO UPDATE SET updated_at = NOW()
+                    RETURNING id
+                """, (cuid(), conversation_id, participant_id))
+                conv_pk = cur.fetchone()[0]
+
+                rows = [_message_row(cuid(), conv_pk, m) for m in _dedupe(messages)]
+                inserted = execute_values(cur, """
+                    INSERT INTO messages (id, message_id, conversation_id, from_id, from_name, content,
+                                          has_attachment, attachment_id, attachment_type, attachment_url, created_at)
+                    VALUES %s
+                    ON CONFLICT (message_id) DO NOTHING
+                    RETURNING from_id, created_at
+                """, rows, page_size=BULK_PAGE_SIZE, fetch=True) if rows else []
+
+                if inserted:
+                    reset, unread = _unread_change(inserted, participant_id)
+                    cur.execute("""
+                        UPDATE conversations SET
+                            last_message_at = GREATEST(COALESCE(last_message_at, %s), %s),
+                            unread_count = CASE WHEN %s THEN %s ELSE unread_count + %s END,
+                            updated_at = NOW()
+                        WHERE id = %s
+                    """, (max(r[1] for r in inserted), max(r[1] for r in inserted), reset, unread, unread, conv_pk))
+            print(f"[DB/Python] Chat {conversation_id}: {len(inserted)}/{len(rows)} new messages stored")
+            return True
+        except Exception as e:
+            print(f"[DB/Python] SQL Chat Error: {e}")
 
     # JSON Fallback
     return save_chat_to_cache_json(conversation_id, messages)
@@ -158,151 +420,220 @@ def save_chat_to_cache_json(conversation_id, messages):
     if not os.path.exists(DATA_DIR): return False
     
     # We need to find which customer this conversation belongs to.
-    # In JSON mode, we check all chathistory folders.
-    for folder in os.listdir(DATA_DIR):
-        history_dir = os.path.join(DATA_DIR, folder, 'chathistory')
-        if not os.path.isdir(history_dir): continue
-            
-        conv_file = os.path.join(history_dir, f"conv_{conversation_id}.json")
-        if os.path.exists(conv_file):
-            try:
-                with open(conv_file, 'r', encoding='utf-8') as f:
-                    existing = json.load(f)
-                existing['messages'] = {'data': messages}
-                existing['updated_time'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
-                with open(conv_file, 'w', encoding='utf-8') as f:
-                    json.dump(existing, f, indent=4, ensure_ascii=False)
-                return True
-            except Exception: pass
+    conv_file = get_customer_index(DATA_DIR).find_conversation(conversation_id)
+    if conv_file:
+        try:
+            with open(conv_file, 'r', encoding='utf-8') as f:
+                existing = json.load(f)
+            # Merge the delta into the stored history (newest first); older messages are kept
+            new_ids = {m.get('id') for m in messages}
+            stored = [m for m in (existing.get('messages') or {}).get('data', []) if m.get('id') not in new_ids]
+            merged = sorted(messages, key=lambda m: m.get('created_time', ''), reverse=True) + stored
+            existing['messages'] = {'data': merged}
+            existing['updated_time'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+            with open(conv_file, 'w', encoding='utf-8') as f:
+                json.dump(existing, f, indent=4, ensure_ascii=False)
+            return True
+        except Exception: pass
     return False
 
 # ═══════════════════════════════════════════════════════════
 #  MARKETING & ADS
 # ═══════════════════════════════════════════════════════════
 
+def _dedupe(rows, key='id'):
+    """Last occurrence wins, so ON CONFLICT never touches the same row twice in one statement."""
+    return list({r.get(key): r for r in rows if r.get(key)}.values())
+
+def _count_upserts(flags):
+    inserted = sum(1 for (is_new,) in flags if is_new)
+    return {"inserted": inserted, "updated": len(flags) - inserted}
+
 def upsert_marketing_data(data):
     """
     Bulk upsert marketing data (campaigns, adsets, creatives, ads).
+    Set-based: each entity list is sent with execute_values, foreign keys are
+    resolved with joins against staged temp tables, and everything commits in
+    one transaction.
+    Returns per-entity {inserted, updated[, skipped]} counts, or False on error.
     """
     if DB_ADAPTER != 'prisma': return True
     
-    import uuid
     import secrets
     def cuid():
         return "c" + secrets.token_hex(12)
 
-    conn = get_db_conn()
-    if not conn: return False
-    
+    campaigns = _dedupe(data.get('campaigns', []))
+    adsets = _dedupe(data.get('adsets', []))
+    creatives = _dedupe(data.get('creatives', []))
+    ads = _dedupe(data.get('ads', []))
+    counts = {}
+
     try:
-        cur = conn.cursor()
-        
-        # 1. Campaigns
-        for c in data.get('campaigns', []):
-            cur.execute("""
+        from psycopg2.extras import execute_values
+        with db_cursor() as cur:
+            # 1. Campaigns
+            rows = execute_values(cur, """
                 INSERT INTO campaigns (id, campaign_id, name, status, objective, start_date, created_at, updated_at, revenue, roas)
-                VALUES (%s, %s, %s, %s, %s, %s, NOW(), NOW(), 0, 0)
+                VALUES %s
                 ON CONFLICT (campaign_id) DO UPDATE SET
                     name = EXCLUDED.name, status = EXCLUDED.status, 
-                    objective = EXCLUDED.objective, start_date = EXCLUDED.start_date, updated_at = NOW();
-            """, (cuid(), c.get('id'), c.get('name'), c.get('status'), c.get('objective'), c.get('start_time')))
-
-        # 2. AdSets
-        for a in data.get('adsets', []):
-            cur.execute("SELECT id FROM campaigns WHERE campaign_id = %s", (a.get('campaign_id'),))
-            camp_res = cur.fetchone()
-            if not camp_res: continue
-            internal_camp_id = camp_res[0]
-
-            cur.execute("SELECT id FROM ad_sets WHERE ad_set_id = %s", (a.get('id'),))
-            res = cur.fetchone()
-            if res:
-                cur.execute("""
-                    UPDATE ad_sets SET name = %s, status = %s, daily_budget = %s, targeting = %s, updated_at = NOW()
-                    WHERE ad_set_id = %s
-                """, (a.get('name'), a.get('status'), int(a.get('daily_budget') or 0)/100, json.dumps(a.get('targeting') or {}), a.get('id')))
-            else:
-                cur.execute("""
-                    INSERT INTO ad_sets (id, ad_set_id, campaign_id, name, status, daily_budget, targeting, created_at, updated_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
-                """, (cuid(), a.get('id'), internal_camp_id, a.get('name'), a.get('status'), int(a.get('daily_budget') or 0)/100, json.dumps(a.get('targeting') or {})))
+                    objective = EXCLUDED.objective, start_date = EXCLUDED.start_date, updated_at = NOW()
+                RETURNING (xmax = 0)
+            """, [(cuid(), c.get('id'), c.get('name'), c.get('status'), c.get('objective'), c.get('start_time')) for c in campaigns],
+                template="(%s, %s, %s, %s, %s, %s, NOW(), NOW(), 0, 0)", page_size=BULK_PAGE_SIZE, fetch=True) if campaigns else []
+            counts['campaigns'] = _count_upserts(rows)
 
-        # 3. Creatives
-        for c in data.get('creatives', []):
+            # 2. AdSets (campaign FK resolved by join)
+            cur.execute("""
+                CREATE TEMP TABLE _stage_adsets (
+                    new_id TEXT, ad_set_id TEXT, campaign_fb_id TEXT, name TEXT, status TEXT,
+                    daily_budget DOUBLE PRECISION, targeting JSONB
+                ) ON COMMIT DROP
+            """)
+            execute_values(cur, "INSERT INTO _stage_adsets VALUES %s", [
+                (cuid(), a.get('id'), a.get('campaign_id'), a.get('name'), a.get('status'),
+                 int(a.get('daily_budget') or 0)/100, json.dumps(a.get('targeting') or {}))
+                for a in adsets
+            ], page_size=BULK_PAGE_SIZE)
             cur.execute("""
+                INSERT INTO ad_sets (id, ad_set_id, campaign_id, name, status, daily_budget, targeting, created_at, updated_at)
+                SELECT s.new_id, s.ad_set_id, c.id, s.name, s.status, s.daily_budget, s.targeting, NOW(), NOW()
+                FROM _stage_adsets s
+                JOIN campaigns c ON c.campaign_id = s.campaign_fb_id
+                ON CONFLICT (ad_set_id) DO UPDATE SET
+                    name = EXCLUDED.name, status = EXCLUDED.status, daily_budget = EXCLUDED.daily_budget,
+                    targeting = EXCLUDED.targeting, updated_at = NOW()
+                RETURNING (xmax = 0)
+            """)
+            counts['adsets'] = _count_upserts(cur.fetchall())
+            counts['adsets']['skipped'] = len(adsets) - sum(counts['adsets'].values())
+
+            # 3. Creatives
+            rows = execute_values(cur, """
                 INSERT INTO ad_creatives (id, name, body, headline, image_url, video_url, call_to_action, created_at, updated_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+                VALUES %s
                 ON CONFLICT (id) DO UPDATE SET
                     name = EXCLUDED.name, body = EXCLUDED.body, headline = EXCLUDED.headline,
-                    image_url = EXCLUDED.image_url, video_url = EXCLUDED.video_url, updated_at = NOW();
-            """, (c.get('id'), c.get('name'), c.get('body'), c.get('title'), c.get('image_url') or c.get('thumbnail_url'), c.get('video_url'), c.get('call_to_action_type')))
-
-        # 4. Ads
-        for ad in data.get('ads', []):
-            cur.execute("SELECT id FROM ad_sets WHERE ad_set_id = %s", (ad.get('adset_id'),))
-            res_set = cur.fetchone()
-            if not res_set: continue
-            
-            cur.execute("SELECT id FROM ads WHERE ad_id = %s", (ad.get('id'),))
-            res_ad = cur.fetchone()
-            if res_ad:
-                cur.execute("""
-                    UPDATE ads SET name = %s, status = %s, ad_set_id = %s, updated_at = NOW()
-                    WHERE ad_id = %s
-                """, (ad.get('name'), ad.get('status'), res_set[0], ad.get('id')))
-            else:
-                cur.execute("""
-                    INSERT INTO ads (id, ad_id, name, status, ad_set_id, created_at, updated_at)
-                    VALUES (%s, %s, %s, %s, %s, NOW(), NOW())
-                """, (cuid(), ad.get('id'), ad.get('name'), ad.get('status'), res_set[0]))
-        
-        conn.commit()
-        return True
+                    image_url = EXCLUDED.image_url, video_url = EXCLUDED.video_url, updated_at = NOW()
+                RETURNING (xmax = 0)
+            """, [(c.get('id'), c.get('name'), c.get('body'), c.get('title'), c.get('image_url') or c.get('thumbnail_url'), c.get('video_url'), c.get('call_to_action_type')) for c in creatives],
+                template="(%s, %s, %s, %s, %s, %s, %s, NOW(), NOW())", page_size=BULK_PAGE_SIZE, fetch=True) if creatives else []
+            counts['creatives'] = _count_upserts(rows)
+
+            # 4. Ads (ad set FK resolved by join)
+            cur.execute("""
+                CREATE TEMP TABLE _stage_ads (
+                    new_id TEXT, ad_id TEXT, adset_fb_id TEXT, name TEXT, status TEXT
+                ) ON COMMIT DROP
+            """)
+            execute_values(cur, "INSERT INTO _stage_ads VALUES %s", [
+                (cuid(), ad.get('id'), ad.get('adset_id'), ad.get('name'), ad.get('status')) for ad in ads
+            ], page_size=BULK_PAGE_SIZE)
+            cur.execute("""
+                INSERT INTO ads (id, ad_id, name, status, ad_set_id, created_at, updated_at)
+                SELECT s.new_id, s.ad_id, s.name, s.status, a.id, NOW(), NOW()
+                FROM _stage_ads s
+                JOIN ad_sets a ON a.ad_set_id = s.adset_fb_id
+                ON CONFLICT (ad_id) DO UPDATE SET
+                    name = EXCLUDED.name, status = EXCLUDED.status, ad_set_id = EXCLUDED.ad_set_id, updated_at = NOW()
+                RETURNING (xmax = 0)
+            """)
+            counts['ads'] = _count_upserts(cur.fetchall())
+            counts['ads']['skipped'] = len(ads) - sum(counts['ads'].values())
+
+        return counts
     except Exception as e:
         print(f"[DB/Marketing] Error: {e}")
-        conn.rollback()
         return False
 
 def upsert_ad_daily_metrics(metrics_list):
     """
     Insert daily metrics snapshot and update Ad aggregate counters.
+    Metrics are written in bulk, then each touched ad is re-aggregated once.
     """
     if DB_ADAPTER != 'prisma': return True
-    conn = get_db_conn()
-    if not conn: return False
     
+    import secrets
+    def cuid():
+        return "c" + secrets.token_hex(12)
+
+    # m: {ad_id, date, spend, impressions, clicks, leads, purchases, revenue, roas}
+    rows = list({(m['ad_id'], m['date']): m for m in metrics_list}.values())
+    if not rows: return True
+
     try:
-        cur = conn.cursor()
-        for m in metrics_list:
-            # m: {ad_id, date, spend, impressions, clicks, leads, purchases}
-            cur.execute("""
+        from psycopg2.extras import execute_values
+        with db_cursor() as cur:
+            execute_values(cur, """
                 INSERT INTO ad_daily_metrics (id, ad_id, date, spend, impressions, clicks, leads, purchases, revenue, roas, created_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+                VALUES %s
                 ON CONFLICT (ad_id, date) DO UPDATE SET
                     spend = EXCLUDED.spend, impressions = EXCLUDED.impressions, 
                     clicks = EXCLUDED.clicks, leads = EXCLUDED.leads, purchases = EXCLUDED.purchases,
-                    revenue = EXCLUDED.revenue, roas = EXCLUDED.roas;
-            """, (f"adm_{int(time.time()*1000)}", m['ad_id'], m['date'], m['spend'], m['impressions'], m['clicks'], m['leads'], m['purchases'], m['revenue'], m['roas']))
-            
-            # Update Ad snapshot (aggregate)
-            cur.execute("""
-                UPDATE ads SET 
-                    spend = (SELECT SUM(spend) FROM ad_daily_metrics WHERE ad_id = %s),
-                    impressions = (SELECT SUM(impressions) FROM ad_daily_metrics WHERE ad_id = %s),
-                    clicks = (SELECT SUM(clicks) FROM ad_daily_metrics WHERE ad_id = %s),
-                    revenue = (SELECT SUM(revenue) FROM ad_daily_metrics WHERE ad_id = %s),
-                    roas = CASE WHEN (SELECT SUM(spend) FROM ad_daily_metrics WHERE ad_id = %s) > 0 
-                                THEN (SELECT SUM(revenue) FROM ad_daily_metrics WHERE ad_id = %s) / (SELECT SUM(spend) FROM ad_daily_metrics WHERE ad_id = %s)
-                                ELSE 0 END,
-                    updated_at = NOW()
-                WHERE ad_id = %s
-            """, (m['ad_id'], m['ad_id'], m['ad_id'], m['ad_id'], m['ad_id'], m['ad_id'], m['ad_id'], m['ad_id']))
-            
+                    revenue = EXCLUDED.revenue, roas = EXCLUDED.roas
+            """, [(cuid(), m['ad_id'], m['date'], m['spend'], m['impressions'], m['clicks'], m['leads'], m['purchases'], m['revenue'], m['roas']) for m in rows],
+                template="(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())", page_size=BULK_PAGE_SIZE)
+
+            refresh_ad_rollups(cur, sorted({m['ad_id'] for m in rows}))
+
         return True
     except Exception as e:
         print(f"[DB/Metrics] Error: {e}")
         return False
 
+def refresh_ad_rollups(cur, ad_ids):
+    """
+    Recomputes lifetime totals for the given ads (Facebook ad_id) with one
+    grouped aggregate, then rolls them up bottom-up (ADR-023):
+    Ad -> Ad Set -> Campaign, for every campaign that contains a touched ad.
+    """
+    if not ad_ids: return
+
+    # 1. Ads: one GROUP BY over their daily history
+    cur.execute("""
+        UPDATE ads AS a SET
+            spend = t.spend, impressions = t.impressions, clicks = t.clicks, revenue = t.revenue,
+            roas = CASE WHEN t.spend > 0 THEN t.revenue / t.spend ELSE 0 END,
+            updated_at = NOW()
+        FROM (
+            SELECT ad_id, SUM(spend) AS spend, SUM(impressions) AS impressions,
+                   SUM(clicks) AS clicks, SUM(revenue) AS revenue
+            FROM ad_daily_metrics
+            WHERE ad_id = ANY(%s)
+            GROUP BY ad_id
+        ) AS t
+        WHERE a.ad_id = t.ad_id
+    """, (list(ad_ids),))
+
+    # 2. Ad Sets -> Campaigns (ad_sets has no metric columns; its totals are the intermediate level)
+    cur.execute("""
+        WITH touched AS (
+            SELECT DISTINCT s.campaign_id
+            FROM ads a JOIN ad_sets s ON s.id = a.ad_set_id
+            WHERE a.ad_id = ANY(%s)
+        ),
+        adset_totals AS (
+            SELECT s.id, s.campaign_id, SUM(a.spend) AS spend, SUM(a.impressions) AS impressions,
+                   SUM(a.clicks) AS clicks, SUM(a.revenue) AS revenue
+            FROM ad_sets s JOIN ads a ON a.ad_set_id = s.id
+            WHERE s.campaign_id IN (SELECT campaign_id FROM touched)
+            GROUP BY s.id, s.campaign_id
+        ),
+        campaign_totals AS (
+            SELECT campaign_id, SUM(spend) AS spend, SUM(impressions) AS impressions,
+                   SUM(clicks) AS clicks, SUM(revenue) AS revenue
+            FROM adset_totals
+            GROUP BY campaign_id
+        )
+        UPDATE campaigns AS c SET
+            spend = t.spend, impressions = t.impressions, clicks = t.clicks, revenue = t.revenue,
+            roas = CASE WHEN t.spend > 0 THEN t.revenue / t.spend ELSE 0 END,
+            updated_at = NOW()
+        FROM campaign_totals AS t
+        WHERE c.id = t.campaign_id
+    """, (list(ad_ids),))
+
 # ═══════════════════════════════════════════════════════════
 #  ASSETS
 # ═══════════════════════════════════════════════════════════
@@ -314,18 +645,8 @@ def get_customer_assets(customer_id, asset_type='images'):
     """
     if not os.path.exists(DATA_DIR): return []
     
-    # Locate customer folder
-    target_folder = None
-    direct_folder = os.path.join(DATA_DIR, str(customer_id))
-    
-    if os.path.exists(direct_folder):
-        target_folder = direct_folder
-    else:
-        # Search for folder manually if ID is not direct match (e.g. standard ID vs PSID)
-        for folder in os.listdir(DATA_DIR):
-            if folder == str(customer_id) or folder.endswith(f"-{customer_id}"):
-                 target_folder = os.path.join(DATA_DIR, folder)
-                 break
+    # Locate customer folder (direct ID, PSID, or "...-{id}" folder name)
+    target_folder = get_customer_index(DATA_DIR).find_folder(customer_id, match_suffix=True)
     
     if not target_folder: return []
     
@@ -342,15 +663,13 @@ def create_order(customer_id, order_id, amount, status="PAID", items=None, metad
     """
     Creates a new order record in the DB or JSON cache.
     """
+    record_change('order', customer=customer_id)
     if DB_ADAPTER == 'prisma':
-        conn = get_db_conn()
-        if conn:
-            try:
-                import uuid
-                import secrets
-                def cuid(): return "c" + secrets.token_hex(12)
-                
-                cur = conn.cursor()
+        try:
+            import secrets
+            def cuid(): return "c" + secrets.token_hex(12)
+
+            with db_cursor() as cur:
                 # Find internal customer ID
                 cur.execute("SELECT id FROM customers WHERE customer_id = %s OR facebook_id = %s", (customer_id, customer_id))
                 res = cur.fetchone()
@@ -370,8 +689,8 @@ def create_order(customer_id, order_id, amount, status="PAID", items=None, metad
                 """, (cuid(), f"TXN-{order_id}", cuid(), amount, status))
 
                 return True
-            except Exception as e:
-                print(f"[DB/Python] SQL Order Error: {e}")
+        except Exception as e:
+            print(f"[DB/Python] SQL Order Error: {e}")
     
     # JSON Fallback: Add to profile's orders array
     return add_order_to_json(customer_id, {
@@ -388,12 +707,10 @@ def add_timeline_event(customer_id, event_type, summary, details=None):
     Adds a new event to the customer timeline.
     """
     if DB_ADAPTER == 'prisma':
-        conn = get_db_conn()
-        if conn:
-            try:
-                import secrets
-                def cuid(): return "c" + secrets.token_hex(12)
-                cur = conn.cursor()
+        try:
+            import secrets
+            def cuid(): return "c" + secrets.token_hex(12)
+            with db_cursor() as cur:
                 cur.execute("SELECT id FROM customers WHERE customer_id = %s OR facebook_id = %s", (customer_id, customer_id))
                 res = cur.fetchone()
                 if not res: return False
@@ -404,8 +721,8 @@ def add_timeline_event(customer_id, event_type, summary, details=None):
                     VALUES (%s, %s, %s, NOW(), %s, %s, %s, NOW())
                 """, (cuid(), f"EVT-{int(time.time())}", internal_id, event_type, summary, json.dumps(details or {})))
                 return True
-            except Exception as e:
-                print(f"[DB/Python] SQL Timeline Error: {e}")
+        except Exception as e:
+            print(f"[DB/Python] SQL Timeline Error: {e}")
 
     # JSON Fallback
     return add_timeline_event_to_json(customer_id, {
@@ -454,42 +771,17 @@ def add_timeline_event_to_json(customer_id, event_data):
 
 def _find_profile_path(customer_id):
     if not os.path.exists(DATA_DIR): return None
-    direct_folder = os.path.join(DATA_DIR, str(customer_id))
-    if os.path.exists(direct_folder):
-        profile_path = os.path.join(direct_folder, f"profile_{customer_id}.json")
-        if os.path.exists(profile_path): return profile_path
-        # Try finding any profile in that folder
-        for f in os.listdir(direct_folder):
-            if f.startswith('profile_') and f.endswith('.json'):
-                return os.path.join(direct_folder, f)
-
-    # Scan all
-    for folder in os.listdir(DATA_DIR):
-        folder_path = os.path.join(DATA_DIR, folder)
-        if not os.path.isdir(folder_path): continue
-        for f in os.listdir(folder_path):
-            if f.startswith('profile_') and f.endswith('.json'):
-                path = os.path.join(folder_path, f)
-                try:
-                    with open(path, 'r', encoding='utf-8') as pf:
-                        p = json.load(pf)
-                    fb_id = p.get('contact_info', {}).get('facebook_id') or p.get('facebook_id')
-                    if str(customer_id) == str(fb_id) or str(customer_id).replace('MSG-', '') == str(fb_id):
-                        return path
-                except: continue
-    return None
+    return get_customer_index(DATA_DIR).find_profile(customer_id)
 
 def create_task(customer_id, title, description, priority="NORMAL"):
     """
     Creates a new task for the staff.
     """
     if DB_ADAPTER == 'prisma':
-        conn = get_db_conn()
-        if conn:
-            try:
-                import secrets
-                def cuid(): return "c" + secrets.token_hex(12)
-                cur = conn.cursor()
+        try:
+            import secrets
+            def cuid(): return "c" + secrets.token_hex(12)
+            with db_cursor() as cur:
                 cur.execute("SELECT id FROM customers WHERE customer_id = %s OR facebook_id = %s", (customer_id, customer_id))
                 res = cur.fetchone()
                 if not res: return False
@@ -500,5 +792,5 @@ def create_task(customer_id, title, description, priority="NORMAL"):
                     VALUES (%s, %s, %s, %s, %s, %s, 'PENDING', NOW(), NOW())
                 """, (cuid(), f"TASK-{int(time.time())}", internal_id, title, description, priority))
                 return True
-            except Exception: pass
+        except Exception: pass
     return False # JSON task support not yet implemented
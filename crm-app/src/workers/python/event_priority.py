@@ -0,0 +1,27 @@
+"""
+V-School Event Priority
+───────────────────────
+Cheap pre-classification of a Facebook event into a scheduling lane:
+  slip        image attachment (possible payment slip)
+  buy_intent  message text contains a buy-intent keyword
+  general     everything else
+Used by the queue worker's lane scheduler at dequeue time; eventProducer.js
+applies the same rules (same event_keywords.json) to set the BullMQ priority
+at enqueue time.
+"""
+
+from keyword_matcher import get_matcher
+
+LANES = ('slip', 'buy_intent', 'general')
+
+
+def has_buy_intent(text):
+    return get_matcher('buy_intent').matches(text)
+
+
+def classify_event(event):
+    if any(a.get('type') == 'image' for a in event.get('attachments') or []):
+        return 'slip'
+    if has_buy_intent(event.get('message', '')):
+        return 'buy_intent'
+    return 'general'
@@ -6,8 +6,9 @@ import time
 from dotenv import load_dotenv
 from PIL import Image
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from google import genai
+from llm_cache import generate_cached, parse_json_text
 
 # Load environment variables
 load_dotenv()
@@ -16,7 +17,7 @@ load_dotenv()
 REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
-# genai configuration removed, now handled via client instantiation
+# Gemini client is shared per process (gemini_client.get_client)
 
 def connect_redis():
     try:
@@ -28,12 +29,74 @@ def connect_redis():
         print(f"[Python Worker] Redis connection skipped/failed: {e}")
         return None
 
-from auto_reply import generate_auto_reply
+from auto_reply import generate_auto_reply, get_last_user_message, should_auto_reply
+from fused_analyzer import analyze_message_fused
+from event_priority import has_buy_intent
+from knowledge_base import search_knowledge
+from chat_history import sync_conversation
 
 from notification_service import send_staff_notification
 from db_adapter import update_customer_intelligence, save_chat_messages, create_task, create_order, add_timeline_event
 from behavioral_analyzer import analyze_customer_behavior
 
+# Shared by all in-flight events (queue mode runs several at once)
+FANOUT_WORKERS = int(os.getenv('EVENT_FANOUT_WORKERS', '16'))
+FUSED_ANALYSIS = os.getenv('EVENT_FUSED_ANALYSIS', '1') == '1'  # one structured call on buy intent
+_fanout_pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='fanout')
+
+def _join(name, sender_id, future):
+    try:
+        return future.result()
+    except Exception as e:
+        print(f"[Python Worker] Step '{name}' failed for {sender_id}: {e}")
+        return None
+
+def behavioral_intel_update(behavioral_data):
+    return {
+        "behavioral": behavioral_data,
+        "status": behavioral_data.get('customer_status', 'WARM'),
+        "tags": behavioral_data.get('behavioral_tags', [])
+    }
+
+def run_behavioral_analysis(sender_id, messages):
+    """Behavioral tags/persona, persisted to the customer's intelligence."""
+    behavioral_data = analyze_customer_behavior(sender_id, messages)
+    if not behavioral_data or "error" in behavioral_data:
+        return None
+    # Update metadata/tags in DB
+    update_customer_intelligence(sender_id, behavioral_intel_update(behavioral_data))
+    return behavioral_data
+
+def run_fused_analysis(sender_id, messages, query):
+    """
+    KB search + one fused call (intel, behavioral, draft reply), persisted
+    in a single intelligence update. None -> caller uses the separate calls.
+    """
+    kb_results = search_knowledge(query, top_k=2) if query else []
+    fused = analyze_message_fused(sender_id, messages, kb_results)
+    if not fused:
+        return None
+    update_customer_intelligence(sender_id, dict(fused['intel'], **behavioral_intel_update(fused['behavioral'])))
+    fused['kb_results'] = kb_results
+    return fused
+
+def _submit_separate_analysis(sender_id, messages, run_intel, run_behavioral):
+    tasks = {}
+    # AI INTELLIGENCE: Analyze Chat Context (Lead Score/Intent)
+    if run_intel:
+        print(f"[Python AI] Running Intel Analysis for {sender_id}...")
+        tasks['chat'] = _fanout_pool.submit(analyze_chat_intelligence, sender_id, messages)
+    else:
+        print(f"[Python AI] 🛡️ Skipping Intel Analysis (Token Guard) for {sender_id}")
+
+    # PHASE 16: BEHAVIORAL AI (Deep Tagging & CTA)
+    if run_behavioral:
+        print(f"[Python Worker] Running Behavioral Analysis for {sender_id}...")
+        tasks['behavioral'] = _fanout_pool.submit(run_behavioral_analysis, sender_id, messages)
+    else:
+        print(f"[Python Worker] 🛡️ Skipping Behavioral Analysis (Token Guard) for {sender_id}")
+    return tasks
+
 def process_event(event):
     """
     Core business logic for processing a Facebook Event.
@@ -55,68 +118,94 @@ def process_event(event):
     # PHASE 17 & 18: HYBRID TOKEN GUARD (High Intent Real-time + Hourly Batch)
     msg_count = len(messages)
     
-    # ⚡ HIGH INTENT (Force Real-time)
-    BUY_INTENT_KEYWORDS = ["ราคา", "โอน", "เลขพัสดุ", "สมัคร", "บัญชี", "กี่บาท", "promotion", "โปร", "ส่วนลด", "สน", "จอง"]
-    latest_text = event.get('message', '').lower()
-    has_buy_intent = any(k in latest_text for k in BUY_INTENT_KEYWORDS)
+    # ⚡ HIGH INTENT (Force Real-time) — buy-intent keywords live in event_keywords.json
+    buy_intent = has_buy_intent(event.get('message', ''))
     
     # Logic: 
     # - Run Intel (Lead Score) every 5 messages or if Buy Intent.
     # - Run Behavioral (Tags) ONLY if Buy Intent (Otherwise wait for Hourly Batch Auditor).
     
-    should_run_intel = msg_count <= 1 or msg_count % 5 == 0 or has_buy_intent
-    should_run_behavioral = has_buy_intent # Real-time only for sales. Deep profile is handled hourly.
-
-    # AI INTELLIGENCE: Analyze Chat Context (Lead Score/Intent)
-    intel_data = None
-    if should_run_intel:
-        print(f"[Python AI] Running Intel Analysis for {sender_id}...")
-        intel_data = analyze_chat_intelligence(sender_id, messages)
-        if intel_data:
-            intelligence_results['chat'] = intel_data
+    should_run_intel = msg_count <= 1 or msg_count % 5 == 0 or buy_intent
+    should_run_behavioral = buy_intent # Real-time only for sales. Deep profile is handled hourly.
+
+    # Buy intent: intel + behavioral + draft reply from ONE structured call
+    use_fused = buy_intent and FUSED_ANALYSIS
+
+    # Independent steps run concurrently and join before auto-reply,
+    # so latency is the slowest step instead of the sum.
+    tasks = {}
+    last_user_message = get_last_user_message(sender_id, messages)
+    # No reply is sent when staff answered last, so skip the RAG lookup then
+    reply_query = last_user_message if messages and messages[0].get('from', {}).get('id') == sender_id else None
+
+    if use_fused:
+        print(f"[Python AI] Running Fused Analysis for {sender_id}...")
+        tasks['fused'] = _fanout_pool.submit(run_fused_analysis, sender_id, messages, reply_query)
     else:
-        print(f"[Python AI] 🛡️ Skipping Intel Analysis (Token Guard) for {sender_id}")
-
-    # PHASE 16: BEHAVIORAL AI (Deep Tagging & CTA)
-    if should_run_behavioral:
-        print(f"[Python Worker] Running Behavioral Analysis for {sender_id}...")
-        behavioral_data = analyze_customer_behavior(sender_id, messages)
-        if behavioral_data and "error" not in behavioral_data:
-            intelligence_results['behavioral'] = behavioral_data
-            # Update metadata/tags in DB
-            update_customer_intelligence(sender_id, {
-                "behavioral": behavioral_data,
-                "status": behavioral_data.get('customer_status', 'WARM'),
-                "tags": behavioral_data.get('behavioral_tags', [])
-            })
-    else:
-        print(f"[Python Worker] 🛡️ Skipping Behavioral Analysis (Token Guard) for {sender_id}")
+        tasks.update(_submit_separate_analysis(sender_id, messages, should_run_intel, should_run_behavioral))
+        if reply_query:
+            tasks['kb'] = _fanout_pool.submit(search_knowledge, reply_query, 2)
 
     # 2. Slip Detection & AI Verification
-    attachments = event.get('attachments', [])
-    if attachments and attachments[0].get('type') == 'image':
-        image_url = attachments[0].get('payload', {}).get('url')
+    # A coalesced burst (queue_worker) may carry several attachments: verify every image
+    images = [a for a in event.get('attachments') or [] if a.get('type') == 'image']
+    for n, image in enumerate(images):
+        image_url = image.get('payload', {}).get('url')
         print(f"[Python Worker] Image detected: {image_url}")
-        slip_data = verify_slip_real(sender_id, image_url)
-        if slip_data and slip_data.get('status') == 'VERIFIED':
-            intelligence_results['slip'] = slip_data
-            
-            # PHASE 19: Order Persistence
-            amount = slip_data.get('amount', 0)
-            txn_id = slip_data.get('ref_id') or f"SLIP-{int(time.time())}"
-            
-            print(f"[Python Worker] 💰 Creating Actual Order for {sender_id}: ฿{amount}")
-            create_order(sender_id, txn_id, amount, status="PAID", metadata={"source": "Facebook Slip Detection"})
-            add_timeline_event(sender_id, "PURCHASE", f"โอนเงินสำเร็จ ฿{amount}", details=slip_data)
-
-            # Update intel_data for auto-reply logic
-            if intel_data: 
-                intel_data.update({"intent": "Purchase", "score": 100})
-            else:
-                intel_data = {"intent": "Purchase", "score": 100, "main_interest": "Payment"}
+        tasks[f'slip:{n}'] = _fanout_pool.submit(verify_slip_real, sender_id, image_url, persist=False)
+
+    results = {name: _join(name, sender_id, future) for name, future in tasks.items()}
+
+    fused = results.get('fused')
+    if use_fused and not fused:
+        fallback = _submit_separate_analysis(sender_id, messages, True, True)
+        if reply_query:
+            fallback['kb'] = _fanout_pool.submit(search_knowledge, reply_query, 2)
+        results.update({name: _join(name, sender_id, future) for name, future in fallback.items()})
+    elif fused:
+        results.update({'chat': fused['intel'], 'behavioral': fused['behavioral'], 'kb': fused['kb_results']})
+
+    intel_data = results.get('chat')
+    if intel_data:
+        intelligence_results['chat'] = intel_data
+    if results.get('behavioral'):
+        intelligence_results['behavioral'] = results['behavioral']
+
+    slips = [results.get(f'slip:{n}') for n in range(len(images))]
+    verified = []
+    for n, slip_data in enumerate(slips):
+        if not slip_data: continue
+        # Written after the join so the slip verdict is not overwritten by the intel step
+        update_customer_intelligence(sender_id, slip_intel_update(slip_data))
+        if slip_data.get('status') != 'VERIFIED': continue
+        verified.append(slip_data)
+
+        # PHASE 19: Order Persistence (one order per verified slip)
+        amount = slip_data.get('amount', 0)
+        txn_id = slip_data.get('ref_id') or f"SLIP-{int(time.time())}{f'-{n}' if n else ''}"
+
+        print(f"[Python Worker] 💰 Creating Actual Order for {sender_id}: ฿{amount}")
+        create_order(sender_id, txn_id, amount, status="PAID", metadata={"source": "Facebook Slip Detection"})
+        add_timeline_event(sender_id, "PURCHASE", f"โอนเงินสำเร็จ ฿{amount}", details=slip_data)
+
+    if verified:
+        intelligence_results['slip'] = verified[-1]
+        if len(verified) > 1:
+            intelligence_results['slips'] = verified
+
+        # Update intel_data for auto-reply logic
+        if intel_data: 
+            intel_data.update({"intent": "Purchase", "score": 100})
+        else:
+            intel_data = {"intent": "Purchase", "score": 100, "main_interest": "Payment"}
 
     # 3. AUTO-REPLY LOGIC (Phase 7)
-    auto_reply_text = generate_auto_reply(sender_id, messages, intel_data or {})
+    # The fused draft is used unless a verified slip changed the picture since it was written
+    slip_verified = bool(verified)
+    if fused and fused['reply'] and not slip_verified:
+        auto_reply_text = fused['reply'] if should_auto_reply(sender_id, messages, intel_data) else None
+    else:
+        auto_reply_text = generate_auto_reply(sender_id, messages, intel_data or {}, kb_results=results.get('kb') or [])
     if auto_reply_text:
         send_result = send_facebook_message(sender_id, auto_reply_text)
         intelligence_results['auto_reply'] = {
@@ -177,6 +266,9 @@ def send_facebook_message(recipient_id, message_text):
 
 from db_adapter import update_customer_intelligence, save_chat_messages
 
+INTEL_PROMPT_VERSION = 1  # bump when the prompt below changes (LLM cache key)
+SLIP_PROMPT_VERSION = 1
+
 def analyze_chat_intelligence(sender_id, messages):
     """
     Use AI to detect Intent and Lead Score.
@@ -185,8 +277,6 @@ def analyze_chat_intelligence(sender_id, messages):
         return None
 
     try:
-        client = genai.Client(api_key=GEMINI_API_KEY)
-        
         # Prepare context (last 5 messages)
         chat_text = "\n".join([f"{m.get('from', {}).get('name', 'User')}: {m.get('message', '')}" for m in messages[:5]])
         
@@ -201,13 +291,9 @@ def analyze_chat_intelligence(sender_id, messages):
         - main_interest: (short string like 'Sushi Course', 'Price Inquiry', etc.)
         """
         
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt
-        )
-        # Clean response text
-        clean_json = response.text.replace('```json', '').replace('```', '').strip()
-        intelligence = json.loads(clean_json)
+        # Identical recent chat -> cached result (retried webhooks, duplicate events)
+        intelligence = generate_cached('chat_intelligence', "gemini-2.0-flash", INTEL_PROMPT_VERSION,
+                                       {"chat": chat_text}, prompt, parse_json_text)
         
         print(f"[Python AI] Lead Score for {sender_id}: {intelligence.get('score')}")
         
@@ -219,19 +305,19 @@ def analyze_chat_intelligence(sender_id, messages):
         print(f"[Python AI] Intelligence Error: {e}")
         return None
 
-def verify_slip_real(sender_id, image_url):
+def verify_slip_real(sender_id, image_url, persist=True):
     """
     Real OCR/AI Verification using Gemini Vision.
+    persist=False leaves the intelligence update to the caller (see slip_intel_update).
     """
     if not GEMINI_API_KEY:
         return None
 
     try:
-        client = genai.Client(api_key=GEMINI_API_KEY)
-
         # Download image
         response = requests.get(image_url)
-        img = Image.open(BytesIO(response.content))
+        image_bytes = response.content
+        img = Image.open(BytesIO(image_bytes))
 
         prompt = """
         Analyze this Thai bank transfer slip. Extract the following information in JSON format:
@@ -243,56 +329,46 @@ def verify_slip_real(sender_id, image_url):
         - is_valid (Boolean - check for standard Bank Layout)
         """
 
-        response = client.models.generate_content(
-            model="gemini-2.0-flash", # gemini-2.0-flash handles multimodal
-            contents=[prompt, img]
-        )
-        clean_json = response.text.replace('```json', '').replace('```', '').strip()
-        result = json.loads(clean_json)
+        # gemini-2.0-flash handles multimodal; keyed by the image bytes, so the same slip sent twice is analyzed once
+        result = generate_cached('slip_verification', "gemini-2.0-flash", SLIP_PROMPT_VERSION, {},
+                                 [prompt, img], parse_json_text, images=[image_bytes])
         
         print(f"[Python AI] ✅ Slip Analyzed: {result.get('amount')} THB via {result.get('bank_name')}")
         
         result['status'] = 'VERIFIED' if result.get('is_valid') else 'REJECTED'
         
         # Use DB Adapter instead of direct fs
-        intel_update = {
-            "slip_verification": result, 
-            "score": 100 if result.get('is_valid') else 0, 
-            "intent": "Purchase"
-        }
-        update_customer_intelligence(sender_id, intel_update)
+        if persist:
+            update_customer_intelligence(sender_id, slip_intel_update(result))
         return result
 
     except Exception as e:
         print(f"[Python AI] Verification Failed: {e}")
         return None
 
+def slip_intel_update(result):
+    return {
+        "slip_verification": result,
+        "score": 100 if result.get('is_valid') else 0,
+        "intent": "Purchase"
+    }
+
 def sync_chat(conversation_id):
     """
-    Fetch messages from Facebook and save to local cache or DB.
+    Fetch new messages from Facebook (since the conversation's high-water mark),
+    save only those, and return the merged recent history.
     """
     page_access_token = os.getenv('FB_PAGE_ACCESS_TOKEN')
     if not page_access_token:
         return {'success': False, 'error': 'Missing Page Access Token'}
 
-    url = f"https://graph.facebook.com/v19.0/{conversation_id}/messages"
-    params = {
-        'fields': 'id,message,from,created_time,attachments{id,mime_type,name,file_url,image_data,url}',
-        'limit': 50,
-        'access_token': page_access_token
-    }
-
     try:
-        response = requests.get(url, params=params)
-        data = response.json()
-
-        if response.status_code == 200:
-            messages = data.get('data', [])
-            # Use DB Adapter
-            save_chat_messages(conversation_id, messages)
-            return {'success': True, 'data': messages, 'source': 'facebook'}
-        else:
-            return {'success': False, 'error': data.get('error', {}).get('message')}
+        # Use DB Adapter; the sync mark only advances once the delta is stored
+        messages, delta, saved = sync_conversation(
+            conversation_id, page_access_token, save=lambda new: save_chat_messages(conversation_id, new))
+        if not saved:
+            print(f"[Python Worker] ⚠️ {len(delta)} new messages of {conversation_id} not stored; retried on the next sync")
+        return {'success': True, 'data': messages, 'new': len(delta), 'saved': saved, 'source': 'facebook'}
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
@@ -308,10 +384,11 @@ def main():
         return
 
     print("[Python Worker] Starting in Queue Mode...")
-    r = connect_redis()
-    while True:
-        # Queue logic would go here
-        time.sleep(1)
+    if connect_redis() is None:
+        return
+
+    from queue_worker import run_worker
+    run_worker(process_event)
 
 if __name__ == "__main__":
     main()
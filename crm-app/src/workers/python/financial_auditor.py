@@ -1,10 +1,11 @@
 import os
 import json
-from google import genai
+from llm_cache import generate_cached, parse_json_text
 from dotenv import load_dotenv
 
 load_dotenv()
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+FINANCIAL_PROMPT_VERSION = 1  # bump when the prompt below changes (LLM cache key)
 
 def audit_financial_context(conversation_id, chat_messages, reported_value):
     """
@@ -14,8 +15,6 @@ def audit_financial_context(conversation_id, chat_messages, reported_value):
     if not GEMINI_API_KEY:
         return {"error": "Missing API Key"}
 
-    client = genai.Client(api_key=GEMINI_API_KEY)
-    
     # Format chat for LLM
     chat_context = ""
     # Sort messages by time if possible, otherwise use original order
@@ -51,18 +50,10 @@ def audit_financial_context(conversation_id, chat_messages, reported_value):
     """
 
     try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=prompt
-        )
-        # Clean response
-        text = response.text.replace('```json', '').replace('```', '').strip()
-        # Basic JSON extraction if LLM adds fluff
-        if '{' in text and '}' in text:
-            text = text[text.find('{'):text.rfind('}')+1]
-        
-        result = json.loads(text)
-        return result
+        # Re-auditing the same payment over an unchanged chat is served from the LLM cache
+        return generate_cached('financial_audit', "gemini-2.0-flash", FINANCIAL_PROMPT_VERSION,
+                               {"chat": chat_context, "value": reported_value, "conversation": conversation_id},
+                               prompt, parse_json_text)
     except Exception as e:
         return {"error": str(e)}
 
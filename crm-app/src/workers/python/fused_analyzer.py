@@ -0,0 +1,204 @@
+"""
+V-School Fused Message Analyzer
+───────────────────────────────
+For high-intent messages, one structured-output Gemini call replaces the
+three separate round trips in process_event:
+  analyze_chat_intelligence  -> intent / score / main_interest
+  analyze_customer_behavior  -> behavioral tags / persona / CTA / status
+  generate_auto_reply        -> draft reply
+The conversation is serialized into a single prompt, and the JSON schema is
+enforced by the API (no ```json stripping).
+
+Returns None on any failure so the caller can fall back to the separate calls.
+
+  python fused_analyzer.py   # benchmark: tokens + latency, fused vs three calls
+"""
+
+import os
+import json
+import time
+
+from gemini_client import get_client, GEMINI_API_KEY
+from auto_reply import SCHOOL_KNOWLEDGE, format_kb_context
+
+MODEL = "gemini-2.0-flash"
+HISTORY_MESSAGES = 30
+
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "intent": {"type": "STRING", "enum": ["Purchase", "Question", "Complaint", "Greeting"]},
+        "score": {"type": "INTEGER"},
+        "main_interest": {"type": "STRING"},
+        "behavioral": {
+            "type": "OBJECT",
+            "properties": {
+                "behavioral_tags": {"type": "ARRAY", "items": {"type": "STRING"}},
+                "marketing_persona": {"type": "STRING"},
+                "emotional_state": {"type": "STRING"},
+                "recommended_cta": {"type": "STRING"},
+                "customer_status": {"type": "STRING"},
+                "analysis_summary": {"type": "STRING"},
+                "intent_evolution": {"type": "STRING"},
+            },
+            "required": ["behavioral_tags", "marketing_persona", "emotional_state",
+                         "recommended_cta", "customer_status", "analysis_summary"],
+        },
+        "reply": {"type": "STRING"},
+    },
+    "required": ["intent", "score", "main_interest", "behavioral", "reply"],
+}
+
+
+def build_prompt(customer_id, messages, kb_results=None):
+    # Graph API returns newest first; the model reads oldest -> newest
+    history = "\n".join(
+        f"{m.get('from', {}).get('name', 'User')}: {m.get('message', '')}"
+        for m in messages[:HISTORY_MESSAGES][::-1]
+    )
+    context_text = format_kb_context(kb_results)
+    return f"""
+    You are the CRM analyst and 'Chef V', the AI Assistant for V School (Japanese Cooking School in Bangkok).
+    Analyze the conversation with Customer {customer_id} and draft the next reply, in ONE JSON object.
+
+    School Knowledge (Static):
+    {json.dumps(SCHOOL_KNOWLEDGE, ensure_ascii=False)}
+
+    Specific Knowledge (Retrieved for this Query):
+    {context_text if context_text else "No specific matching knowledge found."}
+
+    Conversation (oldest to newest):
+    {history}
+
+    Fields:
+    - intent: Purchase, Question, Complaint or Greeting (latest message)
+    - score: integer 0-100, conversion probability
+    - main_interest: short string like 'Sushi Course', 'Price Inquiry'
+    - behavioral: behavioral_tags (e.g. LOVES_SUSHI, BARGAIN_HUNTER, PRICE_SENSITIVE, DECISION_MAKER),
+      marketing_persona (Casual Hobbyist, Professional Chef, Event Planner, Gift Buyer...),
+      emotional_state, recommended_cta (next best action for the admin),
+      customer_status (COLD, WARM, HOT_LEAD, WON, DORMANT), analysis_summary (short Thai),
+      intent_evolution
+    - reply: the next message to the customer. Polite, professional, Thai unless the user writes English.
+      Prioritize 'Specific Knowledge' for facts; if Purchase, offer payment details or a seat booking.
+      Be concise, use emojis appropriately, end with a question. Empty string if Intent is Complaint.
+    """
+
+
+def analyze_message_fused(customer_id, messages, kb_results=None):
+    """
+    Returns {"intel": {intent, score, main_interest}, "behavioral": {...}, "reply": str}
+    or None (caller falls back to the separate analyzers).
+    """
+    if not GEMINI_API_KEY or not messages:
+        return None
+
+    try:
+        response = get_client().models.generate_content(
+            model=MODEL,
+            contents=build_prompt(customer_id, messages, kb_results),
+            config={"response_mime_type": "application/json", "response_schema": RESPONSE_SCHEMA}
+        )
+        data = json.loads(response.text)
+        result = {
+            "intel": {
+                "intent": data['intent'],
+                "score": max(0, min(100, int(data['score']))),
+                "main_interest": data.get('main_interest', 'General'),
+            },
+            "behavioral": data['behavioral'],
+            "reply": (data.get('reply') or '').strip(),
+        }
+        print(f"[Fused AI] {customer_id}: {result['intel']['intent']} ({result['intel']['score']})")
+        return result
+    except Exception as e:
+        print(f"[Fused AI] Error, falling back to separate calls: {e}")
+        return None
+
+
+# ─── Benchmark ─────────────────────────────────────────────
+
+class _UsageRecorder:
+    """Wraps the shared client's generate_content to record latency and token usage."""
+    def __init__(self, client):
+        self.models = client.models
+        self.original = client.models.generate_content
+        self.calls = []
+
+    def __enter__(self):
+        def recorded(*args, **kwargs):
+            start = time.perf_counter()
+            response = self.original(*args, **kwargs)
+            usage = getattr(response, 'usage_metadata', None)
+            self.calls.append({
+                "seconds": time.perf_counter() - start,
+                "prompt_tokens": getattr(usage, 'prompt_token_count', 0) or 0,
+                "output_tokens": getattr(usage, 'candidates_token_count', 0) or 0,
+            })
+            return response
+        self.models.generate_content = recorded
+        return self
+
+    def __exit__(self, *exc):
+        self.models.generate_content = self.original
+
+    def summary(self, wall):
+        return {
+            "calls": len(self.calls),
+            "prompt_tokens": sum(c['prompt_tokens'] for c in self.calls),
+            "output_tokens": sum(c['output_tokens'] for c in self.calls),
+            "wall_seconds": round(wall, 2),
+        }
+
+
+def benchmark(customer_id, messages, rounds=3):
+    """
+    Compare the three-call path with the fused call on the same conversation.
+    Note: analyze_chat_intelligence persists its result, so use a test customer id.
+    The LLM response cache is bypassed, so every round makes real calls.
+    """
+    import llm_cache
+    from event_processor import analyze_chat_intelligence
+    from behavioral_analyzer import analyze_customer_behavior
+    from auto_reply import generate_auto_reply
+    from knowledge_base import search_knowledge
+
+    kb_results = search_knowledge(messages[0].get('message', ''), top_k=2)
+    client = get_client()
+    report = {"separate": [], "fused": []}
+    # Cached answers from round 2 on would understate the separate path's calls, tokens and latency
+    cache_enabled, llm_cache.LLM_CACHE_ENABLED = llm_cache.LLM_CACHE_ENABLED, False
+    try:
+        for _ in range(rounds):
+            with _UsageRecorder(client) as rec:
+                start = time.perf_counter()
+                intel = analyze_chat_intelligence(customer_id, messages) or {}
+                analyze_customer_behavior(customer_id, messages)
+                generate_auto_reply(customer_id, messages, intel, kb_results=kb_results)
+                report["separate"].append(rec.summary(time.perf_counter() - start))
+
+            with _UsageRecorder(client) as rec:
+                start = time.perf_counter()
+                analyze_message_fused(customer_id, messages, kb_results)
+                report["fused"].append(rec.summary(time.perf_counter() - start))
+    finally:
+        llm_cache.LLM_CACHE_ENABLED = cache_enabled
+
+    for mode, runs in report.items():
+        avg = {k: round(sum(r[k] for r in runs) / len(runs), 2) for k in runs[0]}
+        print(f"{mode:<9} calls={avg['calls']} prompt_tokens={avg['prompt_tokens']} "
+              f"output_tokens={avg['output_tokens']} latency={avg['wall_seconds']}s")
+    return report
+
+
+if __name__ == "__main__":
+    sample_chat = [  # newest first, as returned by sync_chat
+        {"from": {"id": "TEST-F01", "name": "User"}, "message": "คอร์ส Professional ราคาเท่าไหร่ครับ โอนมัดจำได้ไหม"},
+        {"from": {"id": "PAGE", "name": "Admin"}, "message": "ถ้าเน้นเปิดร้านแนะนำคอร์ส Professional เลยครับ ตอนนี้มีโปรแถมชุดมีดครับ"},
+        {"from": {"id": "TEST-F01", "name": "User"}, "message": "แต่ราคาแอบแรงนิดนึง มีโปรโมชั่นไหมครับ?"},
+        {"from": {"id": "TEST-F01", "name": "User"}, "message": "อยากเรียนซูชิแบบเปิดร้านเลยครับ"},
+    ]
+    if not GEMINI_API_KEY:
+        print("[Fused AI] GEMINI_API_KEY not set; benchmark needs live API access.")
+    else:
+        benchmark("TEST-F01", sample_chat, rounds=int(os.getenv('BENCH_ROUNDS', '3')))
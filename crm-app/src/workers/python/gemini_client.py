@@ -0,0 +1,30 @@
+"""
+V-School Shared Gemini Client
+─────────────────────────────
+One `genai.Client` per process, shared by every analyzer (event processor,
+auto-reply, behavioral, financial). The client keeps its HTTP connection
+pool alive between calls and is safe to use from worker threads, so calls no
+longer pay client construction + a fresh TLS handshake each time.
+"""
+
+import os
+import threading
+from google import genai
+from dotenv import load_dotenv
+
+load_dotenv()
+GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Process-wide Gemini client, or None if no API key is configured."""
+    global _client
+    if not GEMINI_API_KEY:
+        return None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = genai.Client(api_key=GEMINI_API_KEY)
+    return _client
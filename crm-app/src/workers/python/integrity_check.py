@@ -3,6 +3,7 @@ import os
 import json
 import sys
 from datetime import datetime
+from keyword_matcher import get_matcher
 
 # ──────────────────────────────────────────────────────────
 # CONFIGURATION
@@ -35,7 +36,8 @@ def check_dinner_misattribution(customer):
     campaign = intel.get('campaign_name', '').lower()
     
     # Also check tags or lead_channel
-    is_dinner_lead = 'dinner' in campaign or 'shabu' in campaign
+    dinner = get_matcher('dinner_campaign')  # keywords: event_keywords.json
+    is_dinner_lead = dinner.matches(campaign)
     
     if not is_dinner_lead:
         return None
@@ -60,7 +62,7 @@ def check_dinner_misattribution(customer):
         items = o.get('items', [])
         for item in items:
             p_name = item.get('name', '').lower()
-            if 'shabu' in p_name or 'dinner' in p_name:
+            if dinner.matches(p_name):
                 bought_shabu = True
             else:
                 bought_other = True
@@ -0,0 +1,164 @@
+"""
+V-School Knowledge Vector Store (On-Disk Format)
+────────────────────────────────────────────────
+Compact index files written by `knowledge_ingest.py` and read by
+`knowledge_base.py`:
+
+  vector_index.f32        16-byte header + row-major little-endian float32
+                          matrix (rows L2-normalized), memory-mapped on load
+  vector_index.meta.json  {"version", "dim", "count", "items": [{id, text, original}]}
+
+Header: magic b'VSKB' | uint32 version | uint32 dim | uint32 count.
+The matrix is never parsed, so cold start and resident memory no longer grow
+with the FAQ size. Writing needs no dependencies; NumPy is only used to mmap.
+
+Convert an existing JSON index:
+  python kb_store.py /path/to/vector_index.json
+"""
+
+import os
+import sys
+import json
+import math
+import struct
+from array import array
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+MAGIC = b'VSKB'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sIII')
+MATRIX_SUFFIX = '.f32'
+META_SUFFIX = '.meta.json'
+
+
+def index_paths(base_path):
+    """(matrix_path, meta_path) for an index base path such as `.../vector_index`."""
+    return base_path + MATRIX_SUFFIX, base_path + META_SUFFIX
+
+
+def _normalized(vector):
+    magnitude = math.sqrt(sum(a * a for a in vector))
+    return [a / magnitude for a in vector] if magnitude else list(vector)
+
+
+def write_index(base_path, entries, model=None):
+    """
+    Write entries ({id, text, original, vector[, hash]}) in the binary format.
+    `hash` (content hash) and `model` are kept in the metadata so the next
+    ingest can carry unchanged vectors over.
+    Files are replaced atomically (matrix first, metadata last).
+    Returns the number of vectors written.
+    """
+    if not entries:
+        raise ValueError("no vectors to write")
+    dim = len(entries[0]['vector'])
+    for e in entries:
+        if len(e['vector']) != dim:
+            raise ValueError(f"dimension mismatch for {e.get('id')}: {len(e['vector'])} != {dim}")
+
+    matrix_path, meta_path = index_paths(base_path)
+    os.makedirs(os.path.dirname(os.path.abspath(matrix_path)), exist_ok=True)
+
+    tmp = matrix_path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, dim, len(entries)))
+        for e in entries:
+            row = array('f', _normalized(e['vector']))
+            if sys.byteorder == 'big':
+                row.byteswap()
+            row.tofile(f)
+    os.replace(tmp, matrix_path)
+
+    tmp = meta_path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({
+            "version": FORMAT_VERSION,
+            "dim": dim,
+            "count": len(entries),
+            "model": model,
+            "items": [{"id": e.get('id'), "text": e['text'], "original": e['original'], "hash": e.get('hash')}
+                      for e in entries],
+        }, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp, meta_path)
+    return len(entries)
+
+
+def read_header(matrix_path):
+    with open(matrix_path, 'rb') as f:
+        raw = f.read(HEADER.size)
+    if len(raw) != HEADER.size:
+        raise ValueError(f"truncated header: {matrix_path}")
+    magic, version, dim, count = HEADER.unpack(raw)
+    if magic != MAGIC:
+        raise ValueError(f"not a knowledge index (bad magic): {matrix_path}")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"unsupported index version {version} (expected {FORMAT_VERSION})")
+    return dim, count
+
+
+def load_index(base_path, expected_dim=None):
+    """
+    Returns (matrix, items, dim).
+    `matrix` is a read-only np.memmap of shape (count, dim) when NumPy is
+    available, otherwise a list of float rows. Raises ValueError on a
+    header/metadata mismatch or if `expected_dim` does not match.
+    """
+    matrix_path, meta_path = index_paths(base_path)
+    dim, count = read_header(matrix_path)
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+
+    if meta.get('version') != FORMAT_VERSION or meta.get('dim') != dim or meta.get('count') != count:
+        raise ValueError(f"metadata does not match {matrix_path} (dim={dim}, count={count})")
+    if expected_dim and dim != expected_dim:
+        raise ValueError(f"index dimension {dim} != expected {expected_dim}")
+    expected_size = HEADER.size + dim * count * 4
+    if os.path.getsize(matrix_path) != expected_size:
+        raise ValueError(f"matrix size mismatch: {matrix_path}")
+
+    if HAS_NUMPY:
+        matrix = np.memmap(matrix_path, dtype='<f4', mode='r', offset=HEADER.size, shape=(count, dim))
+    else:
+        flat = array('f')
+        with open(matrix_path, 'rb') as f:
+            f.seek(HEADER.size)
+            flat.fromfile(f, dim * count)
+        if sys.byteorder == 'big':
+            flat.byteswap()
+        matrix = [flat[i * dim:(i + 1) * dim].tolist() for i in range(count)]
+
+    return matrix, meta['items'], dim
+
+
+def load_entries(base_path):
+    """
+    Previous index as plain entries ({id, text, original, hash, vector}) plus
+    the embedding model it was built with. Vectors are copied out of the mmap.
+    """
+    matrix, items, _ = load_index(base_path)
+    with open(index_paths(base_path)[1], 'r', encoding='utf-8') as f:
+        model = json.load(f).get('model')
+    entries = [dict(item, vector=[float(x) for x in row]) for item, row in zip(items, matrix)]
+    return entries, model
+
+
+def convert_json_index(json_path, base_path=None):
+    """Convert a legacy vector_index.json into the binary format. Returns the vector count."""
+    base_path = base_path or os.path.splitext(json_path)[0]
+    with open(json_path, 'r', encoding='utf-8') as f:
+        entries = [e for e in json.load(f) if e.get('vector')]
+    count = write_index(base_path, entries)
+    print(f"[KB/Store] Converted {count} vectors: {json_path} -> {base_path}{MATRIX_SUFFIX}")
+    return count
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python kb_store.py <vector_index.json> [output_base_path]")
+        sys.exit(1)
+    convert_json_index(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
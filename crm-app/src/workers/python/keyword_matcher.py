@@ -0,0 +1,112 @@
+"""
+V-School Keyword Matcher (Aho-Corasick)
+───────────────────────────────────────
+Compiled multi-pattern matcher: every keyword of every category is found in
+one pass over the text, so the cost no longer grows with the keyword lists.
+Matching is case-insensitive substring matching (same semantics as the old
+`k in text.lower()` checks, which also suits Thai since it has no spaces).
+
+Keyword groups live in event_keywords.json (shared with eventProducer.js):
+  "buy_intent": [...]                      flat list -> one category
+  "ad_categories": {"sushi": [...], ...}   nested -> one category per key,
+                                           in priority order
+Users: event_priority (buy intent), scripts/sync_ads_incremental.py (daily
+summary categories), integrity_check (dinner campaign rule).
+"""
+
+import os
+import json
+import threading
+from collections import deque
+
+KEYWORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'event_keywords.json')
+
+
+class KeywordMatcher:
+    def __init__(self, keywords_by_category):
+        """`keywords_by_category`: {category: [keyword, ...]}; dict order is the priority order."""
+        self.order = list(keywords_by_category)
+        self._goto = [{}]       # state -> {char: state}
+        self._fail = [0]
+        self._out = [()]        # state -> ((category, keyword), ...) ending here
+        for category, keywords in keywords_by_category.items():
+            for keyword in keywords:
+                self._add(str(keyword).lower(), category)
+        self._link()
+
+    def _add(self, keyword, category):
+        if not keyword: return
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+                self._goto[state][ch] = nxt
+            state = nxt
+        self._out[state] += ((category, keyword),)
+
+    def _link(self):
+        """Breadth-first failure links; outputs are merged along them."""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    def finditer(self, text):
+        """Yields (end, category, keyword) for every occurrence, left to right."""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(str(text or '').lower()):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for category, keyword in out[state]:
+                yield i + 1, category, keyword
+
+    def categories(self, text):
+        """Every matched category, in priority order."""
+        found = {category for _, category, _ in self.finditer(text)}
+        return [c for c in self.order if c in found]
+
+    def first_category(self, text, default=None):
+        """Highest-priority matched category (the old if/elif chains)."""
+        found = self.categories(text)
+        return found[0] if found else default
+
+    def matches(self, text):
+        """True on the first occurrence of any keyword."""
+        return next(self.finditer(text), None) is not None
+
+
+_matchers = {}
+_matchers_lock = threading.Lock()
+
+def load_keywords(path=KEYWORDS_PATH):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def get_matcher(group, path=KEYWORDS_PATH):
+    """Compiled matcher for one group of the keyword file (built once per process)."""
+    key = (group, path)
+    if key not in _matchers:
+        with _matchers_lock:
+            if key not in _matchers:
+                spec = load_keywords(path)[group]
+                _matchers[key] = KeywordMatcher(spec if isinstance(spec, dict) else {group: spec})
+    return _matchers[key]
+
+
+if __name__ == "__main__":
+    ads = get_matcher('ad_categories')
+    for name in ("Sushi Masterclass - Retarget", "คอร์สราเมน Lookalike", "Summer Kids Camp ซูชิ", "Brand Awareness"):
+        print(f"{name:<32} {ads.categories(name)} -> {ads.first_category(name, 'other')}")
+    print(get_matcher('buy_intent').matches("ราคาเท่าไหร่ครับ"))
@@ -1,8 +1,12 @@
 """
 V-School Semantic Search Engine
 ───────────────────────────────
-Performs cosine similarity search against the vector index.
-Zero-dependency version (using pure Python math fallback).
+Hybrid retrieval: cosine similarity against the vector index fused with a
+local BM25 index (lexical_index.py), which also answers on its own when the
+embedding API is unavailable.
+The index is loaded once per process: the binary store (kb_store.py) is
+memory-mapped as a pre-normalized float32 matrix (NumPy); a pure Python
+fallback is kept for environments without NumPy.
 """
 
 import os
@@ -10,9 +14,48 @@ import json
 import urllib.request
 import ssl
 import math
+import heapq
+import threading
+import hashlib
+import re
+import unicodedata
+
+import kb_store
+from cache_store import make_cache
+from lexical_index import BM25Index
+
+from vector_quant import QuantizedMatrix, search_reranked
+
+try:
+    from ann_index import IVFIndex, HAS_NUMPY as HAS_ANN
+except ImportError:
+    HAS_ANN = False
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
 
 KNOWLEDGE_DIR = "/Users/ideab/Desktop/data_hub/knowledge"
-INDEX_PATH = os.path.join(KNOWLEDGE_DIR, "vector_index.json")
+INDEX_BASE = os.path.join(KNOWLEDGE_DIR, "vector_index")        # binary store (kb_store.py)
+INDEX_PATH = os.path.join(KNOWLEDGE_DIR, "vector_index.json")   # legacy JSON index
+LEXICAL_PATH = os.path.join(KNOWLEDGE_DIR, "lexical_index.json")  # BM25 (lexical_index.py)
+EMBEDDING_DIM = int(os.getenv('KB_EMBEDDING_DIM', '0')) or None  # optional sanity check
+EMBED_MODEL = "gemini-embedding-001"
+
+MIN_SCORE = float(os.getenv('KB_MIN_SCORE', '0.6'))              # cosine cut-off (see is_relevant)
+LEXICAL_MIN_SCORE = float(os.getenv('KB_LEXICAL_MIN_SCORE', '0.5'))  # normalized BM25 cut-off for lexical-only hits
+LEXICAL_WEIGHT = float(os.getenv('KB_LEXICAL_WEIGHT', '0.3'))    # share of BM25 in the fused score
+CANDIDATE_FACTOR = 5                                              # candidates per result from each retriever
+EMBED_TIMEOUT = float(os.getenv('KB_EMBED_TIMEOUT', '4'))        # seconds; lexical results cover slow calls
+VECTOR_QUANT = os.getenv('KB_VECTOR_QUANT', '').lower() or None  # int8 | float16 (binary index only)
+RERANK_FACTOR = int(os.getenv('KB_RERANK_FACTOR', '4'))          # quantized candidates per result, re-ranked exactly
+ANN_MIN_VECTORS = int(os.getenv('KB_ANN_MIN_VECTORS', '5000'))  # below this, exact scan is faster
+
+QUERY_CACHE_MEMORY = int(os.getenv('KB_QUERY_CACHE_SIZE', '2048'))           # in-process LRU entries
+QUERY_CACHE_MAX = int(os.getenv('KB_QUERY_CACHE_MAX', '20000'))              # persistent tier entries
+QUERY_CACHE_TTL = float(os.getenv('KB_QUERY_CACHE_TTL', str(30 * 86400)))    # seconds
 
 # Manual .env Reader (same as ingest)
 def get_api_key():
@@ -44,11 +87,11 @@ def cosine_similarity(v1, v2):
     if magnitude1 == 0 or magnitude2 == 0: return 0
     return dot_product / (magnitude1 * magnitude2)
 
-def generate_query_embedding(text):
+def _fetch_query_embedding(text):
     if not API_KEY: return None
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-embedding-001:embedContent?key={API_KEY}"
+    url = f"https://generativelanguage.googleapis.com/v1beta/models/{EMBED_MODEL}:embedContent?key={API_KEY}"
     payload = {
-        "model": "models/gemini-embedding-001",
+        "model": f"models/{EMBED_MODEL}",
         "content": {"parts": [{"text": text}]}
     }
     data = json.dumps(payload).encode('utf-8')
@@ -56,43 +99,275 @@ def generate_query_embedding(text):
     req.add_header('Content-Type', 'application/json')
     context = ssl._create_unverified_context()
     try:
-        with urllib.request.urlopen(req, context=context, timeout=10) as response:
+        with urllib.request.urlopen(req, context=context, timeout=EMBED_TIMEOUT) as response:
             res_data = json.loads(response.read().decode('utf-8'))
             return res_data.get('embedding', {}).get('values')
     except Exception as e:
         print(f"[KB/Search] Embedding Error: {e}")
         return None
 
-def search_knowledge(query, top_k=2):
+# Trailing politeness particles / punctuation that do not change the question
+_TRAILING_NOISE = re.compile(r'(?:\s|[?!.~,]|นะคะ|นะครับ|ครับผม|ครับ|คับ|ค่ะ|คะ|จ้า|จ้ะ|นะ)+$')
+
+def normalize_query(text):
+    """Canonical form used as the embedding cache key (and embedded as such)."""
+    text = unicodedata.normalize('NFC', str(text)).lower()
+    text = ' '.join(text.split())
+    return _TRAILING_NOISE.sub('', text) or text
+
+_query_cache = None
+_query_cache_lock = threading.Lock()
+
+def _get_query_cache():
+    global _query_cache
+    with _query_cache_lock:
+        if _query_cache is None:
+            _query_cache = make_cache('kb_query_embedding', memory_entries=QUERY_CACHE_MEMORY,
+                                      ttl=QUERY_CACHE_TTL, max_entries=QUERY_CACHE_MAX)
+        return _query_cache
+
+def generate_query_embedding(text):
     """
-    Search the vector index for relevant school knowledge.
+    Embedding for a customer question. Repeated questions ("ราคาเท่าไหร่ครับ",
+    "ราคาเท่าไหร่คะ") share one cache entry, so only the first one pays the
+    HTTPS round trip.
     """
-    if not os.path.exists(INDEX_PATH):
-        print("[KB/Search] Index not found.")
-        return []
+    query = normalize_query(text)
+    if not query: return None
+    key = hashlib.sha256(f"{EMBED_MODEL}\n{query}".encode('utf-8')).hexdigest()
+
+    cache = _get_query_cache()
+    vector = cache.get(key)
+    if vector is not None: return vector
+
+    vector = _fetch_query_embedding(query)
+    if vector:
+        cache.set(key, vector)
+    return vector
+
+def get_query_cache_stats():
+    """Hit/miss counters of the query-embedding cache."""
+    return _get_query_cache().stats()
+
+class VectorIndex:
+    """
+    Knowledge index over L2-normalized rows, so a query is one
+    matrix-vector product + argpartition top-k. The matrix is memory-mapped
+    from the binary store (see kb_store.py).
+    """
+    def __init__(self, matrix, items, dim):
+        self.matrix = matrix
+        self.items = items
+        self.dim = dim
+        self.ann = None      # IVFIndex over row numbers, attached for large indexes
+        self.lexical = None  # BM25Index in the same row order
+        self.quant = None    # QuantizedMatrix for candidate scoring (KB_VECTOR_QUANT)
+
+    @classmethod
+    def from_entries(cls, entries):
+        """Build from legacy JSON entries ({text, original, vector})."""
+        items = [{"id": e.get('id'), "text": e['text'], "original": e['original']} for e in entries]
+        vectors = [e['vector'] for e in entries]
+        dim = len(vectors[0]) if vectors else 0
+
+        if HAS_NUMPY:
+            matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), dim)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix = matrix / norms
+        else:
+            matrix = [_normalize(v) for v in vectors]
+        return cls(matrix, items, dim)
+
+    def __len__(self):
+        return len(self.items)
+
+    @classmethod
+    def load(cls, base_path):
+        return cls(*kb_store.load_index(base_path, expected_dim=EMBEDDING_DIM))
+
+    @classmethod
+    def load_json(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_entries(json.load(f))
+
+    def _query(self, query_vector):
+        if len(query_vector) != self.dim:
+            print(f"[KB/Search] Dimension mismatch: query {len(query_vector)} vs index {self.dim}")
+            return None
+        if HAS_NUMPY:
+            q = np.asarray(query_vector, dtype=np.float32)
+            norm = np.linalg.norm(q)
+            return q / norm if norm else None
+        q = _normalize(query_vector)
+        return q if any(q) else None
+
+    def search_rows(self, query_vector, top_k=2):
+        """[(cosine, row), ...] best first."""
+        k = min(top_k, len(self.items))
+        if k <= 0: return []
+        q = self._query(query_vector)
+        if q is None: return []
+
+        if self.ann is not None:
+            return self.ann.search(q, k)
+        if self.quant is not None:
+            return search_reranked(self.quant, self.matrix, q, k, k * RERANK_FACTOR)
+        if HAS_NUMPY:
+            scores = self.matrix @ q
+            top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+            top = top[np.argsort(-scores[top])]
+            return [(float(scores[i]), int(i)) for i in top]
+        return heapq.nlargest(k, ((sum(a * b for a, b in zip(q, v)), i) for i, v in enumerate(self.matrix)))
+
+    def score_rows(self, query_vector, rows):
+        """{row: cosine} for specific rows."""
+        q = self._query(query_vector)
+        if q is None: return {}
+        if HAS_NUMPY:
+            rows = list(rows)
+            return dict(zip(rows, (float(x) for x in np.asarray(self.matrix[rows]) @ q)))
+        return {row: sum(a * b for a, b in zip(q, self.matrix[row])) for row in rows}
+
+    def result(self, row, score, **extra):
+        # Rows past the vector matrix are chunks whose embedding failed (lexical index only)
+        item = self.items[row] if row < len(self.items) else self.lexical.documents[row]
+        return dict({
+            "score": score,
+            "text": item['text'],
+            "original": item['original']
+        }, **extra)
+
+    def search(self, query_vector, top_k=2):
+        return [self.result(row, score) for score, row in self.search_rows(query_vector, top_k)]
+
+def _normalize(v):
+    magnitude = math.sqrt(sum(a * a for a in v))
+    return [a / magnitude for a in v] if magnitude else list(v)
+
+_index = None
+_index_mtime = None
+_index_lock = threading.Lock()
+
+def _load_or_build_ann(index, index_mtime):
+    """IVF index over the matrix rows, persisted next to the binary store."""
+    path = INDEX_BASE + ".ivf.npz"
+    try:
+        if os.path.getmtime(path) >= index_mtime:
+            ann = IVFIndex.load(path)
+            if len(ann) == len(index) and ann.dim == index.dim:
+                return ann
+    except OSError:
+        pass
+    except Exception as e:
+        print(f"[KB/Search] ANN Load Error: {e}")
 
+    ann = IVFIndex(index.dim)
+    ann.add(np.asarray(index.matrix))
     try:
-        with open(INDEX_PATH, 'r', encoding='utf-8') as f:
-            vector_store = json.load(f)
+        ann.save(path)
+    except OSError as e:
+        print(f"[KB/Search] ANN Save Error: {e}")
+    print(f"[KB/Search] Built ANN index ({len(ann.centroids) if ann.trained else 0} lists)")
+    return ann
+
+def _load_lexical(index):
+    """BM25 index written by knowledge_ingest.py, if its leading rows match the vector rows."""
+    try:
+        lexical = BM25Index.load(LEXICAL_PATH)
+    except FileNotFoundError:
+        return None
     except Exception as e:
-        print(f"[KB/Search] Read Error: {e}")
+        print(f"[KB/Search] Lexical Index Error: {e}")
+        return None
+    if lexical.ids[:len(index)] != [item.get('id') for item in index.items]:
+        print("[KB/Search] Lexical index is out of step with the vector index; re-run knowledge_ingest.py")
+        return None
+    return lexical
+
+def get_index():
+    """
+    Process-wide index, loaded on first use and reloaded only when the
+    index files change on disk (e.g. after knowledge_ingest.py).
+    Falls back to the legacy vector_index.json until it is converted.
+    """
+    global _index, _index_mtime
+    _, meta_path = kb_store.index_paths(INDEX_BASE)
+    binary = os.path.exists(meta_path)
+    try:
+        mtime = os.path.getmtime(meta_path if binary else INDEX_PATH)
+    except OSError:
+        return None
+    if os.path.exists(LEXICAL_PATH):
+        mtime = max(mtime, os.path.getmtime(LEXICAL_PATH))
+
+    with _index_lock:
+        if _index is None or mtime != _index_mtime:
+            try:
+                _index = VectorIndex.load(INDEX_BASE) if binary else VectorIndex.load_json(INDEX_PATH)
+                _index_mtime = mtime
+                if HAS_ANN and len(_index) >= ANN_MIN_VECTORS:
+                    _index.ann = _load_or_build_ann(_index, mtime)
+                elif binary and HAS_NUMPY and VECTOR_QUANT:
+                    _index.quant = QuantizedMatrix.from_matrix(_index.matrix, VECTOR_QUANT)
+                _index.lexical = _load_lexical(_index)
+                print(f"[KB/Search] Loaded {len(_index)} vectors (binary={binary}, numpy={HAS_NUMPY}, "
+                      f"quant={_index.quant.kind if _index.quant else None})")
+            except Exception as e:
+                print(f"[KB/Search] Read Error: {e}")
+                return _index
+        return _index
+
+def search_knowledge(query, top_k=2):
+    """
+    Search the school knowledge (hybrid: vector + BM25).
+    Each result carries the fused `score` (ranking only) plus `vector_score` /
+    `lexical_score`; filter with is_relevant(). Without an embedding (API slow
+    or down) results are lexical only.
+    """
+    index = get_index()
+    if index is None:
+        print("[KB/Search] Index not found.")
         return []
 
+    query = normalize_query(query)
+    pool = max(top_k * CANDIDATE_FACTOR, 10)
+    lexical_hits = index.lexical.search(query, pool) if index.lexical is not None else []
+
     query_vector = generate_query_embedding(query)
-    if not query_vector: return []
+    if not query_vector:
+        if lexical_hits:
+            print("[KB/Search] Embedding unavailable, using lexical results only")
+        return [index.result(row, score, vector_score=None, lexical_score=score)
+                for score, row in lexical_hits[:top_k]]
 
-    results = []
-    for item in vector_store:
-        score = cosine_similarity(query_vector, item['vector'])
-        results.append({
-            "score": score,
-            "text": item['text'],
-            "original": item['original']
-        })
+    vector_hits = index.search_rows(query_vector, pool)
+    if index.lexical is None:
+        return [index.result(row, score, vector_score=score, lexical_score=None)
+                for score, row in vector_hits[:top_k]]
 
-    # Sort by score descending
-    results.sort(key=lambda x: x['score'], reverse=True)
-    return results[:top_k]
+    candidates = {row for _, row in vector_hits} | {row for _, row in lexical_hits}
+    vector_scores = dict((row, score) for score, row in vector_hits)
+    missing = {row for row in candidates - set(vector_scores) if row < len(index)}
+    if missing:
+        vector_scores.update(index.score_rows(query_vector, missing))
+    lexical_scores = index.lexical.score_docs(query, candidates)
+
+    fused = sorted((
+        ((1 - LEXICAL_WEIGHT) * vector_scores.get(row, 0.0) + LEXICAL_WEIGHT * lexical_scores[row], row)
+        for row in candidates
+    ), reverse=True)
+    return [index.result(row, score, vector_score=vector_scores.get(row), lexical_score=lexical_scores[row])
+            for score, row in fused[:top_k]]
+
+def is_relevant(result):
+    """
+    Relevance cut-off per signal: cosine against MIN_SCORE when the chunk has
+    a vector score, otherwise normalized BM25 against LEXICAL_MIN_SCORE.
+    """
+    if result.get('vector_score') is not None:
+        return result['vector_score'] > MIN_SCORE
+    return (result.get('lexical_score') or 0.0) > LEXICAL_MIN_SCORE
 
 if __name__ == "__main__":
     # Test
@@ -100,4 +375,6 @@ if __name__ == "__main__":
     print(f"Searching for: {q}")
     matches = search_knowledge(q)
     for m in matches:
-        print(f"[{m['score']:.4f}] {m['original']['answer']}")
+        print(f"[{m['score']:.4f}] (vector={m['vector_score']}, lexical={m['lexical_score']}) {m['original']['answer']}")
+    search_knowledge(q + "ครับ")
+    print(f"Query cache: {get_query_cache_stats()}")
@@ -3,6 +3,14 @@ V-School Knowledge Ingestion Engine (Zero-Dependency)
 ────────────────────────────────────────────────────
 Standalone script to generate AI embeddings for the V-School KB.
 No external dependencies (no dotenv, no requests, no google-ai).
+Writes the binary index format (see kb_store.py) and the BM25 lexical
+index over the same rows plus any chunk whose embedding failed (see
+lexical_index.py).
+
+Incremental: every Q/A pair is keyed by a SHA-256 of its text; pairs whose
+hash is already in the current index keep their vector, and only new or
+edited pairs are sent to batchEmbedContents (KB_EMBED_BATCH_SIZE per call,
+KB_EMBED_CONCURRENCY calls in flight).
 """
 
 import os
@@ -11,6 +19,11 @@ import urllib.request
 import urllib.error
 import time
 import ssl
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import kb_store
+from lexical_index import BM25Index
 
 # --- Manual .env Reader ---
 def get_api_key():
@@ -38,30 +51,36 @@ def get_api_key():
 
 API_KEY = os.getenv('GEMINI_API_KEY') or get_api_key()
 KNOWLEDGE_DIR = "/Users/ideab/Desktop/data_hub/knowledge"
-INDEX_PATH = os.path.join(KNOWLEDGE_DIR, "vector_index.json")
+INDEX_BASE = os.path.join(KNOWLEDGE_DIR, "vector_index")  # -> vector_index.f32 + vector_index.meta.json
+LEGACY_INDEX_PATH = os.path.join(KNOWLEDGE_DIR, "vector_index.json")
+LEXICAL_PATH = os.path.join(KNOWLEDGE_DIR, "lexical_index.json")
+INDEX_FILES = {"vector_index.json", "vector_index.meta.json", "lexical_index.json"}
+
+# Using gemini-embedding-001 as confirmed by model list
+EMBED_MODEL = "gemini-embedding-001"
+EMBED_BATCH_SIZE = min(100, max(1, int(os.getenv('KB_EMBED_BATCH_SIZE', '100'))))  # API max: 100 per call
+EMBED_CONCURRENCY = max(1, int(os.getenv('KB_EMBED_CONCURRENCY', '2')))
+EMBED_MAX_RETRIES = 3
+
+def _post_json(url, payload, timeout):
+    data = json.dumps(payload).encode('utf-8')
+    req = urllib.request.Request(url, data=data, method='POST')
+    req.add_header('Content-Type', 'application/json')
+    context = ssl._create_unverified_context()
+    with urllib.request.urlopen(req, context=context, timeout=timeout) as response:
+        return json.loads(response.read().decode('utf-8'))
 
 def generate_embedding(text):
     if not API_KEY: return None
 
-    # Using gemini-embedding-001 as confirmed by model list
-    model = "gemini-embedding-001"
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:embedContent?key={API_KEY}"
-    
+    url = f"https://generativelanguage.googleapis.com/v1beta/models/{EMBED_MODEL}:embedContent?key={API_KEY}"
     payload = {
-        "model": f"models/{model}",
+        "model": f"models/{EMBED_MODEL}",
         "content": {"parts": [{"text": text}]}
     }
-    
-    data = json.dumps(payload).encode('utf-8')
-    req = urllib.request.Request(url, data=data, method='POST')
-    req.add_header('Content-Type', 'application/json')
-    
-    context = ssl._create_unverified_context()
-    
+
     try:
-        with urllib.request.urlopen(req, context=context, timeout=15) as response:
-            res_data = json.loads(response.read().decode('utf-8'))
-            return res_data.get('embedding', {}).get('values')
+        return _post_json(url, payload, timeout=15).get('embedding', {}).get('values')
     except urllib.error.HTTPError as e:
         print(f"[Ingest] HTTP Error {e.code}: {e.read().decode('utf-8')}")
         return None
@@ -69,42 +88,133 @@ def generate_embedding(text):
         print(f"[Ingest] Error: {e}")
         return None
 
-def ingest_all():
-    if not os.path.exists(KNOWLEDGE_DIR):
-        print(f"[Ingest] Directory not found: {KNOWLEDGE_DIR}")
-        return
+def generate_embeddings_batch(texts):
+    """
+    One batchEmbedContents call for up to EMBED_BATCH_SIZE texts.
+    Returns a list of vectors aligned with `texts`, or None on failure.
+    Retries with backoff only when the API is throttling (429/503).
+    """
+    if not API_KEY: return None
 
-    vector_store = []
-    
-    # Seed data search
-    for filename in os.listdir(KNOWLEDGE_DIR):
-        if filename.endswith(".json") and filename != "vector_index.json":
+    url = f"https://generativelanguage.googleapis.com/v1beta/models/{EMBED_MODEL}:batchEmbedContents?key={API_KEY}"
+    payload = {"requests": [
+        {"model": f"models/{EMBED_MODEL}", "content": {"parts": [{"text": t}]}} for t in texts
+    ]}
+
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        try:
+            embeddings = _post_json(url, payload, timeout=60).get('embeddings', [])
+            vectors = [e.get('values') for e in embeddings]
+            if len(vectors) != len(texts) or not all(vectors):
+                print(f"[Ingest] Batch returned {len(vectors)} embeddings for {len(texts)} texts")
+                return None
+            return vectors
+        except urllib.error.HTTPError as e:
+            if e.code in (429, 503) and attempt < EMBED_MAX_RETRIES:
+                time.sleep(2 ** attempt)
+                continue
+            print(f"[Ingest] HTTP Error {e.code}: {e.read().decode('utf-8')}")
+            return None
+        except Exception as e:
+            print(f"[Ingest] Batch Error: {e}")
+            return None
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def load_previous_vectors():
+    """
+    Manifest of the current index: {content_hash: vector}.
+    Empty if there is no index yet or it was built with another model.
+    """
+    entries, model = [], EMBED_MODEL
+    try:
+        entries, model = kb_store.load_entries(INDEX_BASE)
+    except FileNotFoundError:
+        # First run after the binary format: seed from the legacy JSON index
+        try:
+            with open(LEGACY_INDEX_PATH, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+    except Exception as e:
+        print(f"[Ingest] Previous index unreadable, rebuilding all: {e}")
+
+    if model and model != EMBED_MODEL:
+        print(f"[Ingest] Embedding model changed ({model} -> {EMBED_MODEL}), rebuilding all")
+        return {}
+    return {e.get('hash') or content_hash(e['text']): e['vector'] for e in entries if e.get('vector')}
+
+def collect_items():
+    items = []
+    for filename in sorted(os.listdir(KNOWLEDGE_DIR)):
+        if filename.endswith(".json") and filename not in INDEX_FILES:
             file_path = os.path.join(KNOWLEDGE_DIR, filename)
             try:
                 with open(file_path, 'r', encoding='utf-8') as f:
                     data = json.load(f)
-                
                 print(f"[Ingest] Processing {filename}...")
                 for item in data:
                     combined_text = f"Question: {item.get('question', '')}\nAnswer: {item.get('answer', '')}"
-                    print(f"  -> Indexing: {item.get('id')}...")
-                    embedding = generate_embedding(combined_text)
-                    if embedding:
-                        vector_store.append({
-                            "id": item.get("id"),
-                            "text": combined_text,
-                            "original": item,
-                            "vector": embedding
-                        })
-                        time.sleep(0.5) 
+                    items.append({
+                        "id": item.get("id"),
+                        "text": combined_text,
+                        "original": item,
+                        "hash": content_hash(combined_text)
+                    })
             except Exception as e:
                 print(f"[Ingest] File Error {filename}: {e}")
+    return items
+
+def ingest_all():
+    if not os.path.exists(KNOWLEDGE_DIR):
+        print(f"[Ingest] Directory not found: {KNOWLEDGE_DIR}")
+        return
+
+    items = collect_items()
+    previous = load_previous_vectors()
+
+    pending = {}
+    for item in items:
+        if item['hash'] in previous:
+            item['vector'] = previous[item['hash']]
+        else:
+            pending.setdefault(item['hash'], item['text'])
+
+    reused = sum(1 for item in items if 'vector' in item)
+    print(f"[Ingest] {len(items)} items: {reused} unchanged, {len(pending)} to embed")
+
+    if pending:
+        hashes = list(pending)
+        batches = [hashes[i:i + EMBED_BATCH_SIZE] for i in range(0, len(hashes), EMBED_BATCH_SIZE)]
+        fresh = {}
+        with ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as pool:
+            for batch, vectors in zip(batches, pool.map(lambda b: generate_embeddings_batch([pending[h] for h in b]), batches)):
+                if vectors:
+                    fresh.update(zip(batch, vectors))
+        print(f"[Ingest] Embedded {len(fresh)}/{len(pending)} in {len(batches)} batch call(s)")
+        for item in items:
+            if 'vector' not in item and item['hash'] in fresh:
+                item['vector'] = fresh[item['hash']]
+
+    vector_store = [item for item in items if item.get('vector')]
+    skipped = len(items) - len(vector_store)
+    if skipped:
+        print(f"[Ingest] ⚠️ {skipped} items left out of the vector index (embedding failed, lexical only); re-run to retry")
 
     if vector_store:
         try:
-            with open(INDEX_PATH, 'w', encoding='utf-8') as f:
-                json.dump(vector_store, f, ensure_ascii=False, indent=2)
-            print(f"[Ingest] Total: {len(vector_store)} vectors saved to {INDEX_PATH}")
+            kb_store.write_index(INDEX_BASE, vector_store, model=EMBED_MODEL)
+            print(f"[Ingest] Total: {len(vector_store)} vectors saved to {INDEX_BASE}{kb_store.MATRIX_SUFFIX}")
+            # Same rows, same order -> knowledge_base fuses both by row number. Chunks left out
+            # of the vector index follow, so the lexical fallback still finds them.
+            unembedded = [item for item in items if not item.get('vector')]
+            lexical_rows = vector_store + unembedded
+            documents = {len(vector_store) + i: {"text": item['text'], "original": item['original']}
+                         for i, item in enumerate(unembedded)}
+            BM25Index.build([e['text'] for e in lexical_rows], ids=[e['id'] for e in lexical_rows],
+                            documents=documents).save(LEXICAL_PATH)
+            print(f"[Ingest] Lexical index saved to {LEXICAL_PATH} ({len(lexical_rows)} rows)")
         except Exception as e:
             print(f"[Ingest] Save Error: {e}")
 
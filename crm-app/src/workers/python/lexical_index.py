@@ -0,0 +1,138 @@
+"""
+V-School Lexical Index (BM25)
+─────────────────────────────
+Local inverted index over the FAQ question/answer text. Thai is written
+without spaces, so Thai runs are indexed as overlapping character n-grams
+(2 + 3 chars); Latin words and numbers are indexed as whole tokens.
+
+Built by `knowledge_ingest.py` next to the vector index (same row order,
+followed by any chunks whose embedding failed, stored in `documents`) and
+fused with vector scores in `knowledge_base.search_knowledge`. It needs no
+network, so retrieval keeps working when the embedding API is slow or down.
+
+Scores are normalized to roughly 0..1: BM25 divided by the score of an
+average-length document that contains each query term once.
+"""
+
+import os
+import re
+import json
+import math
+import unicodedata
+from collections import Counter
+
+INDEX_VERSION = 1
+NGRAM_SIZES = (2, 3)
+_TOKEN = re.compile(r'[\u0E00-\u0E7F]+|[^\W_]+')
+_THAI = re.compile(r'[\u0E00-\u0E7F]+')
+
+
+def tokenize(text):
+    text = unicodedata.normalize('NFC', str(text or '')).lower()
+    tokens = []
+    for run in _TOKEN.findall(text):
+        if _THAI.fullmatch(run):
+            if len(run) < NGRAM_SIZES[0]:
+                tokens.append(run)
+            for n in NGRAM_SIZES:
+                tokens.extend(run[i:i + n] for i in range(len(run) - n + 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+class BM25Index:
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids = []
+        self.doc_len = []
+        self.postings = {}   # term -> {doc: tf}
+        self.avgdl = 0.0
+        self.documents = {}  # doc -> {"text", "original"} for rows without a vector
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    @classmethod
+    def build(cls, texts, ids=None, documents=None, **kwargs):
+        index = cls(**kwargs)
+        index.documents = dict(documents or {})
+        for doc, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            index.doc_len.append(sum(counts.values()))
+            for term, tf in counts.items():
+                index.postings.setdefault(term, {})[doc] = tf
+        index.ids = list(ids) if ids is not None else list(range(len(index.doc_len)))
+        index._update_avgdl()
+        return index
+
+    def _update_avgdl(self):
+        self.avgdl = (sum(self.doc_len) / len(self.doc_len)) if self.doc_len else 0.0
+
+    def _idf(self, term):
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.doc_len) - df + 0.5) / (df + 0.5))
+
+    def _query_terms(self, query):
+        return [(term, self._idf(term)) for term in set(tokenize(query))]
+
+    def _term_score(self, idf, tf, doc):
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len[doc] / (self.avgdl or 1))
+        return idf * tf * (self.k1 + 1) / (tf + norm)
+
+    def _scores(self, terms, docs=None):
+        scores = {}
+        for term, idf in terms:
+            for doc, tf in self.postings.get(term, {}).items():
+                if docs is None or doc in docs:
+                    scores[doc] = scores.get(doc, 0.0) + self._term_score(idf, tf, doc)
+        ideal = sum(idf for _, idf in terms) or 1.0
+        return {doc: min(1.0, s / ideal) for doc, s in scores.items()}
+
+    def search(self, query, top_k=10):
+        """[(score, doc), ...] best first."""
+        scores = self._scores(self._query_terms(query))
+        return sorted(((s, doc) for doc, s in scores.items()), reverse=True)[:top_k]
+
+    def score_docs(self, query, docs):
+        """{doc: score} for specific documents (0.0 if nothing matches)."""
+        docs = set(docs)
+        scores = self._scores(self._query_terms(query), docs)
+        return {doc: scores.get(doc, 0.0) for doc in docs}
+
+    def save(self, path):
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({
+                "version": INDEX_VERSION,
+                "k1": self.k1, "b": self.b,
+                "ids": self.ids,
+                "doc_len": self.doc_len,
+                "postings": {term: [[doc, tf] for doc, tf in docs.items()] for term, docs in self.postings.items()},
+                "documents": [[doc, payload] for doc, payload in self.documents.items()],
+            }, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != INDEX_VERSION:
+            raise ValueError(f"unsupported lexical index version {data.get('version')}")
+        index = cls(data['k1'], data['b'])
+        index.ids = data['ids']
+        index.doc_len = data['doc_len']
+        index.postings = {term: {doc: tf for doc, tf in docs} for term, docs in data['postings'].items()}
+        index.documents = {doc: payload for doc, payload in data.get('documents', [])}
+        index._update_avgdl()
+        return index
+
+
+if __name__ == "__main__":
+    print(tokenize("คอร์สซูชิราคาเท่าไหร่ Sushi 101"))
+    idx = BM25Index.build([
+        "Question: คอร์สซูชิราคาเท่าไหร่\nAnswer: คอร์ส Sushi & Sashimi 101 ราคา 17,000 บาท",
+        "Question: โรงเรียนอยู่ที่ไหน\nAnswer: ใกล้ BTS/MRT กรุงเทพ",
+    ])
+    print(idx.search("ซูชิ ราคา"))
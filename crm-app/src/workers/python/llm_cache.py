@@ -0,0 +1,130 @@
+"""
+V-School LLM Response Cache
+───────────────────────────
+Content-addressed cache for Gemini analyzer calls. The key is a SHA-256 of
+  (analyzer, model, prompt template version, normalized inputs, image bytes)
+so retried webhooks, repeated sweeps over unchanged chats and the same slip
+image sent twice are answered from the cache instead of a new API call.
+Bump an analyzer's template version whenever its prompt changes.
+
+Only successfully parsed results are stored. Storage is cache_store's tiered
+cache: in-process LRU + SQLite (default) or Redis (CACHE_BACKEND), with TTL
+and size-bounded LRU eviction. Per-analyzer hits, misses and the tokens the
+hits would have cost are exposed via get_llm_cache_stats().
+
+Config (env):
+  LLM_CACHE_ENABLED   1 | 0                       (default: 1)
+  LLM_CACHE_TTL       seconds                     (default: 7 days)
+  LLM_CACHE_SIZE      in-process LRU entries      (default: 512)
+  LLM_CACHE_MAX       persistent tier entries     (default: 20000)
+"""
+
+import os
+import json
+import hashlib
+import threading
+import unicodedata
+
+from cache_store import make_cache
+from gemini_client import get_client
+
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', '1') == '1'
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', str(7 * 86400)))
+LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', '512'))
+LLM_CACHE_MAX = int(os.getenv('LLM_CACHE_MAX', '20000'))
+
+_cache = None
+_cache_lock = threading.Lock()
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = make_cache('llm_responses', memory_entries=LLM_CACHE_SIZE,
+                                ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX)
+        return _cache
+
+
+def _normalize(value):
+    """Whitespace/Unicode-insensitive form of the inputs (strings NFC + collapsed whitespace)."""
+    if isinstance(value, str):
+        return ' '.join(unicodedata.normalize('NFC', value).split())
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def parse_json_text(text):
+    """JSON object from a model response (strips ```json fences and surrounding prose)."""
+    text = text.replace('```json', '').replace('```', '').strip()
+    if '{' in text and '}' in text:
+        text = text[text.find('{'):text.rfind('}') + 1]
+    return json.loads(text)
+
+
+def cache_key(analyzer, model, template_version, inputs, images=()):
+    h = hashlib.sha256()
+    h.update(json.dumps([analyzer, model, template_version, _normalize(inputs)],
+                        ensure_ascii=False, sort_keys=True, default=str).encode('utf-8'))
+    for image in images:
+        h.update(b'\0image\0' + hashlib.sha256(image).digest())
+    return f"{analyzer}:{h.hexdigest()}"
+
+
+def _count(analyzer, field, amount=1):
+    with _stats_lock:
+        entry = _stats.setdefault(analyzer, {"hits": 0, "misses": 0, "tokens_saved": 0, "tokens_spent": 0})
+        entry[field] += amount
+
+
+def _usage_tokens(response):
+    usage = getattr(response, 'usage_metadata', None)
+    return (getattr(usage, 'prompt_token_count', 0) or 0) + (getattr(usage, 'candidates_token_count', 0) or 0)
+
+
+def generate_cached(analyzer, model, template_version, inputs, contents, parse, images=(), config=None):
+    """
+    parse(response.text) for a Gemini call, served from the cache when the same
+    (model, template version, inputs, images) was answered before.
+    `inputs` are every variable of the prompt; `images` the raw bytes of any
+    image in `contents`. Exceptions (API or parse) propagate and are not cached.
+    Returns a fresh copy, so callers may mutate the result.
+    """
+    key = cache_key(analyzer, model, template_version, inputs, images) if LLM_CACHE_ENABLED else None
+    if key:
+        hit = _get_cache().get(key)
+        if hit is not None:
+            _count(analyzer, "hits")
+            _count(analyzer, "tokens_saved", hit.get('tokens', 0))
+            return json.loads(json.dumps(hit['value']))
+
+    kwargs = {"config": config} if config else {}
+    response = get_client().models.generate_content(model=model, contents=contents, **kwargs)
+    value = parse(response.text)
+    tokens = _usage_tokens(response)
+    _count(analyzer, "misses")
+    _count(analyzer, "tokens_spent", tokens)
+    if key:
+        _get_cache().set(key, {"value": value, "tokens": tokens})
+    return json.loads(json.dumps(value))
+
+
+def get_llm_cache_stats():
+    """Per-analyzer hits / misses / tokens_saved plus the underlying cache tiers."""
+    with _stats_lock:
+        stats = {name: dict(entry) for name, entry in _stats.items()}
+    for entry in stats.values():
+        lookups = entry['hits'] + entry['misses']
+        entry['hit_rate'] = round(entry['hits'] / lookups, 4) if lookups else 0.0
+    stats['_store'] = _get_cache().stats() if LLM_CACHE_ENABLED else {}
+    return stats
+
+
+if __name__ == "__main__":
+    print(cache_key('intel', 'gemini-2.0-flash', 1, {"chat": "User:  ราคา  เท่าไหร่"}))
+    print(cache_key('intel', 'gemini-2.0-flash', 1, {"chat": "User: ราคา เท่าไหร่"}))
@@ -87,10 +87,13 @@ def sync_marketing_data():
         # data["creatives"] = [] # Placeholder
 
         # 3. Save Bulk Data to DB
-        success = upsert_marketing_data(data)
-        if not success:
+        upsert_counts = upsert_marketing_data(data)
+        if not upsert_counts:
             print("[MarketingSync] ❌ Failed to save bulk data to DB")
             return
+        if isinstance(upsert_counts, dict):
+            for entity, c in upsert_counts.items():
+                print(f"💾 {entity}: {c['inserted']} inserted, {c['updated']} updated" + (f", {c['skipped']} skipped (missing parent)" if c.get('skipped') else ""))
 
         # 4. Fetch Daily Insights (Year 2026 Only)
         print("[MarketingSync] 🔄 Fetching Daily Insights (Year 2026 window)...")
@@ -0,0 +1,267 @@
+"""
+V-School Persistent Queue Worker
+────────────────────────────────
+Long-lived consumer for the BullMQ queue that the Node side fills
+(`eventProducer.js` -> 'fb-events'). Replaces the one-interpreter-per-event
+`PYTHON_INPUT` path under load: imports (PIL, redis, genai...) are paid once
+and every job runs `process_event` in-process.
+
+Config (env):
+  PYTHON_QUEUE_NAME          BullMQ queue to consume     (default: fb-events)
+  PYTHON_WORKER_CONCURRENCY  Events processed in parallel (default: 4)
+  PYTHON_DEBOUNCE_MS         Per-sender coalescing window, 0 = off (default: 2000)
+  PYTHON_DEBOUNCE_MAX_MS     Max delay of a burst's first event     (default: 8000)
+  PYTHON_WORKER_PREFETCH     Extra jobs held while debouncing/queued (default: 16)
+  PYTHON_LANE_WEIGHTS        Fair-share weights per lane (default: slip=6,buy_intent=3,general=1)
+  PYTHON_LANE_CAPS           Max concurrent events per lane (default: general=concurrency/2)
+
+Customers often send 3-5 short messages in a row; with debouncing the burst
+runs through the pipeline once (newest text + all attachments), so sync,
+analysis and auto-reply are not repeated per message.
+
+Bursts are then scheduled by lane (event_priority.py): payment slips and
+buy-intent messages keep low latency while general chatter is backlogged.
+
+NOTE: Run either this worker or `eventProcessor.mjs` against a given queue,
+not both — BullMQ would split the jobs between them.
+"""
+
+import os
+import json
+import signal
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from event_priority import LANES, classify_event
+
+try:
+    from bullmq import Worker
+    HAS_BULLMQ = True
+except ImportError:
+    HAS_BULLMQ = False
+
+
+def _parse_lanes(spec, setting):
+    """
+    'slip=6,buy_intent=3' -> {'slip': 6, 'buy_intent': 3}. Values must be
+    integers >= 1 (a zero weight or cap would stall the lane); bad entries
+    are logged and ignored, so the lane keeps its default.
+    """
+    out = {}
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        name, sep, value = part.partition('=')
+        try:
+            number = int(value)
+        except ValueError:
+            number = None
+        if not sep or not name.strip() or number is None or number < 1:
+            print(f"[Python Worker] Ignoring {setting} entry '{part}' (expected lane=<integer >= 1>)")
+            continue
+        out[name.strip()] = number
+    return out
+
+
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379')
+QUEUE_NAME = os.getenv('PYTHON_QUEUE_NAME', 'fb-events')
+WORKER_CONCURRENCY = max(1, int(os.getenv('PYTHON_WORKER_CONCURRENCY', '4')))
+DEBOUNCE_WINDOW = float(os.getenv('PYTHON_DEBOUNCE_MS', '2000')) / 1000
+DEBOUNCE_MAX_WAIT = float(os.getenv('PYTHON_DEBOUNCE_MAX_MS', '8000')) / 1000
+PREFETCH = max(0, int(os.getenv('PYTHON_WORKER_PREFETCH', '16')))
+LANE_WEIGHTS = _parse_lanes(os.getenv('PYTHON_LANE_WEIGHTS', 'slip=6,buy_intent=3,general=1'), 'PYTHON_LANE_WEIGHTS')
+LANE_CAPS = _parse_lanes(os.getenv('PYTHON_LANE_CAPS', ''), 'PYTHON_LANE_CAPS')
+
+
+def merge_events(events):
+    """One event for a burst: newest message text + every attachment, in arrival order."""
+    merged = dict(events[-1])
+    merged['message'] = next((e['message'] for e in reversed(events) if e.get('message')), merged.get('message', ''))
+    attachments = [a for e in events for a in (e.get('attachments') or [])]
+    if attachments:
+        merged['attachments'] = attachments
+    if len(events) > 1:
+        merged['coalesced'] = len(events)
+    return merged
+
+
+class _Burst:
+    def __init__(self, loop):
+        self.events = []
+        self.future = loop.create_future()
+        self.started = loop.time()
+        self.timer = None
+
+
+class SenderCoalescer:
+    """
+    Debounces events per sender: an event waits `window` seconds for more
+    from the same sender (at most `max_wait` from the first one), then the
+    burst runs once as a merged event. Every job of the burst gets its result.
+    Bursts of the same sender never run concurrently.
+    """
+    def __init__(self, run, window, max_wait):
+        self.run = run
+        self.window = window
+        self.max_wait = max(window, max_wait)
+        self._pending = {}   # sender -> _Burst still collecting
+        self._locks = {}     # sender -> [asyncio.Lock, users]
+
+    async def submit(self, event):
+        sender = (event.get('sender') or {}).get('id')
+        if not sender or self.window <= 0:
+            return await self.run(event)
+
+        loop = asyncio.get_running_loop()
+        burst = self._pending.get(sender)
+        if burst is None:
+            burst = self._pending[sender] = _Burst(loop)
+        burst.events.append(event)
+        if burst.timer:
+            burst.timer.cancel()
+        delay = min(self.window, max(0.0, burst.started + self.max_wait - loop.time()))
+        burst.timer = loop.call_later(delay, self._flush, sender, burst)
+        # shield: one job being cancelled must not cancel the shared burst
+        return await asyncio.shield(burst.future)
+
+    def _flush(self, sender, burst):
+        if self._pending.get(sender) is burst:
+            del self._pending[sender]
+        asyncio.ensure_future(self._execute(sender, burst))
+
+    async def _execute(self, sender, burst):
+        entry = self._locks.setdefault(sender, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                if len(burst.events) > 1:
+                    print(f"[Python Worker] Coalesced {len(burst.events)} events from {sender}")
+                result = await self.run(merge_events(burst.events))
+            burst.future.set_result(result)
+        except Exception as e:
+            burst.future.set_exception(e)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._locks.pop(sender, None)
+
+
+class LaneScheduler:
+    """
+    Weighted fair dequeue over priority lanes (stride scheduling): with
+    weights slip=6, buy_intent=3, general=1 a backlog of chatter gets 1 slot
+    in 10 while sales events are waiting, and never starves. Each lane also
+    has a concurrency cap, so general events cannot occupy every slot.
+    """
+    def __init__(self, run, slots, classify, weights, caps):
+        self.run = run
+        self.slots = slots
+        self.classify = classify
+        self.lanes = list(weights)
+        self.weights = weights
+        self.caps = caps
+        self._queues = {lane: deque() for lane in self.lanes}
+        self._active = {lane: 0 for lane in self.lanes}
+        self._pass = {lane: 0.0 for lane in self.lanes}
+        self._vtime = 0.0
+        self._running = 0
+
+    async def submit(self, event):
+        lane = self.classify(event)
+        if lane not in self._queues:
+            lane = self.lanes[-1]
+        future = asyncio.get_running_loop().create_future()
+        if not self._queues[lane]:
+            # An idle lane re-enters at the current virtual time (no saved-up credit)
+            self._pass[lane] = max(self._pass[lane], self._vtime)
+        self._queues[lane].append((event, future))
+        self._dispatch()
+        return await future
+
+    def _dispatch(self):
+        while self._running < self.slots:
+            ready = [l for l in self.lanes if self._queues[l] and self._active[l] < self.caps[l]]
+            if not ready: return
+            lane = min(ready, key=lambda l: (self._pass[l], self.lanes.index(l)))
+            self._vtime = self._pass[lane]
+            self._pass[lane] += 1.0 / self.weights[lane]
+            event, future = self._queues[lane].popleft()
+            self._active[lane] += 1
+            self._running += 1
+            asyncio.ensure_future(self._execute(lane, event, future))
+
+    async def _execute(self, lane, event, future):
+        try:
+            future.set_result(await self.run(event))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            self._active[lane] -= 1
+            self._running -= 1
+            self._dispatch()
+
+    def backlog(self):
+        return {lane: len(q) for lane, q in self._queues.items()}
+
+
+async def _run(handler, concurrency):
+    loop = asyncio.get_running_loop()
+    # process_event is blocking (HTTP + DB), so it runs on a bounded thread pool
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='event')
+    stop = asyncio.Event()
+
+    async def run_event(event):
+        try:
+            result = await loop.run_in_executor(executor, handler, event)
+        except Exception as e:
+            # Same contract as Direct Mode, then fail the job(s) so BullMQ keeps them
+            print(json.dumps({"success": False, "error": str(e)}))
+            raise
+        print(json.dumps(result, ensure_ascii=False, default=str))
+        return result
+
+    weights = {lane: LANE_WEIGHTS.get(lane, 1) for lane in LANES}
+    default_caps = {'slip': concurrency, 'buy_intent': concurrency, 'general': max(1, concurrency // 2)}
+    caps = {lane: LANE_CAPS.get(lane, default_caps.get(lane, concurrency)) for lane in LANES}
+    scheduler = LaneScheduler(run_event, concurrency, classify_event, weights, caps)
+    coalescer = SenderCoalescer(scheduler.submit, DEBOUNCE_WINDOW, DEBOUNCE_MAX_WAIT)
+
+    async def process(job, job_token):
+        return await coalescer.submit(job.data or {})
+
+    # Jobs waiting in a debounce window or a lane only hold an asyncio task, so
+    # BullMQ may hand out more jobs than there are executor threads; the lane
+    # scheduler decides which of them run first.
+    worker = Worker(QUEUE_NAME, process, {
+        "connection": REDIS_URL,
+        "concurrency": concurrency + PREFETCH,
+    })
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows: fall back to KeyboardInterrupt
+
+    print(f"[Python Worker] Queue Mode: consuming '{QUEUE_NAME}' (concurrency={concurrency}, debounce={DEBOUNCE_WINDOW}s)")
+    await stop.wait()
+
+    print("[Python Worker] Shutdown requested. Waiting for active jobs to finish...")
+    await worker.close()
+    executor.shutdown(wait=True)
+    print("[Python Worker] Stopped cleanly.")
+
+
+def run_worker(handler, concurrency=None):
+    """
+    Blocks and feeds queue jobs into `handler(event) -> dict` until SIGINT/SIGTERM.
+    Returns False if the worker could not start.
+    """
+    if not HAS_BULLMQ:
+        print("[Python Worker] ❌ 'bullmq' is not installed (pip install bullmq). Queue Mode unavailable.")
+        return False
+
+    try:
+        asyncio.run(_run(handler, concurrency or WORKER_CONCURRENCY))
+    except KeyboardInterrupt:
+        pass
+    return True
@@ -0,0 +1,133 @@
+"""
+V-School Adaptive Rate Limiter
+──────────────────────────────
+Token buckets for the Gemini quota, shared by all threads of a process:
+  requests/min  (GEMINI_RPM)   one unit per call
+  tokens/min    (GEMINI_TPM)   estimated prompt + output tokens per call
+`acquire()` blocks until both buckets allow the call. On a 429 /
+RESOURCE_EXHAUSTED response, `backoff()` pauses every caller (exponential,
+jittered, or the server's retryDelay) and halves the refill rate; each
+success restores 10% of it, so throughput settles just under the real quota.
+
+Config (env):
+  GEMINI_RPM   requests per minute (default: 60)
+  GEMINI_TPM   tokens per minute   (default: 1000000)
+"""
+
+import os
+import re
+import time
+import random
+import threading
+
+GEMINI_RPM = float(os.getenv('GEMINI_RPM', '60'))
+GEMINI_TPM = float(os.getenv('GEMINI_TPM', '1000000'))
+BACKOFF_BASE = 2.0     # seconds, doubled per consecutive rate-limit error
+BACKOFF_MAX = 120.0
+MIN_SCALE = 0.1        # adaptive rate never drops below 10% of the configured quota
+RECOVERY_STEP = 0.1
+
+_RETRY_DELAY = re.compile(r'retry[_ ]?delay\W+(\d+(?:\.\d+)?)s', re.IGNORECASE)
+_RATE_LIMITED = re.compile(r'(?<![\w.:-])429(?![\w:-]|\.\d)|RESOURCE_EXHAUSTED|rate limit', re.IGNORECASE)
+
+
+def is_rate_limit_error(error):
+    """Exception with a 429 status, or an error text naming one (not any id or count containing 429)."""
+    if getattr(error, 'code', None) == 429 or getattr(error, 'status_code', None) == 429:
+        return True
+    return bool(_RATE_LIMITED.search(str(error)))
+
+
+def retry_after(error):
+    """Server-suggested delay in seconds (Gemini 'retryDelay': '17s'), or None."""
+    match = _RETRY_DELAY.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+class TokenBucket:
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now, scale=1.0):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate * scale)
+        self.updated = now
+
+    def wait_time(self, amount, scale=1.0):
+        return max(0.0, (amount - self.level) / (self.rate * scale))
+
+
+class RateLimiter:
+    def __init__(self, rpm=GEMINI_RPM, tpm=GEMINI_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.scale = 1.0
+        self.blocked_until = 0.0
+        self._failures = 0
+        self._cond = threading.Condition()
+        self.stats = {"calls": 0, "waited_seconds": 0.0, "rate_limited": 0}
+
+    def acquire(self, tokens=0):
+        """Block until one request + `tokens` fit in the buckets; returns seconds waited."""
+        tokens = min(tokens, self.tokens.capacity)
+        start = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self.requests.refill(now, self.scale)
+                self.tokens.refill(now, self.scale)
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                else:
+                    wait = max(self.requests.wait_time(1, self.scale), self.tokens.wait_time(tokens, self.scale))
+                    if wait <= 0:
+                        self.requests.level -= 1
+                        self.tokens.level -= tokens
+                        waited = now - start
+                        self.stats["calls"] += 1
+                        self.stats["waited_seconds"] += waited
+                        return waited
+                self._cond.wait(wait)
+
+    def backoff(self, error=None):
+        """Rate-limit response: pause all callers and slow the refill rate."""
+        with self._cond:
+            self._failures += 1
+            delay = retry_after(error) if error is not None else None
+            if delay is None:
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self._failures - 1)) * (1 + random.random() * 0.25)
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            self.scale = max(MIN_SCALE, self.scale * 0.5)
+            self.stats["rate_limited"] += 1
+            print(f"[RateLimit] Backing off {delay:.1f}s (rate at {self.scale:.0%} of quota)")
+            return delay
+
+    def success(self):
+        with self._cond:
+            self._failures = 0
+            self.scale = min(1.0, self.scale + RECOVERY_STEP)
+            self._cond.notify_all()
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_limiter():
+    """Process-wide Gemini limiter."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter()
+    return _limiter
+
+
+if __name__ == "__main__":
+    limiter = RateLimiter(rpm=120, tpm=60000)
+    start = time.monotonic()
+    for i in range(130):
+        limiter.acquire(tokens=400)
+    print(f"130 calls @ 120 rpm / 400 tokens each: {time.monotonic() - start:.1f}s", limiter.stats)
+    print(retry_after('429 RESOURCE_EXHAUSTED {"retryDelay": "17s"}'))
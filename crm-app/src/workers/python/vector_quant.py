@@ -0,0 +1,117 @@
+"""
+V-School Quantized Vector Matrix
+────────────────────────────────
+Compact in-memory copy of the knowledge matrix for candidate scoring:
+  int8     per-vector scale (max |x| / 127)   -> 1/4 of float32
+  float16  plain half precision               -> 1/2 of float32
+Candidates are scored on the quantized copy; the caller re-ranks the top
+few exactly against the memory-mapped float32 rows (kb_store.py), so only
+those rows are ever paged in.
+
+  python vector_quant.py   # memory + recall@k + latency vs the float32 scan
+"""
+
+import os
+import time
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+KINDS = ('int8', 'float16')
+CHUNK_ROWS = 4096  # rows de-quantized per step (bounds temporary float32 memory)
+
+
+class QuantizedMatrix:
+    def __init__(self, kind, codes, scales=None):
+        self.kind = kind
+        self.codes = codes
+        self.scales = scales
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    @classmethod
+    def from_matrix(cls, matrix, kind):
+        """Quantize (e.g. a float32 memmap) chunk by chunk, never holding a full float32 copy."""
+        if kind not in KINDS:
+            raise ValueError(f"unknown quantization '{kind}' (expected one of {KINDS})")
+        count, dim = matrix.shape
+        if kind == 'float16':
+            codes = np.empty((count, dim), dtype=np.float16)
+            for start in range(0, count, CHUNK_ROWS):
+                codes[start:start + CHUNK_ROWS] = matrix[start:start + CHUNK_ROWS]
+            return cls(kind, codes)
+
+        codes = np.empty((count, dim), dtype=np.int8)
+        scales = np.empty(count, dtype=np.float32)
+        for start in range(0, count, CHUNK_ROWS):
+            block = np.asarray(matrix[start:start + CHUNK_ROWS], dtype=np.float32)
+            scale = np.abs(block).max(axis=1) / 127.0
+            scale[scale == 0] = 1.0
+            codes[start:start + CHUNK_ROWS] = np.clip(np.rint(block / scale[:, None]), -127, 127)
+            scales[start:start + CHUNK_ROWS] = scale
+        return cls(kind, codes, scales)
+
+    def scores(self, q):
+        """Approximate dot products of every row with `q` (float32 vector)."""
+        out = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), CHUNK_ROWS):
+            out[start:start + CHUNK_ROWS] = self.codes[start:start + CHUNK_ROWS].astype(np.float32) @ q
+        if self.scales is not None:
+            out *= self.scales
+        return out
+
+
+def top_k(scores, k):
+    k = min(k, len(scores))
+    if k <= 0: return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    return top[np.argsort(-scores[top])]
+
+
+def search_reranked(quantized, matrix, q, k, rerank=None):
+    """
+    Top-k rows as [(score, row)]: quantized scoring picks `rerank` candidates
+    (default 4*k), exact float32 dot products order the final k.
+    """
+    candidates = top_k(quantized.scores(q), rerank or 4 * k)
+    if not len(candidates): return []
+    candidates = np.sort(candidates)  # sequential reads from the memmap
+    exact = np.asarray(matrix[candidates], dtype=np.float32) @ q
+    return [(float(exact[i]), int(candidates[i])) for i in top_k(exact, k)]
+
+
+def benchmark(count=50_000, dim=768, k=10, queries=100, seed=7):
+    """Memory saved and recall@k retained vs the float32 scan, on synthetic clustered vectors."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((200, dim)).astype(np.float32)
+    matrix = centers[rng.integers(0, 200, count)] + 0.7 * rng.standard_normal((count, dim)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    qs = matrix[rng.choice(count, queries, replace=False)] + 0.2 * rng.standard_normal((queries, dim)).astype(np.float32)
+    qs /= np.linalg.norm(qs, axis=1, keepdims=True)
+
+    t = time.perf_counter()
+    exact = [set(top_k(matrix @ q, k).tolist()) for q in qs]
+    base_ms = (time.perf_counter() - t) * 1000 / queries
+    print(f"float32   {matrix.nbytes / 1e6:8.1f} MB   recall@{k}=1.000   {base_ms:.2f} ms/query")
+
+    for kind in KINDS:
+        quantized = QuantizedMatrix.from_matrix(matrix, kind)
+        raw = sum(len(exact[i] & set(top_k(quantized.scores(q), k).tolist())) for i, q in enumerate(qs))
+        t = time.perf_counter()
+        hits = [{row for _, row in search_reranked(quantized, matrix, q, k)} for q in qs]
+        ms = (time.perf_counter() - t) * 1000 / queries
+        reranked = sum(len(exact[i] & hits[i]) for i in range(queries))
+        print(f"{kind:<8}  {quantized.nbytes / 1e6:8.1f} MB   recall@{k}={reranked / (k * queries):.3f} "
+              f"(no rerank {raw / (k * queries):.3f})   {ms:.2f} ms/query")
+
+
+if __name__ == "__main__":
+    benchmark(count=int(os.getenv('BENCH_COUNT', '50000')), dim=int(os.getenv('BENCH_DIM', '768')))